@@ -0,0 +1,143 @@
+# Sizes batches of POD downloads to what the portal can handle: batches grow while downloads
+# succeed, and a batch that fails is split in half until the documents causing the failure
+# are found.
+
+import time
+from typing import Callable
+
+class AdaptiveBatcher:
+    """
+    A class that works through a list of items in batches with a function that returns
+    whether a batch succeeded. After a success the batch size grows. A failed batch is
+    split in two and both halves are tried again, so one bad document only holds back the
+    batch it is in. If both halves fail too, the failure isn't down to one document, so they
+    aren't split further but retried whole. A single item or batch that keeps failing is
+    retried with a growing backoff until it runs out of retries, and is then given up on.
+    After too many failed batches in a row, the rest of the items are given up on at once.
+    The size is kept between runs, so later pages start at the size that worked before.
+    It has the following attributes:
+      - size: the size of the next batch
+      - min_size, max_size: the bounds of the batch size
+      - growth: how much the size is multiplied by after a success
+      - max_retries: how many times a single failing item, or a batch whose halves both
+                     failed, is retried
+      - max_consecutive_failures: how many batches can fail in a row before the rest of
+                                  the items are given up on
+      - backoff: how many seconds to wait before the first retry of a failure
+      - backoff_factor: how much the wait grows with each retry
+      - succeeded: every item that was downloaded
+      - failed: every item that was given up on
+      - batches: how many batches have been tried
+      - failures: how many batches have failed
+      - elapsed: how many seconds have been spent in run
+    """
+
+    def __init__(self, initial_size:int = 25, min_size:int = 1, max_size:int = 200,
+                 growth:float = 2, max_retries:int = 3, backoff:float = 5,
+                 backoff_factor:float = 2, max_consecutive_failures:int = 6):
+        self.size = initial_size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.growth = growth
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_factor = backoff_factor
+        self.max_consecutive_failures = max_consecutive_failures
+        self.succeeded = []
+        self.failed = []
+        self.batches = 0
+        self.failures = 0
+        self.elapsed = 0.0
+
+    def run(self, items:list, process_batch:Callable[[list], bool]) -> list:
+        """
+        This method works through items in adaptive batches and returns the items that were
+        given up on.
+
+        Parameters:
+          - items: the items to process, e.g. the names of POD checkboxes on a page
+          - process_batch: a function that processes a batch and returns whether it succeeded
+        """
+
+        start = time.monotonic()
+        failed = []
+        consecutive_failures = 0
+
+        # Each pending entry is a batch of items, how many times it has failed, the split it
+        # is a half of (or None), and whether it already failed and only waits on its other half
+        pending = [(list(items), 0, None, False)]
+        while pending:
+            batch, attempts, split, already_failed = pending.pop(0)
+
+            if not already_failed:
+                if len(batch) > self.size:
+                    # Only taking what the current size allows and leaving the rest for later
+                    pending.insert(0, (batch[self.size:], attempts, None, False))
+                    batch = batch[:self.size]
+
+                self.batches += 1
+                if split is not None:
+                    split['untried'] -= 1
+                if process_batch(batch):
+                    self.succeeded.extend(batch)
+                    self.size = min(self.max_size, max(self.size + 1, int(self.size * self.growth)))
+                    consecutive_failures = 0
+                    continue
+
+                self.failures += 1
+                consecutive_failures += 1
+                if split is not None:
+                    split['failed'] += 1
+
+                if consecutive_failures >= self.max_consecutive_failures:
+                    # Everything is failing, e.g. the portal is down, so the rest is given up on
+                    # instead of being retried one document at a time
+                    remaining = batch + [item for entry in pending for item in entry[0]]
+                    print(f'Giving up on the last {len(remaining)} items after '
+                          f'{consecutive_failures} failed batches in a row.')
+                    failed.extend(remaining)
+                    break
+
+                time.sleep(self.backoff * self.backoff_factor ** attempts)
+
+                if split is not None and split['untried']:
+                    # Trying the other half before splitting this one, to tell a bad document
+                    # apart from a failure that hits every batch
+                    sibling = next(i for i, entry in enumerate(pending) if entry[2] is split)
+                    pending.insert(sibling + 1, (batch, attempts, split, True))
+                    continue
+
+            both_halves_failed = split is not None and split['failed'] == 2
+            if len(batch) > 1 and not both_halves_failed:
+                # Splitting the batch to narrow down which documents are causing the failure
+                half = len(batch) // 2
+                self.size = max(self.min_size, len(batch) - half)
+                halves = {'untried': 2, 'failed': 0}
+                pending[0:0] = [(batch[:half], attempts, halves, False),
+                                (batch[half:], attempts, halves, False)]
+            elif attempts + 1 < self.max_retries:
+                # A single document, or a batch whose halves both failed, is tried again whole
+                pending.insert(0, (batch, attempts + 1, None, False))
+            else:
+                print(f'Giving up on {len(batch)} items after {self.max_retries} tries.')
+                failed.extend(batch)
+
+        self.failed.extend(failed)
+        self.elapsed += time.monotonic() - start
+        return failed
+
+    def items_per_minute(self) -> float:
+        """
+        This method returns how many items have been processed per minute spent in run.
+        """
+
+        return len(self.succeeded) / (self.elapsed / 60) if self.elapsed else 0.0
+
+    def report(self) -> str:
+        """
+        This method returns a summary of the batcher's work so far.
+        """
+
+        return (f'{len(self.succeeded)} PODs downloaded in {self.batches} batches '
+                f'({self.failures} failed, {len(self.failed)} PODs given up on) at '
+                f'{self.items_per_minute():.1f} PODs/minute. Next batch size: {self.size}.')
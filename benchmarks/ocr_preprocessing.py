@@ -0,0 +1,141 @@
+# Benchmark of the OCR preprocessing settings in ocr.py against rendered sample screens.
+#
+# Run from the root of the project with:
+#     python -m benchmarks.ocr_preprocessing [--tesseract-cmd PATH] [--repeat N]
+
+import argparse
+import time
+import PIL.Image
+import PIL.ImageDraw
+import PIL.ImageFont
+import pytesseract
+import pandas as pd
+from typing import Optional
+from ocr import Preprocessor, parse_ocr_data
+
+# Words that the Selector waits for in the Order Entry app, plus some product codes
+# like the ones in the Item grid.
+SAMPLE_WORDS = [
+    'Warning', 'Physician', 'Whole', 'Additional', 'Item', 'Date', 'Span',
+    'Cancel', 'Yes', 'Address', 'Apps', 'Keep', 'RES', '37296', 'FPHC482', 'A7035'
+]
+
+# The text sizes, in screen pixels, that the sample screens are rendered at
+TEXT_HEIGHTS = [9, 11, 14, 20, 28]
+
+# Each setting is a Preprocessor and whether it is told the height of the text on the
+# screen (the adaptive settings), like the Eye would be when looking for a known label.
+SETTINGS = {
+    'fixed 2x (old default)': (Preprocessor(), False),
+    'native 1x': (Preprocessor(default_scale=1), False),
+    'grayscale 2x': (Preprocessor(grayscale=True), False),
+    'grayscale + otsu 2x': (Preprocessor(threshold='otsu'), False),
+    'adaptive': (Preprocessor(), True),
+    'grayscale + adaptive': (Preprocessor(grayscale=True), True),
+    'grayscale + otsu + adaptive': (Preprocessor(threshold='otsu'), True),
+}
+
+def get_font(text_height:int) -> "PIL.ImageFont.FreeTypeFont":
+    """
+    This function loads a font whose capital letters are about text_height pixels tall,
+    falling back to Pillow's built in font if DejaVu Sans isn't installed.
+
+    Parameters:
+        - text_height: the height of the text in pixels
+    """
+
+    try:
+        return PIL.ImageFont.truetype('DejaVuSans.ttf', round(text_height * 1.4))
+    except OSError:
+        return PIL.ImageFont.load_default(round(text_height * 1.4))
+
+def render_screen(text_height:int, size:tuple = (1280, 720)) -> "PIL.Image.Image":
+    """
+    This function renders a sample screen in the style of the Order Entry app: dark
+    text on a light gray background, with one blue highlighted row.
+
+    Parameters:
+        - text_height: the height of the text in pixels
+        - size: the (width, height) of the screen
+    """
+
+    screen = PIL.Image.new('RGB', size, (240, 240, 240))
+    draw = PIL.ImageDraw.Draw(screen)
+    font = get_font(text_height)
+    line_height = round(text_height * 2.5)
+
+    x, y = 20, 20
+    for i, word in enumerate(SAMPLE_WORDS):
+        word_width = draw.textlength(word, font=font)
+        if x + word_width > size[0] - 20:
+            x = 20
+            y += line_height
+        if i == 4:
+            draw.rectangle((0, y - 4, size[0], y + line_height - 8), fill=(51, 153, 255))
+        draw.text((x, y), word, fill=(0, 0, 0), font=font)
+        x += word_width + 3 * text_height
+    return screen
+
+def run_setting(preprocessor:"Preprocessor", screen:"PIL.Image.Image", 
+                text_height:Optional[int]) -> tuple:
+    """
+    This function preprocesses and OCRs one screen and returns the fraction of sample
+    words that were read exactly, the seconds taken and the number of pixels OCR'd.
+
+    Parameters:
+        - preprocessor: the Preprocessor being measured
+        - screen: the rendered sample screen
+        - text_height: the height of the text on the screen in pixels, or None if the
+                       Preprocessor shouldn't be told
+    """
+
+    start = time.perf_counter()
+    image, _ = preprocessor.process(screen, text_height)
+    data = parse_ocr_data(pytesseract.image_to_data(image))
+    elapsed = time.perf_counter() - start
+
+    seen = set(data['text'].dropna().astype(str))
+    accuracy = sum(word in seen for word in SAMPLE_WORDS) / len(SAMPLE_WORDS)
+    return accuracy, elapsed, image.size[0] * image.size[1]
+
+def main() -> None:
+    """
+    This function runs every setting over every sample screen and prints a table of
+    accuracy and latency per setting and text height.
+    """
+
+    parser = argparse.ArgumentParser(description='Benchmark OCR preprocessing settings.')
+    parser.add_argument('--tesseract-cmd', default=None, help='path to the tesseract executable')
+    parser.add_argument('--repeat', type=int, default=3, help='how many times to OCR each screen')
+    args = parser.parse_args()
+
+    if args.tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = args.tesseract_cmd
+
+    screens = {text_height: render_screen(text_height) for text_height in TEXT_HEIGHTS}
+
+    results = []
+    for name, (preprocessor, adaptive) in SETTINGS.items():
+        for text_height, screen in screens.items():
+            for _ in range(args.repeat):
+                accuracy, elapsed, pixels = run_setting(preprocessor, screen, 
+                                                        text_height if adaptive else None)
+                results.append({
+                    'setting': name,
+                    'text height': text_height,
+                    'accuracy': accuracy,
+                    'latency (ms)': elapsed * 1000,
+                    'megapixels': pixels / 1e6
+                })
+
+    results = pd.DataFrame(results)
+    by_height = results.groupby(['setting', 'text height'], sort=False).mean()
+    overall = results.groupby('setting', sort=False)[['accuracy', 'latency (ms)', 'megapixels']].mean()
+
+    pd.set_option('display.width', 120)
+    print(by_height.round(3).to_string())
+    print()
+    print(overall.round(3).to_string())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# A stand-in for the POD search and download endpoints, for trying out pod_http.py without
+# the vendor's website. Run it from the root of the project with:
+#     python -m benchmarks.pod_server [--pods-per-day N] [--bad N] [--workers N]
+#
+# It starts the server, downloads every POD in a date range with a PodHttpClient, and
+# checks that every good POD ended up in a zip and every bad one was reported.
+
+import argparse
+import io
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+import constants
+from pod_http import PodHttpClient
+
+SESSION_COOKIE = 'ASP.NET_SessionId=stand-in-session'
+
+class PodPortal:
+    """
+    The stand-in portal's documents: pods_per_day PODs for every day, named like the
+    checkboxes on the real search page, some of which always fail to download.
+    """
+
+    def __init__(self, pods_per_day:int, bad_pods:set, latency:float):
+        self.pods_per_day = pods_per_day
+        self.bad_pods = bad_pods
+        self.latency = latency
+
+    def search(self, start:"date", end:"date") -> list[str]:
+        days = (end - start).days + 1
+        return [
+            f'chk_{(start + timedelta(days=day)).strftime("%Y%m%d")}_{i:03d}'
+            for day in range(days) for i in range(self.pods_per_day)
+        ]
+
+def make_handler(portal:"PodPortal") -> type:
+    """
+    This function makes a request handler class that serves the portal.
+    """
+
+    class PodRequestHandler(BaseHTTPRequestHandler):
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def send_page(self, status:int, body:bytes, content_type:str = 'text/html', headers:dict = {}) -> None:
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self) -> None:
+            time.sleep(portal.latency)
+            if SESSION_COOKIE not in self.headers.get('Cookie', ''):
+                self.send_page(302, b'', headers={'Location': '/login'})
+                return
+
+            length = int(self.headers.get('Content-Length', 0))
+            fields = parse_qsl(self.rfile.read(length).decode())
+
+            if self.path == '/search':
+                form = dict(fields)
+                start = datetime.strptime(form['txtStartDate'], '%m/%d/%Y').date()
+                end = datetime.strptime(form['txtEndDate'], '%m/%d/%Y').date()
+                rows = ''.join(
+                    f'<tr><td><input type="checkbox" name="{name}"></td><td>{name}</td></tr>'
+                    for name in portal.search(start, end)
+                )
+                page = f'<table id="podResults"><tr><th><input type="checkbox" name="chkAll"></th></tr>{rows}</table>'
+                self.send_page(200, page.encode())
+
+            elif self.path == '/download':
+                names = [name for name, _ in fields]
+                if portal.bad_pods & set(names):
+                    page = f'<html><body>{constants.POD_ERROR_MESSAGES[0]} could not be found.</body></html>'
+                    self.send_page(200, page.encode())
+                    return
+
+                buffer = io.BytesIO()
+                with zipfile.ZipFile(buffer, 'w') as zip_file:
+                    for name in names:
+                        zip_file.writestr(f'{name}.pdf', b'%PDF-1.4 stand-in POD ' + name.encode())
+                self.send_page(200, buffer.getvalue(), 'application/zip',
+                               {'Content-Disposition': 'attachment; filename="PODs.zip"'})
+
+            else:
+                self.send_page(404, b'Not found')
+
+    return PodRequestHandler
+
+def main() -> None:
+    """
+    This function starts the stand-in portal, downloads a week of PODs from it and checks
+    the results.
+    """
+
+    parser = argparse.ArgumentParser(description='Download PODs from a stand-in portal with PodHttpClient.')
+    parser.add_argument('--pods-per-day', type=int, default=40, help='how many PODs the portal has for each day')
+    parser.add_argument('--days', type=int, default=7, help='how many days to search')
+    parser.add_argument('--bad', type=int, default=3, help='how many PODs always fail to download')
+    parser.add_argument('--workers', type=int, default=4, help='how many downloads to run at once')
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds the portal takes per request')
+    args = parser.parse_args()
+
+    start, end = date.today() - timedelta(days=args.days - 1), date.today()
+    all_pods = PodPortal(args.pods_per_day, set(), 0).search(start, end)
+    bad_pods = set(all_pods[len(all_pods) // (args.bad + 1)::len(all_pods) // (args.bad + 1)][:args.bad]) if args.bad else set()
+    portal = PodPortal(args.pods_per_day, bad_pods, args.latency)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(portal))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    name, value = SESSION_COOKIE.split('=')
+    client = PodHttpClient({name: value}, f'{base_url}/search', f'{base_url}/download',
+                           max_workers=args.workers)
+
+    with tempfile.TemporaryDirectory() as folder:
+        found = client.search(start, end)
+        print(f'The search found {len(found)} PODs.')
+        paths, failed = client.download_all(found, folder, backoff=0.1)
+
+        downloaded = set()
+        for path in paths:
+            with zipfile.ZipFile(path) as zip_file:
+                downloaded.update(os.path.splitext(name)[0] for name in zip_file.namelist())
+
+        expected = set(found) - bad_pods
+        print(f'{len(downloaded)} of {len(expected)} good PODs were downloaded in {len(paths)} zips.')
+        print(f'Reported as failed: {sorted(failed)} (expected {sorted(bad_pods)})')
+        print('OK' if downloaded == expected and set(failed) == bad_pods else 'MISMATCH')
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# Replays a Selector flight recording through the Eye, to compare OCR settings on the exact
+# screens a real run saw. The screen comes from a ReplayCapture set as the default capture,
+# so the Eye grabs the same frames in the same order on every run of the benchmark.
+#
+# Run from the root of the project with:
+#     python -m benchmarks.replay_ocr "Flight Recording 2024-01-01 12-00-00" [--tesseract-cmd PATH]
+
+import argparse
+import time
+import pytesseract
+from capture import ReplayCapture, set_default_capture
+from recorder import load_recording, get_words
+from selection import Eye
+from benchmarks.ocr_preprocessing import SETTINGS
+
+def main() -> None:
+    """
+    This function OCRs every recorded grab with each preprocessing setting and prints how
+    long it took and how many of the words read at the time were read again.
+    """
+
+    parser = argparse.ArgumentParser(description='Replay a flight recording through the Eye with each OCR setting.')
+    parser.add_argument('folder', help='the folder the recording was flushed to')
+    parser.add_argument('--tesseract-cmd', default=None, help='path to the tesseract executable')
+    args = parser.parse_args()
+
+    events = load_recording(args.folder)
+    replay = ReplayCapture.from_recording(events, timed=False)
+    set_default_capture(replay)
+
+    # Pairing each recorded grab with the words that were read from it at the time
+    grabs = []
+    for event in events:
+        if event['kind'] == 'frame' and 'image' in event:
+            grabs.append((event, None))
+        elif event['kind'] == 'ocr' and 'data' in event and grabs and grabs[-1][1] is None:
+            grabs[-1] = (grabs[-1][0], set(get_words(event['data'])))
+    print(f'Replaying {len(grabs)} grabs from {args.folder}.')
+
+    print(f"{'setting':<30} {'ms/grab':>8} {'words read again':>17}")
+    for name, (preprocessor, _) in SETTINGS.items():
+        eye = Eye(preprocessor=preprocessor)
+        if args.tesseract_cmd:
+            pytesseract.pytesseract.tesseract_cmd = args.tesseract_cmd
+
+        replay.rewind()
+        matched = total = 0
+        start = time.perf_counter()
+        for i, (event, recorded_words) in enumerate(grabs):
+            if i:
+                replay.advance()
+            x, y = event['origin']
+            eye.get_screen_grab_data((x, y, event['image'].width, event['image'].height))
+            if recorded_words:
+                matched += len(recorded_words & set(get_words(eye.data)))
+                total += len(recorded_words)
+        elapsed = time.perf_counter() - start
+
+        agreement = f'{matched}/{total}' if total else 'n/a'
+        print(f'{name:<30} {1000 * elapsed / max(1, len(grabs)):>8.0f} {agreement:>17}')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# End to end benchmark of the Selector against the Order Entry simulator on a virtual display.
+#
+# Run from the root of the project on Linux (needs Xvfb, xdotool and tesseract) with:
+#     python -m benchmarks.selector_e2e [--orders N] [--latency SECONDS]
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import pandas as pd
+from workers import VirtualDisplay
+from capture import FRAMEBUFFER_ENV_VAR
+
+PRODUCT_CODES = ['RES 37296', 'RES 39102', 'FPHC482', 'FPX HC431A', 'REPR15', 'HCS A7035', 'HCS HEADGEAR']
+
+def make_orders(count:int, seed:int = 0) -> dict:
+    """
+    This function makes up some orders, each with a few line items.
+
+    Parameters:
+        - count: how many orders to make
+        - seed: the random seed, so runs can be compared
+    """
+
+    rng = random.Random(seed)
+    return {
+        str(100000 + i): rng.sample(PRODUCT_CODES, rng.randint(1, 4))
+        for i in range(count)
+    }
+
+def main() -> None:
+    """
+    This function starts a virtual display and the simulator, then drives the simulator
+    with a Selector like run_selection_script does and reports orders/minute.
+    """
+
+    parser = argparse.ArgumentParser(description='Benchmark the Selector against the Order Entry simulator.')
+    parser.add_argument('--orders', type=int, default=10, help='how many orders to open and close')
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds before each simulated dialog responds')
+    parser.add_argument('--jitter', type=float, default=0.2, help='most extra random seconds per response')
+    parser.add_argument('--already-selected', type=float, default=0.2, help='fraction of orders that show the Warning popup')
+    parser.add_argument('--display', type=int, default=99, help='the X display number to use')
+    parser.add_argument('--tesseract-cmd', default='tesseract', help='path to the tesseract executable')
+    parser.add_argument('--pyautogui-capture', action='store_true',
+                        help='grab the screen with pyautogui instead of reading the Xvfb framebuffer')
+    args = parser.parse_args()
+
+    orders = make_orders(args.orders)
+    already_selected = [order for order in orders if random.Random(order).random() < args.already_selected]
+    workdir = tempfile.mkdtemp(prefix='selector_e2e_')
+    orders_path = os.path.join(workdir, 'orders.json')
+    with open(orders_path, 'w') as orders_file:
+        json.dump(orders, orders_file)
+
+    with VirtualDisplay(args.display) as display:
+        # pyautogui connects to the display when it is imported
+        os.environ['DISPLAY'] = display.name
+        if not args.pyautogui_capture:
+            os.environ[FRAMEBUFFER_ENV_VAR] = display.framebuffer_path
+        import pytesseract
+        from selection import Selector
+        from matching import TemplateMatcher
+
+        simulator = subprocess.Popen([
+            sys.executable, 'order_entry_simulator.py',
+            '--orders', orders_path,
+            '--already-selected', ','.join(already_selected),
+            '--latency', str(args.latency),
+            '--jitter', str(args.jitter),
+            '--assets', workdir
+        ])
+
+        try:
+            selector = Selector()
+            pytesseract.pytesseract.tesseract_cmd = args.tesseract_cmd
+
+            # The simulator's buttons are drawn from these images, so they stand in for
+            # the reference images of the real app
+            selector.matcher = TemplateMatcher({
+                'CANCEL_BTN': os.path.join(workdir, 'cancel_btn.png'),
+                'YES_BTN': os.path.join(workdir, 'yes_btn.png')
+            }, capture=selector.capture)
+
+            start = time.monotonic()
+            selector.wait_for_window(".*Order Entry.*", timeout=30)
+            selector.set_selection_mode()
+            startup = time.monotonic() - start
+
+            order_times = []
+            for order_number, product_codes in orders.items():
+                order_start = time.monotonic()
+                line_items = pd.DataFrame({'Product Code': sorted(product_codes)})
+                selector.get_order_line_items(order_number, line_items)
+                selector.close_order()
+                order_times.append(time.monotonic() - order_start)
+                print(f'Order {order_number} took {order_times[-1]:.1f} seconds.')
+        finally:
+            simulator.terminate()
+            simulator.wait()
+
+    total_minutes = sum(order_times) / 60
+    print()
+    print(f'Start up to selection mode: {startup:.1f} seconds')
+    print(f'Orders: {len(order_times)}, simulated latency {args.latency}s (+ up to {args.jitter}s)')
+    print(f'Seconds per order: mean {pd.Series(order_times).mean():.1f}, '
+          f'median {pd.Series(order_times).median():.1f}, max {max(order_times):.1f}')
+    print(f'Throughput: {len(order_times) / total_minutes:.2f} orders/minute')
+    selector.pacer.save(os.path.join(workdir, 'pacing.csv'))
+    selector.metrics.save(os.path.join(workdir, 'metrics.json'))
+
+    print()
+    print('Where the time went (whole run):')
+    timings = selector.metrics.summary()['run']['timings']
+    for action, summary in sorted(timings.items(), key=lambda item: -item[1]['total']):
+        print(f"  {action:<40} n={summary['count']:<5} total {summary['total']:7.1f}s  "
+              f"p50 {summary['p50']:.3f}s  p90 {summary['p90']:.3f}s")
+    print(f'Pacing history and metrics saved to {workdir}')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# Measures how quickly MaildirCodeProvider picks up a two-factor code, with a local Maildir
+# standing in for the mailbox. Run it from the root of the project with:
+#     python -m benchmarks.tfa_mailbox [--delay SECONDS] [--runs N]
+#
+# Each run puts an old code message and some unrelated mail in the Maildir, asks for a code,
+# and delivers the real code message from another thread after the delay. The time from
+# delivery to the code being returned is the provider's latency.
+
+import argparse
+import mailbox
+import os
+import statistics
+import tempfile
+import threading
+import time
+from email.message import EmailMessage
+import constants
+from tfa import MaildirCodeProvider
+
+def make_message(subject:str, body:str, delivered:float) -> "mailbox.MaildirMessage":
+    """
+    This function makes a Maildir message delivered at a given time.
+    """
+
+    email_message = EmailMessage()
+    email_message['Subject'] = subject
+    email_message['From'] = 'no-reply@example.com'
+    email_message.set_content(body)
+    message = mailbox.MaildirMessage(email_message)
+    message.set_date(delivered)
+    return message
+
+def run_once(delay:float) -> float:
+    """
+    This function runs one code request against a fresh Maildir and returns the seconds
+    between the code message being delivered and the provider returning its code.
+    """
+
+    with tempfile.TemporaryDirectory() as temporary_folder:
+        folder = os.path.join(temporary_folder, 'Maildir')
+        maildir = mailbox.Maildir(folder, create=True)
+        requested_at = time.time()
+        maildir.add(make_message(constants.TFA_SUBJECT, 'Your code is 111111.', requested_at - 3600))
+        for number in range(50):
+            maildir.add(make_message(f'Newsletter {number}', 'Nothing to see here, 222222.', requested_at - number))
+
+        delivered_at = []
+
+        def deliver() -> None:
+            time.sleep(delay)
+            delivered_at.append(time.monotonic())
+            maildir.add(make_message(constants.TFA_SUBJECT, 'Your one-time verification code is 654321.', time.time()))
+
+        threading.Thread(target=deliver, daemon=True).start()
+        code = MaildirCodeProvider(folder, clock_skew=0).get_code(requested_at, timeout=delay + 10)
+        returned_at = time.monotonic()
+
+        if code != '654321':
+            raise AssertionError(f'The provider returned {code} instead of the new code.')
+        return returned_at - delivered_at[0]
+
+def main() -> None:
+    """
+    This function runs the benchmark and prints the latencies.
+    """
+
+    parser = argparse.ArgumentParser(description='Measure how quickly a two-factor code is picked up from a Maildir.')
+    parser.add_argument('--delay', type=float, default=1.0, help='seconds before the code message is delivered')
+    parser.add_argument('--runs', type=int, default=5, help='how many code requests to time')
+    args = parser.parse_args()
+
+    latencies = [run_once(args.delay) for _ in range(args.runs)]
+    print(f'Picked up the right code in all {args.runs} runs, ignoring the old code and other mail.')
+    print(f'Latency from delivery: median {statistics.median(latencies) * 1000:.0f} ms, '
+          f'worst {max(latencies) * 1000:.0f} ms.')
+
+if __name__ == "__main__":
+    main()
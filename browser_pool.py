@@ -0,0 +1,260 @@
+# Fetches PODs with several browser windows at once. The portal only allows one login per
+# account, so the extra browsers don't log in themselves: they are given the cookies of the
+# browser that did, and share its session.
+
+import hashlib
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, datetime
+from typing import Callable, Optional
+import pandas as pd
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.remote.webdriver import WebDriver
+from batching import AdaptiveBatcher
+from downloads import DownloadTracker
+from sessions import apply_cookies
+import constants
+from utils import engage_stealth_mode, get_date_ranges, search_PODs, get_PODs_from_page, close_POD_tabs
+
+class BrowserPool:
+    """
+    A class that keeps a bounded pool of browsers sharing one authenticated session, and
+    fetches POD search results with all of them at once. Each date range is searched by
+    whichever browser is free, and the pages of its results are handed out to the other
+    browsers as soon as the page count is known, so a long backlog of ranges and pages is
+    spread over the whole pool. Each extra browser downloads into its own folder, and the
+    zips are merged into the downloads folder at the end with duplicates left out. It is used
+    as a context manager, which closes the extra browsers:
+
+        with BrowserPool(driver, downloads_folder, size=3) as pool:
+            pool.get_PODs(df)
+
+    It has the following attributes:
+      - driver: the browser that logged in
+      - downloads_folder: the folder the zips end up in
+      - size: the most browsers to use at once, including the one that logged in
+      - driver_factory: the function that starts an extra browser
+      - tracker: the DownloadTracker of the browser that logged in
+      - members: a list of (driver, tracker, download folder) for each browser in the pool
+      - work_folder: the temporary folder holding the extra browsers' download folders
+      - max_attempts: how many times a date range or page is tried before it is given up on
+      - failed: the names of the PODs that couldn't be downloaded, and a (min_date, max_date,
+                page_number) for each page that couldn't be fetched at all (page_number is
+                None if the range couldn't even be searched)
+    """
+
+    def __init__(self, driver:"WebDriver", downloads_folder:str, size:int = constants.POD_BROWSER_SESSIONS,
+                 driver_factory:Callable[[], "WebDriver"] = engage_stealth_mode,
+                 tracker:Optional["DownloadTracker"] = None, max_attempts:int = 3):
+        self.driver = driver
+        self.downloads_folder = downloads_folder
+        self.size = max(1, size)
+        self.driver_factory = driver_factory
+        self.tracker = tracker
+        self.members = []
+        self.work_folder = None
+        self.max_attempts = max_attempts
+        self.failed = []
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> "BrowserPool":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def start(self) -> None:
+        """
+        This method starts the extra browsers and gives them the logged in browser's session.
+        A browser the session can't be cloned into is closed, and the pool goes on without it.
+        """
+
+        self.members = [(self.driver, self.tracker, self.downloads_folder)]
+        self.work_folder = tempfile.mkdtemp(prefix='POD pool ', dir=self.downloads_folder)
+
+        for number in range(1, self.size):
+            folder = os.path.join(self.work_folder, str(number))
+            os.makedirs(folder)
+            driver = self.driver_factory()
+            if not self.clone_session(driver):
+                print(f"Browser {number} couldn't share the login, continuing without it.")
+                driver.quit()
+                continue
+
+            tracker = DownloadTracker(driver, folder)
+            tracker.enable()
+            self.members.append((driver, tracker, folder))
+
+        print(f'Fetching PODs with {len(self.members)} browsers.')
+
+    def clone_session(self, driver:"WebDriver") -> bool:
+        """
+        This method copies the logged in browser's cookies into another browser and returns
+        whether the other browser can open the POD search page with them.
+
+        Parameters:
+            - driver: the browser to copy the session into
+        """
+
+        return apply_cookies(driver, self.driver.get_cookies())
+
+    def get_PODs(self, df:"pd.DataFrame") -> list[str]:
+        """
+        This method downloads the PODs from every date range of df (see get_date_ranges) with
+        every browser in the pool, merges the zips into the downloads folder, and returns the
+        paths of the zips that were added.
+
+        Parameters:
+            - df: the DataFrame being used to calculate the relevant date ranges
+        """
+
+        # Each work item is a date range, a page of its results (or None for "search the range
+        # and hand out its pages") and how many times the item has failed
+        work = queue.Queue()
+        for min_date, max_date in get_date_ranges(df):
+            work.put((min_date, max_date, None, 0))
+
+        start = time.monotonic()
+        threads = [
+            threading.Thread(target=self.run_member, args=(member, work), daemon=True)
+            for member in self.members
+        ]
+        for thread in threads:
+            thread.start()
+        work.join()
+        for _ in threads:
+            work.put(None)
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+
+        added = self.merge_downloads()
+        print(f'Fetched {len(added)} new zips with {len(self.members)} browsers in {elapsed:.1f} seconds.')
+        if self.failed:
+            print(f"These PODs couldn't be downloaded: {', '.join(map(str, self.failed))}")
+        return added
+
+    def run_member(self, member:tuple, work:"queue.Queue") -> None:
+        """
+        This method works through the queue of date ranges and pages with one browser until
+        get_PODs puts None on the queue. A browser keeps the results of the last range it
+        searched, so it only searches again when it gets a page of a different range.
+
+        Parameters:
+            - member: the (driver, tracker, download folder) of the browser
+            - work: the queue of work items
+        """
+
+        driver, tracker, _ = member
+        batcher = AdaptiveBatcher()
+        searched = None
+
+        while (item := work.get()) is not None:
+            min_date, max_date, page_number, attempts = item
+            try:
+                if searched != (min_date, max_date) or page_number is None:
+                    page_list = search_PODs(driver, min_date, max_date)
+                    searched = (min_date, max_date)
+                    if page_number is None:
+                        # Doing the first page here and leaving the rest to whichever browser is free
+                        page_number = page_list[0]
+                        for other_page in page_list[1:]:
+                            work.put((min_date, max_date, other_page, 0))
+
+                get_PODs_from_page(driver, page_number, batcher, tracker)
+                close_POD_tabs(driver)
+            except Exception as e:
+                print(f'Fetching {min_date} to {max_date} (page {page_number}) failed: {e!r}')
+                searched = None
+                if attempts + 1 < self.max_attempts:
+                    # Putting the page back so it can be tried again, maybe by another browser.
+                    # A range whose first page was already handed out is retried as that page.
+                    work.put((min_date, max_date, page_number, attempts + 1))
+                else:
+                    with self.lock:
+                        self.failed.append((min_date, max_date, page_number))
+            finally:
+                work.task_done()
+
+        with self.lock:
+            self.failed.extend(batcher.failed)
+
+    def merge_downloads(self) -> list[str]:
+        """
+        This method moves the zips the extra browsers downloaded into the downloads folder,
+        leaving out any zip with the same contents as one already there from today, and
+        returns the paths of the zips that were moved.
+        """
+
+        seen = {file_hash(path) for path in get_todays_zips(self.downloads_folder)}
+        added = []
+
+        for _, _, folder in self.members[1:]:
+            for path in get_todays_zips(folder):
+                digest = file_hash(path)
+                if digest in seen:
+                    os.remove(path)
+                    continue
+                seen.add(digest)
+
+                name, extension = os.path.splitext(os.path.basename(path))
+                destination = os.path.join(self.downloads_folder, name + extension)
+                copy_number = 1
+                while os.path.exists(destination):
+                    destination = os.path.join(self.downloads_folder, f'{name} ({copy_number}){extension}')
+                    copy_number += 1
+                shutil.move(path, destination)
+                added.append(destination)
+
+        return added
+
+    def close(self) -> None:
+        """
+        This method closes the extra browsers and deletes their download folders. The
+        browser that logged in is left open.
+        """
+
+        for driver, _, _ in self.members[1:]:
+            try:
+                driver.quit()
+            except WebDriverException:
+                pass
+        self.members = self.members[:1]
+
+        if self.work_folder is not None:
+            shutil.rmtree(self.work_folder, ignore_errors=True)
+            self.work_folder = None
+
+def get_todays_zips(folder:str) -> list[str]:
+    """
+    This function returns the paths of the finished .zip files in folder that were made today.
+
+    Parameters:
+        - folder: the folder to look in
+    """
+
+    today = date.today()
+    return [
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if name.endswith('.zip')
+        and datetime.fromtimestamp(os.path.getctime(os.path.join(folder, name))).date() == today
+    ]
+
+def file_hash(path:str) -> str:
+    """
+    This function returns the SHA-256 hash of a file's contents.
+
+    Parameters:
+        - path: the path of the file
+    """
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
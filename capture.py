@@ -0,0 +1,273 @@
+# Backends for grabbing the screen. Everything that looks at the screen (the Eye, the
+# FrameWatcher, the TemplateMatcher, error_page...) grabs through one of these, so the
+# way frames are captured can be swapped without touching the code that reads them.
+
+import bisect
+import glob
+import mmap
+import os
+import struct
+import time
+import numpy as np
+import pyautogui
+import PIL.Image
+from abc import ABC, abstractmethod
+from typing import Callable, Optional
+
+# The environment variable that points at an Xvfb framebuffer file (see VirtualDisplay)
+FRAMEBUFFER_ENV_VAR = 'XVFB_FRAMEBUFFER'
+
+class CaptureBackend(ABC):
+    """
+    The interface every capture backend follows. A backend returns RGB PIL Images of the
+    whole screen or of a region of it, given as an (x, y, width, height) tuple like
+    pyautogui.screenshot takes.
+    """
+
+    @abstractmethod
+    def grab(self, region:Optional[tuple] = None) -> "PIL.Image.Image":
+        """
+        This method returns an RGB image of the region, or of the whole screen if region is None.
+
+        Parameters:
+          - region: the (x, y, width, height) area of the screen to grab
+        """
+
+    @abstractmethod
+    def size(self) -> tuple:
+        """
+        This method returns the (width, height) of the screen.
+        """
+
+class PyAutoGuiCapture(CaptureBackend):
+    """
+    A capture backend that uses pyautogui.screenshot. It works everywhere pyautogui does
+    and is the default.
+    """
+
+    def grab(self, region:Optional[tuple] = None) -> "PIL.Image.Image":
+        return pyautogui.screenshot(region=region)
+
+    def size(self) -> tuple:
+        return tuple(pyautogui.size())
+
+class XvfbFramebufferCapture(CaptureBackend):
+    """
+    A capture backend that reads the screen straight out of an Xvfb framebuffer. When Xvfb
+    is started with -fbdir, it keeps its screen in an XWD file that it memory maps, so
+    mapping the same file gives a live view of the screen without asking the X server for
+    anything. A region grab only copies the rows and columns of that region.
+    It has the following attributes:
+      - path: the path to the framebuffer file, e.g. '/tmp/fb/Xvfb_screen0'
+      - width, height: the size of the screen in pixels
+      - pixels: a (height, bytes_per_line) view of the framebuffer's pixel data
+      - channels: the byte offsets of the red, green and blue values within each pixel
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        with open(path, 'rb') as framebuffer_file:
+            self.buffer = mmap.mmap(framebuffer_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # The XWD header is 25 big-endian 32-bit values, followed by the colormap and then the pixels
+        header = struct.unpack('>25I', self.buffer[:100])
+        header_size, pixmap_depth = header[0], header[3]
+        self.width, self.height = header[4], header[5]
+        byte_order, bits_per_pixel, bytes_per_line = header[7], header[11], header[12]
+        red_mask, green_mask, blue_mask = header[14], header[15], header[16]
+        colormap_entries = header[19]
+
+        if bits_per_pixel != 32:
+            raise ValueError(f'Only 32 bits per pixel framebuffers are supported, {path} has '
+                             f'{bits_per_pixel} (depth {pixmap_depth}).')
+
+        # Working out which byte of each pixel holds each color from the masks
+        def byte_index(mask:int) -> int:
+            index = (mask.bit_length() - 1) // 8
+            return index if byte_order == 0 else 3 - index
+        self.channels = [byte_index(mask) for mask in (red_mask, green_mask, blue_mask)]
+
+        offset = header_size + 12 * colormap_entries
+        self.pixels = np.frombuffer(
+            self.buffer, dtype=np.uint8, count=self.height * bytes_per_line, offset=offset
+        ).reshape(self.height, bytes_per_line)
+
+    def grab(self, region:Optional[tuple] = None) -> "PIL.Image.Image":
+        x, y, width, height = region if region else (0, 0, self.width, self.height)
+
+        # Clamping the region to the screen, since the framebuffer has nothing outside it
+        left, top = max(0, int(x)), max(0, int(y))
+        right = min(self.width, int(x) + int(width))
+        bottom = min(self.height, int(y) + int(height))
+        if right <= left or bottom <= top:
+            raise ValueError(f'The region {region} is outside the {self.width}x{self.height} screen.')
+        x, y, width, height = left, top, right - left, bottom - top
+
+        rows = self.pixels[y:y + height, 4 * x:4 * (x + width)].reshape(height, width, 4)
+        return PIL.Image.fromarray(np.ascontiguousarray(rows[:, :, self.channels]), 'RGB')
+
+    def size(self) -> tuple:
+        return (self.width, self.height)
+
+    def close(self) -> None:
+        """
+        This method unmaps the framebuffer.
+        """
+
+        self.pixels = None
+        self.buffer.close()
+
+class ReplayCapture(CaptureBackend):
+    """
+    A capture backend that plays back recorded frames instead of looking at the screen,
+    so benchmarks and debugging sessions can be repeated exactly. Which frame a grab sees
+    doesn't depend on how often the code grabs: with times, the frame is the one that was
+    on screen at that point of the recording (going by the clock since the replay started),
+    and without them, the frame only changes when advance is called, e.g. once per recorded
+    event. The last frame is repeated once they run out. Grabs are cropped to the region.
+    It has the following attributes:
+      - frames: the list of recorded frames as full screen RGB Images
+      - times: the seconds into the recording each frame appeared at, or None to step
+               through the frames with advance
+      - position: the index of the current frame when stepping with advance
+      - loop: whether to start over from the first frame after the last one
+      - clock: the function the replay's time is read from, e.g. time.monotonic
+      - started: the clock reading the replay started at
+    """
+
+    def __init__(self, frames:list, times:Optional[list[float]] = None, loop:bool = False,
+                 clock:Callable[[], float] = time.monotonic):
+        self.frames = [frame.convert('RGB') for frame in frames]
+        if not self.frames:
+            raise ValueError('ReplayCapture needs at least one frame.')
+        if times is not None and len(times) != len(self.frames):
+            raise ValueError('ReplayCapture needs one time for each frame.')
+        self.times = None if times is None else [time_ - times[0] for time_ in times]
+        self.position = 0
+        self.loop = loop
+        self.clock = clock
+        self.started = clock()
+
+    @classmethod
+    def from_folder(cls, folder:str, pattern:str = '*.png', loop:bool = False) -> "ReplayCapture":
+        """
+        This method loads every image in a folder matching pattern, in name order, to be
+        stepped through with advance.
+
+        Parameters:
+          - folder: the folder the frames were saved to
+          - pattern: the file name pattern of the frames
+          - loop: whether to start over after the last frame
+        """
+
+        paths = sorted(glob.glob(os.path.join(folder, pattern)))
+        frames = []
+        for path in paths:
+            with PIL.Image.open(path) as frame:
+                frames.append(frame.convert('RGB'))
+        return cls(frames, loop=loop)
+
+    @classmethod
+    def from_recording(cls, events:list[dict], screen_size:Optional[tuple] = None,
+                       timed:bool = True) -> "ReplayCapture":
+        """
+        This method rebuilds the screen from the frame events of a flight recording (see
+        recorder.load_recording). Each recorded grab only covers a region, so every frame
+        is the previous one with the new grab pasted where it came from.
+
+        Parameters:
+          - events: the recording's events
+          - screen_size: the (width, height) of the screen (defaults to what the grabs cover)
+          - timed: whether to play the frames back at the times they were recorded, rather
+                   than stepping through them with advance
+        """
+
+        grabs = [event for event in events if event['kind'] == 'frame' and 'image' in event]
+        if not grabs:
+            raise ValueError('The recording has no frames.')
+        if screen_size is None:
+            screen_size = (
+                max(event['origin'][0] + event['image'].width for event in grabs),
+                max(event['origin'][1] + event['image'].height for event in grabs)
+            )
+
+        screen = PIL.Image.new('RGB', screen_size)
+        frames = []
+        for event in grabs:
+            screen.paste(event['image'].convert('RGB'), tuple(event['origin']))
+            frames.append(screen.copy())
+        return cls(frames, [event['time'] for event in grabs] if timed else None)
+
+    def rewind(self) -> None:
+        """
+        This method starts the replay over from the first frame.
+        """
+
+        self.position = 0
+        self.started = self.clock()
+
+    def advance(self, steps:int = 1) -> None:
+        """
+        This method moves on to a later frame, when the frames aren't played back by time.
+
+        Parameters:
+          - steps: how many frames to move on by
+        """
+
+        position = self.position + steps
+        if self.loop:
+            position %= len(self.frames)
+        self.position = min(position, len(self.frames) - 1)
+
+    def current_index(self) -> int:
+        """
+        This method returns the index of the frame a grab would return now.
+        """
+
+        if self.times is None:
+            return self.position
+
+        elapsed = self.clock() - self.started
+        if self.loop and self.times[-1] > 0:
+            elapsed %= self.times[-1]
+        return max(0, bisect.bisect_right(self.times, elapsed) - 1)
+
+    def grab(self, region:Optional[tuple] = None) -> "PIL.Image.Image":
+        frame = self.frames[self.current_index()]
+        if region is None:
+            return frame.copy()
+        x, y, width, height = region
+        return frame.crop((x, y, x + width, y + height))
+
+    def size(self) -> tuple:
+        return self.frames[0].size
+
+_default_capture = None
+
+def get_default_capture() -> "CaptureBackend":
+    """
+    This function returns the capture backend to use when none is given. It is the one set
+    with set_default_capture, otherwise an XvfbFramebufferCapture if the XVFB_FRAMEBUFFER
+    environment variable points at a framebuffer, otherwise a PyAutoGuiCapture.
+    """
+
+    global _default_capture
+    if _default_capture is None:
+        framebuffer_path = os.environ.get(FRAMEBUFFER_ENV_VAR)
+        if framebuffer_path and os.path.exists(framebuffer_path):
+            _default_capture = XvfbFramebufferCapture(framebuffer_path)
+        else:
+            _default_capture = PyAutoGuiCapture()
+    return _default_capture
+
+def set_default_capture(capture:"CaptureBackend") -> None:
+    """
+    This function sets the capture backend returned by get_default_capture, e.g. a
+    ReplayCapture for a benchmark.
+
+    Parameters:
+      - capture: the backend to use from now on
+    """
+
+    global _default_capture
+    _default_capture = capture
@@ -5,8 +5,39 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.remote.webdriver import WebDriver
 from utils import get_code_from_inbox
+from sessions import SessionStore
+from typing import Optional
+import time
 
-def cardinal_login(driver:"WebDriver", credentials:list) -> bool:
+def cardinal_login(driver:"WebDriver", credentials:Optional[list], 
+                   session_store:Optional["SessionStore"] = None) -> bool:
+    """
+    This function logs into the Cardinal website. If a session_store is given, it first tries
+    the session saved by the last run, and only logs in with the credentials (and two-factor
+    authentication) if that session has expired. A new login is saved to the session_store.
+    It returns False if the login failed (or if there are no credentials to log in with) 
+    and True if there are no issues.
+
+    Parameters:
+        - driver: the WebDriver controlling the web browser
+        - credentials: the credentials of the user provided by the get_credentials function
+                       in utils.py, or None to only try the saved session
+        - session_store: the SessionStore holding the last run's session
+    """
+
+    if session_store is not None and session_store.restore(driver):
+        print('Picked up the saved Cardinal session.')
+        return True
+
+    if credentials is None:
+        return False
+
+    logged_in = log_in_with_credentials(driver, credentials)
+    if logged_in and session_store is not None:
+        session_store.save(driver)
+    return logged_in
+
+def log_in_with_credentials(driver:"WebDriver", credentials:list) -> bool:
     """
     This function takes the user's input as given from display_login() and inputs it into the
     Cardinal website's log-in page. It also deals with the two-factor authentication
@@ -44,11 +75,13 @@ def cardinal_login(driver:"WebDriver", credentials:list) -> bool:
     except Exception:
         return False
 
-    # Clicking the tfa_button once it appears
+    # Clicking the tfa_button once it appears, noting when so only emails that arrive after 
+    # this are searched for the code
+    code_requested_at = time.time()
     tfa_button.click()
 
     # Getting the TFA code from my inbox, entering it, and submitting it
-    tfa_code = get_code_from_inbox()
+    tfa_code = get_code_from_inbox(since=code_requested_at)
     tfa_code_entry = driver.switch_to.active_element
     tfa_code_entry.send_keys(tfa_code)
     cursor = driver.switch_to.active_element
@@ -57,7 +90,7 @@ def cardinal_login(driver:"WebDriver", credentials:list) -> bool:
 
     # Sometimes Cardinal will tell you that the account is still in use when you try to log in.
     # This searches for the hyperlink that releases your account, clicks on it, 
-    # if it finds it, and starts cardinal_login() again.
+    # if it finds it, and starts log_in_with_credentials() again.
     try:
         wait.until(EC.visibility_of_element_located((By.XPATH, '//*[@id="spnOverRide"]')))
         error_button = driver.find_element(By.XPATH, '//*[@id="spnOverRide"]')
@@ -65,7 +98,7 @@ def cardinal_login(driver:"WebDriver", credentials:list) -> bool:
         error_button = None
     if error_button != None:
         error_button.click()
-        cardinal_login(driver, credentials)
+        return log_in_with_credentials(driver, credentials)
 
     return True
 
@@ -4,6 +4,8 @@ CARDINAL_LOGIN = None # Link removed for HIPAA reasons
 ACTIVITY_REPORT_VIEWER = None # Link removed for HIPAA reasons
 POD_SEARCH = None # Link removed for HIPAA reasons
 OODR_VIEWER = None # Link removed for HIPAA reasons
+POD_SEARCH_API = None # Link removed for HIPAA reasons (where the POD search form posts to)
+POD_DOWNLOAD_API = None # Link removed for HIPAA reasons (where the POD download form posts to)
 DESIRED_BRANCHES = [
     '100 - HME PORTLAND',
     '110 - HME WEST',
@@ -25,4 +27,16 @@ MISMATCHED_NAMES = {
     "FPX HC482A":"FPHC482",
     "FPX HC431":"FPX HC431A",
     "IMX KRTUB006SS":"REPR15"
-}
\ No newline at end of file
+}
+POD_RESULTS_TABLE = 'podResults'
+POD_PAGE_LENGTH = 100 # PODs shown (and downloaded) per page of search results
+POD_BROWSER_SESSIONS = 1 # Browser windows fetching PODs at once. More than 1 shares the one login the portal allows across extra browsers, so only raise it if the portal tolerates that.
+SELECTION_SESSIONS = 1 # Selectors running at once. More than 1 runs each on its own Xvfb display (see workers.py), so it only works on Linux. A run's 'selection sessions' setting overrides it.
+TFA_SUBJECT = 'One-time verification code' # The subject of Cardinal's two-factor authentication emails
+TFA_MAILDIR = None # A Maildir to read the codes from instead of Outlook
+TFA_IMAP_HOST = None # An IMAP server to read the codes from instead of Outlook
+TFA_IMAP_USER = None # The IMAP login (the password goes in the TFA_IMAP_PASSWORD environment variable)
+POD_ERROR_MESSAGES = [
+    "We are sorry, the (Proof of Delivery) documents",
+    "An error occurred while processing your request"
+]
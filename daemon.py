@@ -0,0 +1,297 @@
+# Keeps a browser started and logged into Cardinal between runs, so a scheduled or requested
+# run can start downloading right away instead of starting Chrome and logging in first.
+#
+# Start the daemon with:
+#     python daemon.py serve --downloads-folder FOLDER [--at 06:30 --at 13:00] [--every MINUTES]
+# and ask it for a run from another terminal (or a scheduled task) with:
+#     python daemon.py run [--settings '{"select items": true}']
+#     python daemon.py run --settings '{"select items": true, "selection sessions": 3}'
+#     python daemon.py status
+#     python daemon.py stop
+# Add --settings '{"stay logged in": true}' to serve to keep the session cookies between
+# restarts of the daemon. They are saved unencrypted in the user folder.
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.common.by import By
+import constants
+from cardinal_login_logout import cardinal_login
+from sessions import SessionStore
+from utils import engage_stealth_mode, get_credentials
+from stealth_pod_import_app import run_scripts
+
+DEFAULT_ADDRESS = ('127.0.0.1', 8765)
+
+# What a run does unless the request says otherwise. Selecting items needs the Order Entry
+# app in front of the user, so it is left for them to ask for.
+DEFAULT_SETTINGS = {
+    'open orders report': True,
+    'cardinal PODs': True,
+    'find selectables': True,
+    'select items': False,
+    'bulk export': False,
+    'stay logged in': False
+}
+
+class WarmBrowserDaemon:
+    """
+    A class that keeps one logged in browser ready and runs the program with it whenever a
+    run is asked for on its local socket or comes up on its schedule. Between runs it opens
+    the POD search page every few minutes, which keeps the session alive and shows when it
+    has expired, in which case it logs in again (with the saved session if it still works).
+    Runs are handled one at a time, since they share the browser.
+    It has the following attributes:
+      - downloads_folder: the folder the runs download into
+      - settings: the settings a run uses unless the request changes them
+      - address: the (host, port) the daemon listens on, which should stay on localhost
+      - run_times: the times of day to run at
+      - interval: how many minutes apart to run, or None
+      - keepalive: how many seconds apart the session is checked between runs
+      - driver: the warm browser
+      - session_store: the SessionStore the login is saved in, or None if the settings
+                       don't stay logged in between runs of the daemon
+      - credentials: the Cardinal credentials, once the user has been asked for them
+      - runs: a list of summaries of the runs so far
+      - running: whether the daemon keeps serving
+      - last_check: the time.monotonic() the session was last checked
+      - next_run: when the schedule next calls for a run, or None
+    """
+
+    def __init__(self, downloads_folder:str, settings:dict = DEFAULT_SETTINGS, address:tuple = DEFAULT_ADDRESS,
+                 run_times:Optional[list] = None, interval:Optional[float] = None, keepalive:float = 300):
+        self.downloads_folder = os.path.abspath(downloads_folder)
+        self.settings = dict(settings)
+        self.address = address
+        self.run_times = list(run_times or [])
+        self.interval = interval
+        self.keepalive = keepalive
+        self.driver = None
+        self.session_store = SessionStore() if self.settings.get('stay logged in') else None
+        self.credentials = None
+        self.runs = []
+        self.running = False
+        self.last_check = 0.0
+        self.next_run = None
+
+    def start_browser(self) -> None:
+        """
+        This method starts the browser and logs it in.
+        """
+
+        start = time.monotonic()
+        self.driver = engage_stealth_mode()
+        self.log_in()
+        self.last_check = time.monotonic()
+        print(f'The browser is warm and logged in ({time.monotonic() - start:.1f} seconds).')
+
+    def log_in(self) -> None:
+        """
+        This method logs the browser in, with the saved session if it still works and with
+        the user's credentials otherwise.
+        """
+
+        successful_login = cardinal_login(self.driver, self.credentials, self.session_store)
+        while not successful_login:
+            self.credentials = get_credentials(first_try=self.credentials is None)
+            successful_login = cardinal_login(self.driver, self.credentials, self.session_store)
+
+    def ensure_ready(self) -> None:
+        """
+        This method makes sure the browser is open and logged in, starting it again if it
+        was closed and logging in again if the session expired. It leaves the browser on the
+        POD search page.
+        """
+
+        try:
+            self.driver.get(constants.POD_SEARCH)
+            logged_in = bool(self.driver.find_elements(By.ID, 'txtStartDate'))
+        except (WebDriverException, AttributeError):
+            # The browser was closed or crashed
+            print('The browser is gone, starting a new one.')
+            self.start_browser()
+            return
+
+        if not logged_in:
+            print('The Cardinal session expired, logging in again.')
+            self.log_in()
+        self.last_check = time.monotonic()
+
+    def run(self, overrides:Optional[dict] = None) -> dict:
+        """
+        This method runs the program with the warm browser and returns a summary of the run.
+
+        Parameters:
+            - overrides: settings to change for this run only
+        """
+
+        requested = time.monotonic()
+        settings = {**self.settings, **(overrides or {})}
+        try:
+            self.ensure_ready()
+            ready_seconds = time.monotonic() - requested
+            print(f'Starting a run {ready_seconds:.1f} seconds after it was asked for.')
+
+            selectable_items = run_scripts(settings, self.driver, self.downloads_folder)
+            if self.session_store is not None:
+                self.session_store.save(self.driver)
+            summary = {
+                'ok': True,
+                'started': datetime.now().isoformat(timespec='seconds'),
+                'seconds to start': round(ready_seconds, 1),
+                'seconds': round(time.monotonic() - requested, 1),
+                'selectable items': 0 if selectable_items is None else len(selectable_items)
+            }
+        except Exception as e:
+            summary = {'ok': False, 'error': repr(e), 'seconds': round(time.monotonic() - requested, 1)}
+            print(f'The run failed: {e!r}')
+
+        self.runs.append(summary)
+        return summary
+
+    def handle(self, request:dict) -> dict:
+        """
+        This method answers one request from the socket.
+
+        Parameters:
+            - request: a dictionary with the 'command' ('run', 'status' or 'stop') and, for
+                       'run', optional 'settings' to change for that run
+        """
+
+        command = request.get('command')
+        if command == 'run':
+            return self.run(request.get('settings', {}))
+        if command == 'status':
+            return {'ok': True, 'runs': self.runs, 'next run': self.next_run.isoformat(timespec='minutes') if self.next_run else None}
+        if command == 'stop':
+            self.running = False
+            return {'ok': True}
+        return {'ok': False, 'error': f'Unknown command {command!r}.'}
+
+    def get_next_run(self, now:"datetime") -> Optional["datetime"]:
+        """
+        This method returns when the schedule next calls for a run after now, or None if
+        there is no schedule.
+
+        Parameters:
+            - now: the current time
+        """
+
+        candidates = []
+        for run_time in self.run_times:
+            candidate = datetime.combine(now.date(), run_time)
+            candidates.append(candidate if candidate > now else candidate + timedelta(days=1))
+        if self.interval:
+            candidates.append(now + timedelta(minutes=self.interval))
+        return min(candidates) if candidates else None
+
+    def serve(self) -> None:
+        """
+        This method starts the browser and answers requests on the socket until it is asked
+        to stop, running on the schedule and checking the session in between.
+        """
+
+        daemon = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                try:
+                    request = json.loads(self.rfile.readline())
+                except ValueError:
+                    request = {}
+                reply = daemon.handle(request)
+                self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+        # Working from the downloads folder like the app does once the user picks it, so the
+        # files the steps write without a folder (journals, pacing and metrics, flight
+        # recordings) end up there and not wherever the daemon was started from
+        os.chdir(self.downloads_folder)
+
+        self.start_browser()
+        self.next_run = self.get_next_run(datetime.now())
+        self.running = True
+
+        try:
+            with socketserver.TCPServer(self.address, RequestHandler) as server:
+                server.timeout = 1
+                print(f'Waiting for runs on {self.address[0]}:{self.address[1]}'
+                      + (f', next scheduled run at {self.next_run:%Y-%m-%d %H:%M}.' if self.next_run else '.'))
+
+                while self.running:
+                    server.handle_request()
+
+                    if self.next_run is not None and datetime.now() >= self.next_run:
+                        self.run()
+                        self.next_run = self.get_next_run(datetime.now())
+                    elif time.monotonic() - self.last_check > self.keepalive:
+                        try:
+                            self.ensure_ready()
+                        except Exception as e:
+                            # Trying again at the next check or run instead of stopping the daemon
+                            self.last_check = time.monotonic()
+                            print(f'Checking the session failed: {e!r}')
+        finally:
+            try:
+                self.driver.quit()
+            except WebDriverException:
+                pass
+
+def send_command(command:str, settings:Optional[dict] = None, address:tuple = DEFAULT_ADDRESS,
+                 timeout:Optional[float] = None) -> dict:
+    """
+    This function sends a request to a running daemon and returns its reply.
+
+    Parameters:
+        - command: 'run', 'status' or 'stop'
+        - settings: settings to change for a run
+        - address: the (host, port) the daemon listens on
+        - timeout: the most seconds to wait for the reply, or None to wait for the run to finish
+    """
+
+    request = {'command': command}
+    if settings:
+        request['settings'] = settings
+
+    with socket.create_connection(address, timeout=timeout) as connection:
+        connection.sendall(json.dumps(request).encode() + b'\n')
+        with connection.makefile('rb') as reply:
+            return json.loads(reply.readline())
+
+def main() -> None:
+    """
+    This function starts the daemon or sends it a request, depending on the command line.
+    """
+
+    parser = argparse.ArgumentParser(description='Keep a logged in browser ready for runs of the program.')
+    parser.add_argument('command', choices=['serve', 'run', 'status', 'stop'])
+    parser.add_argument('--port', type=int, default=DEFAULT_ADDRESS[1], help='the local port the daemon listens on')
+    parser.add_argument('--downloads-folder', help='the folder runs download into (serve only)')
+    parser.add_argument('--at', action='append', default=[], metavar='HH:MM', help='a time of day to run at (serve only)')
+    parser.add_argument('--every', type=float, metavar='MINUTES', help='run every this many minutes (serve only)')
+    parser.add_argument('--settings', type=json.loads, default={}, help='settings to change, as JSON')
+    args = parser.parse_args()
+
+    address = (DEFAULT_ADDRESS[0], args.port)
+
+    if args.command == 'serve':
+        if not args.downloads_folder:
+            parser.error('serve needs --downloads-folder')
+        daemon = WarmBrowserDaemon(
+            args.downloads_folder,
+            settings={**DEFAULT_SETTINGS, **args.settings},
+            address=address,
+            run_times=[datetime.strptime(run_time, '%H:%M').time() for run_time in args.at],
+            interval=args.every
+        )
+        daemon.serve()
+    else:
+        print(json.dumps(send_command(args.command, args.settings, address), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+# Batched DOM operations. Each function here injects one script into the page that does
+# all of its work in the browser and sends back a summary, instead of making a WebDriver
+# round trip for every element it reads or clicks.
+
+from selenium.webdriver.remote.webdriver import WebDriver
+
+# Clicks every unchecked checkbox whose name doesn't contain any of the excluded strings.
+# Clicking (rather than setting .checked) fires the page's own handlers.
+CHECK_ALL_CHECKBOXES_JS = """
+const excluded = arguments[0];
+const summary = {checked: 0, already_checked: 0, skipped: 0};
+for (const checkbox of document.querySelectorAll('input[type="checkbox"]')) {
+    const name = checkbox.getAttribute('name') || '';
+    if (excluded.some(part => name.includes(part))) {
+        summary.skipped++;
+    } else if (checkbox.checked) {
+        summary.already_checked++;
+    } else {
+        checkbox.click();
+        summary.checked++;
+    }
+}
+return summary;
+"""
+
+# Checks the checkboxes inside a container whose labels are in a list, leaving the others alone
+SELECT_CHECKBOXES_BY_LABEL_JS = """
+const container = document.evaluate(
+    arguments[0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+).singleNodeValue;
+const labels = new Set(arguments[1]);
+const summary = {selected: [], already_selected: [], missing: []};
+if (container === null) {
+    summary.missing = Array.from(labels);
+    return summary;
+}
+
+const found = new Set();
+for (const checkbox of container.querySelectorAll('input[type="checkbox"]')) {
+    const label = checkbox.labels && checkbox.labels.length
+        ? checkbox.labels[0].textContent
+        : checkbox.parentElement.textContent;
+    const text = label.trim();
+    if (!labels.has(text)) {
+        continue;
+    }
+    found.add(text);
+    if (checkbox.checked) {
+        summary.already_selected.push(text);
+    } else {
+        checkbox.click();
+        summary.selected.push(text);
+    }
+}
+summary.missing = Array.from(labels).filter(label => !found.has(label));
+return summary;
+"""
+
+def check_all_checkboxes(driver:"WebDriver", excluded_names:list[str] = ['chkAll']) -> dict:
+    """
+    This function checks every unchecked checkbox on the page in one script, skipping the
+    ones whose name contains any of excluded_names. It returns a dictionary counting how
+    many were 'checked', 'already_checked' and 'skipped'.
+
+    Parameters:
+        - driver: the WebDriver controlling the web browser
+        - excluded_names: parts of the names of checkboxes to leave alone, like the Select All boxes
+    """
+
+    return driver.execute_script(CHECK_ALL_CHECKBOXES_JS, list(excluded_names))
+
+def select_checkboxes_by_label(driver:"WebDriver", container_xpath:str, labels:list[str]) -> dict:
+    """
+    This function checks the checkboxes inside the element at container_xpath whose labels
+    are in labels, in one script. It returns a dictionary listing the labels that were
+    'selected', 'already_selected', and 'missing' (not found in the container).
+
+    Parameters:
+        - driver: the WebDriver controlling the web browser
+        - container_xpath: the xpath of the element holding the checkboxes, e.g. a dropdown
+        - labels: the labels of the checkboxes to check
+    """
+
+    return driver.execute_script(SELECT_CHECKBOXES_BY_LABEL_JS, container_xpath, list(labels))
+
+# Finds a DataTables table's API, with the legacy (1.9 and older) interface as a fallback.
+# Returns null when the page has no DataTables table with that id.
+DATATABLE_PREAMBLE = """
+const selector = '#' + arguments[0];
+const $ = window.jQuery;
+if (!$ || !$.fn.dataTable || $(selector).length === 0) {
+    return null;
+}
+const legacy = !$.fn.dataTable.Api;
+"""
+
+GET_DATATABLE_INFO_JS = DATATABLE_PREAMBLE + """
+if (!legacy) {
+    return $(selector).DataTable().page.info();
+}
+const settings = $(selector).dataTable().fnSettings();
+const length = settings._iDisplayLength;
+const records = settings.fnRecordsDisplay();
+return {
+    page: length > 0 ? Math.floor(settings._iDisplayStart / length) : 0,
+    pages: length > 0 ? Math.ceil(records / length) : 1,
+    length: length,
+    recordsDisplay: records,
+    recordsTotal: settings.fnRecordsTotal()
+};
+"""
+
+SET_DATATABLE_PAGE_JS = DATATABLE_PREAMBLE + """
+if (!legacy) {
+    $(selector).DataTable().page(arguments[1]).draw('page');
+} else {
+    $(selector).dataTable().fnPageChange(arguments[1]);
+}
+return true;
+"""
+
+SET_DATATABLE_PAGE_LENGTH_JS = DATATABLE_PREAMBLE + """
+if (!legacy) {
+    $(selector).DataTable().page.len(arguments[1]).draw();
+} else {
+    const table = $(selector).dataTable();
+    table.fnSettings()._iDisplayLength = arguments[1];
+    table.fnDraw();
+}
+return true;
+"""
+
+def get_datatable_info(driver:"WebDriver", table_id:str) -> dict | None:
+    """
+    This function reads a DataTables table's paging state straight from the table, without
+    clicking through its pages. It returns a dictionary with the current 'page' (counting
+    from 0), the number of 'pages', the page 'length' and the number of records, or None
+    if the table isn't a DataTables table.
+
+    Parameters:
+        - driver: the WebDriver controlling the web browser
+        - table_id: the id of the table element, e.g. 'podResults'
+    """
+
+    return driver.execute_script(GET_DATATABLE_INFO_JS, table_id)
+
+def set_datatable_page(driver:"WebDriver", table_id:str, page:int) -> bool:
+    """
+    This function jumps a DataTables table straight to a page. It returns False if the 
+    table isn't a DataTables table.
+
+    Parameters:
+        - driver: the WebDriver controlling the web browser
+        - table_id: the id of the table element
+        - page: the page to show, counting from 0
+    """
+
+    return bool(driver.execute_script(SET_DATATABLE_PAGE_JS, table_id, page))
+
+def set_datatable_page_length(driver:"WebDriver", table_id:str, length:int) -> dict | None:
+    """
+    This function changes how many rows a DataTables table shows per page, and returns the
+    table's paging state afterwards (see get_datatable_info), since the site may not allow
+    the length asked for. It returns None if the table isn't a DataTables table.
+
+    Parameters:
+        - driver: the WebDriver controlling the web browser
+        - table_id: the id of the table element
+        - length: the number of rows per page
+    """
+
+    if not driver.execute_script(SET_DATATABLE_PAGE_LENGTH_JS, table_id, length):
+        return None
+    return get_datatable_info(driver, table_id)
+
+def click_twice(driver:"WebDriver", element_id:str) -> bool:
+    """
+    This function clicks an element twice in one script, e.g. a Select All checkbox to
+    clear the selection. It returns False if there is no element with that id.
+
+    Parameters:
+        - driver: the WebDriver controlling the web browser
+        - element_id: the id of the element to click
+    """
+
+    return driver.execute_script(
+        "const element = document.getElementById(arguments[0]);"
+        "if (element === null) { return false; }"
+        "element.click(); element.click(); return true;",
+        element_id
+    )
+
+READ_PAGE_STATE_JS = """
+const navigation = performance.getEntriesByType('navigation')[0];
+return {
+    url: location.href,
+    title: document.title,
+    ready_state: document.readyState,
+    status: navigation && navigation.responseStatus ? navigation.responseStatus : null,
+    text: document.body ? document.body.innerText : ''
+};
+"""
+
+def read_page_state(driver:"WebDriver") -> dict:
+    """
+    This function reads what the current tab is showing in one script: its 'url', 'title',
+    'ready_state', the HTTP 'status' of the page (None where the browser doesn't report it)
+    and the visible 'text' of the page.
+
+    Parameters:
+        - driver: the WebDriver controlling the web browser
+    """
+
+    return driver.execute_script(READ_PAGE_STATE_JS)
+
+GET_CHECKBOX_NAMES_JS = """
+const excluded = arguments[0];
+return Array.from(document.querySelectorAll('input[type="checkbox"]'))
+    .map(checkbox => checkbox.getAttribute('name') || '')
+    .filter(name => name && !excluded.some(part => name.includes(part)));
+"""
+
+CHECK_CHECKBOXES_BY_NAME_JS = """
+const names = new Set(arguments[0]);
+const summary = {checked: 0, already_checked: 0, missing: 0};
+const found = new Set();
+for (const checkbox of document.querySelectorAll('input[type="checkbox"]')) {
+    const name = checkbox.getAttribute('name') || '';
+    if (!names.has(name)) {
+        continue;
+    }
+    found.add(name);
+    if (checkbox.checked) {
+        summary.already_checked++;
+    } else {
+        checkbox.click();
+        summary.checked++;
+    }
+}
+summary.missing = names.size - found.size;
+return summary;
+"""
+
+def get_checkbox_names(driver:"WebDriver", excluded_names:list[str] = ['chkAll']) -> list[str]:
+    """
+    This function returns the names of the checkboxes on the page, in page order, leaving
+    out the ones whose name contains any of excluded_names.
+
+    Parameters:
+        - driver: the WebDriver controlling the web browser
+        - excluded_names: parts of the names of checkboxes to leave out, like the Select All boxes
+    """
+
+    return driver.execute_script(GET_CHECKBOX_NAMES_JS, list(excluded_names))
+
+def check_checkboxes_by_name(driver:"WebDriver", names:list[str]) -> dict:
+    """
+    This function checks the checkboxes with the given names in one script. It returns a
+    dictionary counting how many were 'checked', 'already_checked' and 'missing'.
+
+    Parameters:
+        - driver: the WebDriver controlling the web browser
+        - names: the names of the checkboxes to check
+    """
+
+    return driver.execute_script(CHECK_CHECKBOXES_BY_NAME_JS, list(names))
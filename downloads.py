@@ -0,0 +1,242 @@
+# Tracks Chrome downloads through the DevTools protocol, so the program can wait for a
+# download to actually finish instead of counting tabs or looking for buttons on screen.
+
+import json
+import os
+import time
+from concurrent.futures import Future
+from typing import NamedTuple, Optional
+from selenium.webdriver.remote.webdriver import WebDriver
+
+class Download(NamedTuple):
+    """
+    A finished download: Chrome's id for it, where it came from, the path of the file it
+    was saved to and how many bytes were received.
+    """
+    guid: str
+    url: str
+    path: str
+    bytes: int
+
+class DownloadFailed(Exception):
+    """
+    Raised (through a download's Future) when Chrome cancels a download.
+    """
+
+class DownloadTracker:
+    """
+    A class that follows the browser's download events and resolves a Future for each
+    download with its Download once it completes. The driver has to be started with
+    performance logging on (see engage_stealth_mode), since that is how the events reach
+    Selenium. Events are read whenever one of the wait methods polls. Chrome's performance
+    log only records some domains, so if no events arrive, the tracker falls back to
+    watching the download folder for new files and unfinished .crdownload files.
+    It has the following attributes:
+      - driver: the WebDriver controlling the browser
+      - download_dir: the folder downloads are saved to
+      - downloads: a dictionary mapping each download's guid to its Future
+      - order: the guids in the order their downloads began
+      - info: a dictionary mapping each guid to what is known about it so far
+              (url, suggested file name, received bytes)
+      - mark_files: a dictionary mapping each marker to the names of the files that were in
+                    the download folder when it was last handed out
+    """
+
+    def __init__(self, driver:"WebDriver", download_dir:str):
+        self.driver = driver
+        self.download_dir = os.path.abspath(download_dir)
+        self.downloads = {}
+        self.order = []
+        self.info = {}
+        self.mark_files = {}
+
+    def enable(self) -> None:
+        """
+        This method sets the folder downloads are saved to and turns on download events.
+        """
+
+        self.driver.execute_cdp_cmd('Browser.setDownloadBehavior', {
+            'behavior': 'allow',
+            'downloadPath': self.download_dir,
+            'eventsEnabled': True
+        })
+
+    def mark(self) -> int:
+        """
+        This method returns a marker for "now", which can be passed to wait_for_downloads
+        to only wait for downloads that begin afterwards.
+        """
+
+        self.poll()
+        marker = len(self.order)
+        self.mark_files[marker] = set(os.listdir(self.download_dir))
+        return marker
+
+    def poll(self) -> None:
+        """
+        This method reads the browser's new log entries and updates the downloads they mention.
+        """
+
+        for entry in self.driver.get_log('performance'):
+            message = json.loads(entry['message'])['message']
+            method = message.get('method', '')
+            params = message.get('params', {})
+
+            # Chrome sends these from the Browser domain, and from the Page domain on older versions
+            if method in ('Browser.downloadWillBegin', 'Page.downloadWillBegin'):
+                self.begin(params['guid'], params.get('url', ''), params.get('suggestedFilename', ''))
+            elif method in ('Browser.downloadProgress', 'Page.downloadProgress'):
+                self.progress(params['guid'], params.get('state'), params.get('receivedBytes', 0))
+
+    def begin(self, guid:str, url:str, suggested_filename:str) -> None:
+        """
+        This method starts tracking a download.
+
+        Parameters:
+          - guid: Chrome's id for the download
+          - url: where the download comes from
+          - suggested_filename: the name Chrome will save the file under
+        """
+
+        if guid in self.downloads:
+            return
+        self.downloads[guid] = Future()
+        self.order.append(guid)
+        self.info[guid] = {'url': url, 'filename': suggested_filename, 'bytes': 0,
+                           'started': time.time()}
+
+    def progress(self, guid:str, state:Optional[str], received_bytes:int) -> None:
+        """
+        This method updates a download, resolving its Future if it completed or was canceled.
+
+        Parameters:
+          - guid: Chrome's id for the download
+          - state: 'inProgress', 'completed' or 'canceled'
+          - received_bytes: how many bytes have been received so far
+        """
+
+        if guid not in self.downloads:
+            self.begin(guid, '', '')
+        future = self.downloads[guid]
+        info = self.info[guid]
+        info['bytes'] = received_bytes
+
+        if future.done():
+            return
+        if state == 'completed':
+            future.set_result(Download(guid, info['url'], self.find_file(info), received_bytes))
+        elif state == 'canceled':
+            future.set_exception(DownloadFailed(f"The download of {info['url'] or guid} was canceled."))
+
+    def find_file(self, info:dict) -> str:
+        """
+        This method returns the path a completed download was saved to. Chrome adds a number
+        to the suggested name if a file with that name already exists, so this is the newest
+        file starting with the suggested name that was written after the download began.
+
+        Parameters:
+          - info: what is known about the download
+        """
+
+        path = os.path.join(self.download_dir, info['filename'])
+        if not info['filename']:
+            return path
+
+        stem = os.path.splitext(info['filename'])[0]
+        candidates = [
+            os.path.join(self.download_dir, name) for name in os.listdir(self.download_dir)
+            if name.startswith(stem) and not name.endswith('.crdownload')
+            and os.path.getmtime(os.path.join(self.download_dir, name)) >= info['started'] - 1
+        ]
+        return max(candidates, key=os.path.getmtime) if candidates else path
+
+    def wait(self, future:"Future", timeout:float = 600) -> "Download":
+        """
+        This method waits for one download's Future to resolve and returns its Download.
+
+        Parameters:
+          - future: the download's Future, from the downloads attribute
+          - timeout: the most seconds to wait
+        """
+
+        deadline = time.monotonic() + timeout
+        while not future.done():
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'The download did not finish within {timeout} seconds.')
+            time.sleep(0.1)
+            self.poll()
+        return future.result()
+
+    def wait_for_downloads(self, since:int = 0, count:int = 1, timeout:float = 600,
+                           event_timeout:float = 30) -> list["Download"]:
+        """
+        This method waits until at least count downloads have begun after the marker since
+        and all of them have finished, and returns their Downloads in the order they began.
+        If no download events arrive within event_timeout seconds, or the downloads don't
+        finish in time, it watches the download folder instead (see wait_for_folder).
+
+        Parameters:
+          - since: a marker from the mark method
+          - count: how many downloads to wait for
+          - timeout: the most seconds to wait
+          - event_timeout: how many seconds to wait for a download event before watching
+                           the folder instead
+        """
+
+        existing = self.mark_files.get(since)
+        if existing is None:
+            existing = set(os.listdir(self.download_dir))
+        deadline = time.monotonic() + timeout
+        event_deadline = time.monotonic() + event_timeout
+        while len(self.order) - since < count:
+            if time.monotonic() > min(deadline, event_deadline):
+                print('No download events arrived, watching the download folder instead.')
+                return self.wait_for_folder(existing, count, max(0, deadline - time.monotonic()))
+            time.sleep(0.1)
+            self.poll()
+
+        try:
+            return [
+                self.wait(self.downloads[guid], max(0, deadline - time.monotonic()))
+                for guid in self.order[since:]
+            ]
+        except TimeoutError as e:
+            print(f'{e} Checking the download folder instead.')
+            return self.wait_for_folder(existing, count, 0)
+
+    def wait_for_folder(self, existing:set, count:int = 1, timeout:float = 600) -> list["Download"]:
+        """
+        This method waits until at least count new files are in the download folder and
+        none of them is still a .crdownload file, like the program did before it followed
+        download events, and returns them oldest first. Files that were already there, or
+        still downloading, when the downloads began aren't new. If that doesn't happen in
+        time, it returns the files that did finish.
+
+        Parameters:
+          - existing: the names of the files in the folder when the downloads began
+          - count: how many finished files to wait for
+          - timeout: the most seconds to wait
+        """
+
+        deadline = time.monotonic() + timeout
+        while True:
+            new_files = [
+                os.path.join(self.download_dir, name) for name in os.listdir(self.download_dir)
+                if name not in existing and name + '.crdownload' not in existing
+                and os.path.isfile(os.path.join(self.download_dir, name))
+            ]
+            finished = [path for path in new_files if not path.endswith(('.crdownload', '.tmp'))]
+            in_progress = len(new_files) - len(finished)
+
+            if (len(finished) >= count and not in_progress) or time.monotonic() > deadline:
+                break
+            time.sleep(0.5)
+
+        if len(finished) < count or in_progress:
+            print(f'Only {len(finished)} of {count} downloads finished in the download folder, '
+                  f'{in_progress} are still downloading.')
+
+        return [
+            Download('', '', path, os.path.getsize(path))
+            for path in sorted(finished, key=os.path.getmtime)
+        ]
@@ -0,0 +1,218 @@
+# A durable record of how far the Selector got with each order, so a run can pick up
+# where it left off after a crash.
+
+import sqlite3
+import time
+from typing import Optional
+
+# The states an order moves through in the Selector, in order
+STATES = ('opened', 'sorted', 'selected', 'closed')
+
+class SelectionJournal:
+    """
+    A class that records each order's state transitions in a SQLite database. Every
+    transition is committed as soon as it is recorded, so the journal survives the
+    program (or Citrix) dying part way through a run. The journal also holds a queue
+    of orders that several selection workers can lease from, so that no order is
+    worked on by two workers at once.
+    It has the following attributes:
+      - path: the path to the SQLite database file
+      - connection: the open connection to the database
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=30)
+
+        # Write-ahead logging keeps commits cheap, and FULL sync makes each one durable
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=FULL')
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS transitions ('
+                'order_number TEXT NOT NULL, '
+                'state TEXT NOT NULL, '
+                'recorded_at REAL NOT NULL)'
+            )
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS orders ('
+                'order_number TEXT PRIMARY KEY, '
+                'state TEXT NOT NULL, '
+                'updated_at REAL NOT NULL)'
+            )
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS queue ('
+                'order_number TEXT PRIMARY KEY, '
+                'position INTEGER NOT NULL, '
+                'leased_by TEXT, '
+                'lease_expires REAL, '
+                'attempts INTEGER NOT NULL DEFAULT 0)'
+            )
+
+            # Journals made before failed attempts were counted don't have the column yet
+            columns = [row[1] for row in self.connection.execute('PRAGMA table_info(queue)')]
+            if 'attempts' not in columns:
+                self.connection.execute('ALTER TABLE queue ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+
+    def record(self, order_number:str, state:str) -> None:
+        """
+        This method records that an order has reached a state.
+
+        Parameters:
+            - order_number: the order in question
+            - state: one of 'opened', 'sorted', 'selected' or 'closed'
+        """
+
+        if state not in STATES:
+            raise ValueError(f'Unknown order state "{state}", expected one of {STATES}.')
+
+        now = time.time()
+        with self.connection:
+            self.connection.execute(
+                'INSERT INTO transitions (order_number, state, recorded_at) VALUES (?, ?, ?)',
+                (order_number, state, now)
+            )
+            self.connection.execute(
+                'INSERT INTO orders (order_number, state, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(order_number) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at',
+                (order_number, state, now)
+            )
+
+    def get_state(self, order_number:str) -> Optional[str]:
+        """
+        This method returns the latest state recorded for an order, or None if the order
+        hasn't been started.
+
+        Parameters:
+            - order_number: the order in question
+        """
+
+        row = self.connection.execute(
+            'SELECT state FROM orders WHERE order_number = ?', (order_number,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def is_complete(self, order_number:str) -> bool:
+        """
+        This method returns whether an order has been closed, i.e. it can be skipped.
+
+        Parameters:
+            - order_number: the order in question
+        """
+
+        return self.get_state(order_number) == 'closed'
+
+    def get_completed(self) -> set[str]:
+        """
+        This method returns the set of all orders that have been closed.
+        """
+
+        rows = self.connection.execute("SELECT order_number FROM orders WHERE state = 'closed'")
+        return {row[0] for row in rows}
+
+    def enqueue(self, order_numbers:list[str]) -> None:
+        """
+        This method adds orders to the end of the queue, in order. Orders that are
+        already in the queue keep their place.
+
+        Parameters:
+            - order_numbers: the orders to add
+        """
+
+        with self.connection:
+            start = self.connection.execute('SELECT COALESCE(MAX(position), -1) + 1 FROM queue').fetchone()[0]
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO queue (order_number, position) VALUES (?, ?)',
+                [(order_number, start + i) for i, order_number in enumerate(order_numbers)]
+            )
+
+    def lease(self, worker:str, ttl:float = 900, max_attempts:int = 3) -> Optional[str]:
+        """
+        This method hands the next order that isn't closed or leased to a worker, leasing
+        it to them for ttl seconds. If a worker dies, its lease runs out and the order goes
+        back to the queue. Orders that have failed max_attempts times are left alone. It
+        returns None once there is nothing left to lease.
+
+        Parameters:
+            - worker: the name of the worker taking the order
+            - ttl: how many seconds the lease lasts before another worker can take the order
+            - max_attempts: how many failed attempts an order gets before it is skipped
+        """
+
+        now = time.time()
+
+        # One UPDATE statement, so two workers can never lease the same order
+        with self.connection:
+            row = self.connection.execute(
+                'UPDATE queue SET leased_by = ?, lease_expires = ? '
+                'WHERE order_number = ('
+                '    SELECT queue.order_number FROM queue '
+                '    LEFT JOIN orders ON orders.order_number = queue.order_number '
+                "    WHERE COALESCE(orders.state, '') != 'closed' "
+                '    AND (queue.leased_by IS NULL OR queue.lease_expires < ?) '
+                '    AND queue.attempts < ? '
+                '    ORDER BY queue.position LIMIT 1'
+                ') RETURNING order_number',
+                (worker, now + ttl, now, max_attempts)
+            ).fetchone()
+        return row[0] if row else None
+
+    def renew(self, order_number:str, worker:str, ttl:float = 900) -> bool:
+        """
+        This method extends a worker's lease on an order. It returns False if the worker
+        no longer holds the lease.
+
+        Parameters:
+            - order_number: the leased order
+            - worker: the name of the worker holding the lease
+            - ttl: how many seconds from now the lease should last
+        """
+
+        with self.connection:
+            cursor = self.connection.execute(
+                'UPDATE queue SET lease_expires = ? WHERE order_number = ? AND leased_by = ?',
+                (time.time() + ttl, order_number, worker)
+            )
+        return cursor.rowcount == 1
+
+    def release(self, order_number:str, worker:str, failed:bool = False) -> None:
+        """
+        This method gives up a worker's lease on an order, so that another worker can 
+        pick it up. If the worker failed on the order, the failed attempt is counted.
+
+        Parameters:
+            - order_number: the leased order
+            - worker: the name of the worker holding the lease
+            - failed: whether the worker gave the order up because it failed
+        """
+
+        with self.connection:
+            self.connection.execute(
+                'UPDATE queue SET leased_by = NULL, lease_expires = NULL, attempts = attempts + ? '
+                'WHERE order_number = ? AND leased_by = ?',
+                (int(failed), order_number, worker)
+            )
+
+    def get_failed(self, max_attempts:int = 3) -> set[str]:
+        """
+        This method returns the set of orders that aren't closed and have failed 
+        max_attempts times, i.e. that no worker will lease again.
+
+        Parameters:
+            - max_attempts: the number of failed attempts after which an order is skipped
+        """
+
+        rows = self.connection.execute(
+            'SELECT queue.order_number FROM queue '
+            'LEFT JOIN orders ON orders.order_number = queue.order_number '
+            "WHERE COALESCE(orders.state, '') != 'closed' AND queue.attempts >= ?",
+            (max_attempts,)
+        )
+        return {row[0] for row in rows}
+
+    def close(self) -> None:
+        """
+        This method closes the connection to the database.
+        """
+
+        self.connection.close()
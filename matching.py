@@ -0,0 +1,125 @@
+# A template matcher for finding the reference images from reference_images.py on screen.
+
+import cv2
+import numpy as np
+from typing import NamedTuple, Optional
+from capture import CaptureBackend, get_default_capture
+
+class Match(NamedTuple):
+    """
+    Where a template was found: the x, y screen coordinates of its center, how confident
+    the match is (0 to 1) and the scale the template matched at.
+    """
+    x: int
+    y: int
+    confidence: float
+    scale: float
+
+class TemplateMatcher:
+    """
+    A class that decodes reference images once and then finds them in screen grabs.
+    Every template is converted to grayscale and resized to each scale up front, so a
+    search only has to grab and convert the screen once, no matter how many templates
+    are being looked for.
+    It has the following attributes:
+      - scales: the scales each template is matched at, to allow for DPI/zoom differences
+      - templates: a dictionary mapping each template name to a list of
+                   (scale, grayscale template array) tuples
+      - capture: the CaptureBackend the screen is grabbed with
+    """
+
+    def __init__(self, paths:dict, scales:tuple = (0.8, 0.9, 1.0, 1.1, 1.25),
+                 capture:Optional["CaptureBackend"] = None):
+        self.scales = scales
+        self.capture = capture if capture is not None else get_default_capture()
+        self.templates = {}
+
+        for name, path in paths.items():
+            # Some reference image paths are removed for privacy, so they can't be loaded
+            if path is None:
+                continue
+            image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+            if image is None:
+                print(f'Could not read the reference image for {name} at {path}.')
+                continue
+            self.add_template(name, image)
+
+    def add_template(self, name:str, image:"np.ndarray") -> None:
+        """
+        This method adds a grayscale template to the matcher at each of its scales.
+
+        Parameters:
+          - name: the name the template will be looked up by
+          - image: the grayscale template as a 2D array
+        """
+
+        self.templates[name] = []
+        for scale in self.scales:
+            if scale == 1:
+                scaled = image
+            else:
+                interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+                scaled = cv2.resize(image, None, fx=scale, fy=scale, interpolation=interpolation)
+            self.templates[name].append((scale, scaled))
+
+    def grab_frame(self, region:Optional[tuple] = None) -> "np.ndarray":
+        """
+        This method takes a screenshot of the region and returns it as a grayscale array.
+
+        Parameters:
+          - region: the (x, y, width, height) area of the screen to grab, or None for
+                    the whole screen
+        """
+
+        return cv2.cvtColor(np.asarray(self.capture.grab(region)), cv2.COLOR_RGB2GRAY)
+
+    def match(self, frame:"np.ndarray", names:list[str], confidence:float = 0.7,
+              origin:tuple = (0, 0)) -> dict:
+        """
+        This method looks for each named template in one grayscale frame and returns a
+        dictionary mapping each name to its best Match, or None if it wasn't found with
+        at least the given confidence.
+
+        Parameters:
+          - frame: the grayscale frame to search
+          - names: the names of the templates to look for
+          - confidence: the lowest match score (0 to 1) that counts as found
+          - origin: the screen coordinates of the top left corner of frame
+        """
+
+        matches = {}
+        for name in names:
+            best = None
+            for scale, template in self.templates.get(name, []):
+                height, width = template.shape
+                if height > frame.shape[0] or width > frame.shape[1]:
+                    continue
+
+                scores = cv2.matchTemplate(frame, template, cv2.TM_CCOEFF_NORMED)
+                _, score, _, location = cv2.minMaxLoc(scores)
+                if best is None or score > best.confidence:
+                    best = Match(
+                        origin[0] + location[0] + width // 2,
+                        origin[1] + location[1] + height // 2,
+                        float(score),
+                        scale
+                    )
+
+            matches[name] = best if best is not None and best.confidence >= confidence else None
+        return matches
+
+    def find_on_screen(self, names:list[str], region:Optional[tuple] = None,
+                       confidence:float = 0.7) -> dict:
+        """
+        This method grabs the screen once and looks for each named template in it,
+        returning the same dictionary as match.
+
+        Parameters:
+          - names: the names of the templates to look for
+          - region: the (x, y, width, height) area of the screen to search, or None for
+                    the whole screen
+          - confidence: the lowest match score (0 to 1) that counts as found
+        """
+
+        origin = (region[0], region[1]) if region else (0, 0)
+        return self.match(self.grab_frame(region), names, confidence, origin)
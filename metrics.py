@@ -0,0 +1,195 @@
+# Latency and retry measurements for the Selector, so a slow order can be broken down
+# into time spent on OCR, waiting, window lookups, keystrokes and the app itself.
+
+import functools
+import json
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+# The upper edges, in seconds, of the buckets latencies are counted in
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def summarize(samples:list[float], buckets:Optional[tuple] = None) -> dict:
+    """
+    This function summarizes a list of measurements: how many there were, their total,
+    mean, median, 90th and 99th percentiles and max, plus a histogram if buckets are given.
+
+    Parameters:
+        - samples: the measurements
+        - buckets: the upper edges of the histogram buckets, or None for no histogram
+    """
+
+    if not samples:
+        return {'count': 0}
+
+    ordered = sorted(samples)
+    def percentile(p:float) -> float:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    summary = {
+        'count': len(ordered),
+        'total': sum(ordered),
+        'mean': sum(ordered) / len(ordered),
+        'p50': percentile(0.5),
+        'p90': percentile(0.9),
+        'p99': percentile(0.99),
+        'max': ordered[-1]
+    }
+
+    if buckets is not None:
+        histogram = {}
+        remaining = ordered
+        for edge in buckets:
+            histogram[f'<={edge}'] = sum(1 for sample in remaining if sample <= edge)
+            remaining = [sample for sample in remaining if sample > edge]
+        histogram[f'>{buckets[-1]}'] = len(remaining)
+        summary['histogram'] = histogram
+
+    return summary
+
+class Metrics:
+    """
+    A class that collects how long each kind of action takes and how many attempts or
+    retries it needs, for the whole run and for each order.
+    It has the following attributes:
+      - timings: a dictionary mapping each action to the list of its latencies in seconds
+      - counts: a dictionary mapping each counted thing (e.g. attempts) to its list of values
+      - orders: a dictionary mapping each order number to its own {'timings', 'counts'}
+      - current_order: the order that measurements are also being filed under, if any
+      - order_start: the time.monotonic() the current order started at
+      - run_start: the time.monotonic() the Metrics were made at
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.counts = {}
+        self.orders = {}
+        self.current_order = None
+        self.order_start = None
+        self.run_start = time.monotonic()
+
+    def observe(self, action:str, seconds:float) -> None:
+        """
+        This method records how long an action took.
+
+        Parameters:
+          - action: the name of the action, e.g. 'ocr' or 'keys: dialog'
+          - seconds: how long it took
+        """
+
+        self.timings.setdefault(action, []).append(seconds)
+        if self.current_order is not None:
+            self.orders[self.current_order]['timings'].setdefault(action, []).append(seconds)
+
+    def count(self, name:str, value:float) -> None:
+        """
+        This method records a count, like how many attempts something needed.
+
+        Parameters:
+          - name: what was counted, e.g. 'wait_until_seen attempts: Physician'
+          - value: the count
+        """
+
+        self.counts.setdefault(name, []).append(value)
+        if self.current_order is not None:
+            self.orders[self.current_order]['counts'].setdefault(name, []).append(value)
+
+    @contextmanager
+    def timed(self, action:str):
+        """
+        This method times the code in a with block as one action:
+
+            with metrics.timed('window lookup'):
+                ...
+
+        Parameters:
+          - action: the name of the action
+        """
+
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(action, time.monotonic() - start)
+
+    def start_order(self, order_number:str) -> None:
+        """
+        This method starts filing measurements under an order as well as the run.
+
+        Parameters:
+          - order_number: the order that is starting
+        """
+
+        self.end_order()
+        self.current_order = order_number
+        self.order_start = time.monotonic()
+        self.orders.setdefault(order_number, {'timings': {}, 'counts': {}})
+
+    def end_order(self) -> None:
+        """
+        This method stops filing measurements under the current order and records how long
+        the whole order took.
+        """
+
+        if self.current_order is None:
+            return
+        self.observe('order', time.monotonic() - self.order_start)
+        self.current_order = None
+        self.order_start = None
+
+    def summary(self) -> dict:
+        """
+        This method returns a JSON serializable summary of the run and of each order.
+        """
+
+        def summarize_all(timings:dict, counts:dict) -> dict:
+            return {
+                'timings': {action: summarize(samples, LATENCY_BUCKETS) for action, samples in timings.items()},
+                'counts': {name: summarize(values) for name, values in counts.items()}
+            }
+
+        return {
+            'run': {
+                'seconds': time.monotonic() - self.run_start,
+                **summarize_all(self.timings, self.counts)
+            },
+            'orders': {
+                order_number: summarize_all(order['timings'], order['counts'])
+                for order_number, order in self.orders.items()
+            }
+        }
+
+    def save(self, path:str) -> None:
+        """
+        This method writes the summary to a JSON file.
+
+        Parameters:
+          - path: the file to write
+        """
+
+        with open(path, 'w') as json_file:
+            json.dump(self.summary(), json_file, indent=2)
+
+def timed_method(action:str) -> Callable:
+    """
+    This function makes a decorator that times a method as an action, using the Metrics
+    in the object's metrics attribute (if it has any):
+
+        @timed_method('ocr')
+        def get_screen_grab_data(self, ...):
+
+    Parameters:
+        - action: the name of the action
+    """
+
+    def decorator(method:Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            metrics = getattr(self, 'metrics', None)
+            if metrics is None:
+                return method(self, *args, **kwargs)
+            with metrics.timed(action):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
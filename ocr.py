@@ -0,0 +1,257 @@
+# Helper functions for running pytesseract over screen grabs, used by the Eye class.
+
+import csv
+import io
+import math
+import os
+import pandas as pd
+import pytesseract
+import PIL.Image
+import PIL.ImageOps
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+def parse_ocr_data(data:str) -> "pd.DataFrame":
+    """
+    This function turns the TSV string returned by pytesseract.image_to_data into a
+    DataFrame, using the same options that the Eye has always read data.tsv with.
+
+    Parameters:
+        - data: the TSV output of pytesseract.image_to_data
+    """
+
+    return pd.read_csv(io.StringIO(data), delimiter='\t', na_values=-1, on_bad_lines="skip", quoting=csv.QUOTE_NONE)
+
+def get_otsu_threshold(image:"PIL.Image.Image") -> int:
+    """
+    This function picks the gray level that best splits a grayscale image into dark text
+    and light background (Otsu's method), using the image's histogram.
+
+    Parameters:
+        - image: a grayscale ('L' mode) image
+    """
+
+    histogram = image.histogram()
+    total = sum(histogram)
+    total_sum = sum(i * count for i, count in enumerate(histogram))
+
+    best_threshold = 0
+    best_variance = 0
+    background_count = 0
+    background_sum = 0
+    for threshold, count in enumerate(histogram):
+        background_count += count
+        if background_count == 0:
+            continue
+        foreground_count = total - background_count
+        if foreground_count == 0:
+            break
+        background_sum += threshold * count
+        background_mean = background_sum / background_count
+        foreground_mean = (total_sum - background_sum) / foreground_count
+        variance = background_count * foreground_count * (background_mean - foreground_mean) ** 2
+        if variance > best_variance:
+            best_variance = variance
+            best_threshold = threshold
+    return best_threshold
+
+class Preprocessor:
+    """
+    A class that prepares screen grabs for OCR. Tesseract reads best when capital letters
+    are around 20-30 pixels tall, so instead of always upscaling, the Preprocessor picks
+    a scale from the expected height of the text being read. Large labels that already
+    read fine at native resolution are left at 1x.
+    It has the following attributes:
+        - grayscale: whether to convert grabs to grayscale
+        - threshold: None to skip binarization, a gray level (0-255) to binarize at, or 
+                     'otsu' to pick the gray level from each grab
+        - text_height: the usual height in screen pixels of the text being read, or None
+                       to always use default_scale
+        - target_height: the text height, in pixels, that text is scaled up towards
+        - default_scale: the scale used when no text height is known
+        - max_scale: the largest scale the Preprocessor will use
+        - resample: the PIL resampling filter used for scaling
+    """
+
+    def __init__(self, grayscale:bool = False, threshold:Optional[int | str] = None, 
+                 text_height:Optional[float] = None, target_height:float = 24, 
+                 default_scale:float = 2, max_scale:float = 4,
+                 resample:int = PIL.Image.Resampling.LANCZOS):
+        self.grayscale = grayscale
+        self.threshold = threshold
+        self.text_height = text_height
+        self.target_height = target_height
+        self.default_scale = default_scale
+        self.max_scale = max_scale
+        self.resample = resample
+
+    def get_scale(self, text_height:Optional[float] = None) -> float:
+        """
+        This method returns how much a grab should be scaled up before OCR.
+
+        Parameters:
+            - text_height: the expected height of the text in screen pixels, overriding
+                           the Preprocessor's text_height for this grab
+        """
+
+        if text_height is None:
+            text_height = self.text_height
+        if text_height is None:
+            return self.default_scale
+        return min(self.max_scale, max(1, self.target_height / text_height))
+
+    def process(self, image:"PIL.Image.Image", text_height:Optional[float] = None) -> tuple:
+        """
+        This method runs a grab through the pipeline and returns the processed image
+        along with the scale it was resized by.
+
+        Parameters:
+            - image: the screen grab to process
+            - text_height: the expected height of the text in screen pixels, overriding
+                           the Preprocessor's text_height for this grab
+        """
+
+        # Converting to grayscale first means the resize has a third of the data to move
+        if self.grayscale or self.threshold is not None:
+            image = PIL.ImageOps.grayscale(image)
+
+        scale = self.get_scale(text_height)
+        if scale != 1:
+            new_size = tuple(round(scale*x) for x in image.size)
+            image = image.resize(new_size, self.resample)
+
+        if self.threshold is not None:
+            threshold = get_otsu_threshold(image) if self.threshold == 'otsu' else self.threshold
+            image = image.point(lambda p: 255 if p > threshold else 0)
+
+        return image, scale
+
+def get_tile_spans(length:int, tile_size:int, overlap:int) -> list[tuple[int]]:
+    """
+    This function splits one axis of an image into overlapping spans. Each span is a tuple
+    of (start, end, core_start, core_end), where the core is the part of the span that the
+    tile "owns". The cores of neighbouring spans meet in the middle of their overlap, so
+    together they cover the axis exactly once. It uses as few spans as fit within tile_size
+    and spreads them evenly, so they are all the same length and no span is mostly a copy
+    of its neighbour.
+
+    Parameters:
+        - length: the length of the axis in pixels
+        - tile_size: the longest each span can be, in pixels
+        - overlap: how many pixels neighbouring spans share at least
+    """
+
+    if length <= tile_size:
+        return [(0, length, 0, length)]
+
+    count = math.ceil((length - overlap) / (tile_size - overlap))
+    span_size = min(tile_size, math.ceil((length + (count - 1) * overlap) / count))
+    starts = [round(i * (length - span_size) / (count - 1)) for i in range(count)]
+
+    spans = []
+    for i, start in enumerate(starts):
+        end = start + span_size
+        core_start = 0 if i == 0 else (starts[i-1] + span_size + start) // 2
+        core_end = length if i == len(starts) - 1 else (end + starts[i+1]) // 2
+        spans.append((start, end, core_start, core_end))
+    return spans
+
+def get_tile_boxes(size:tuple, tile_size:int = 1280, overlap:int = 200) -> list[tuple[tuple[int]]]:
+    """
+    This function returns the tiles that an image of the given size should be split into,
+    as a list of (box, core) pairs. Both are (left, top, right, bottom) tuples; box is the
+    area to OCR and core is the area whose words belong to that tile.
+
+    Parameters:
+        - size: the (width, height) of the image
+        - tile_size: the largest width and height of each tile in pixels
+        - overlap: how many pixels neighbouring tiles share. This should be wider than the
+                   widest word so that every word fits whole inside the tile that owns it.
+    """
+
+    tiles = []
+    for top, bottom, core_top, core_bottom in get_tile_spans(size[1], tile_size, overlap):
+        for left, right, core_left, core_right in get_tile_spans(size[0], tile_size, overlap):
+            tiles.append(((left, top, right, bottom), (core_left, core_top, core_right, core_bottom)))
+    return tiles
+
+def ocr_tile(image:"PIL.Image.Image", box:tuple, core:tuple, tile_num:int) -> "pd.DataFrame":
+    """
+    This function OCRs one tile of an image and returns the words whose centers fall in
+    the tile's core, with their coordinates shifted back into the coordinates of the whole image.
+
+    Parameters:
+        - image: the whole image
+        - box: the (left, top, right, bottom) area of the image to OCR
+        - core: the (left, top, right, bottom) area that this tile owns
+        - tile_num: the index of the tile, used to keep block numbers unique after merging
+    """
+
+    data = parse_ocr_data(pytesseract.image_to_data(image.crop(box)))
+
+    # Keeping just the words, since the block/paragraph/line rows don't survive merging
+    data = data[(data['level'] == 5) & data['text'].notna()].copy()
+    data['left'] += box[0]
+    data['top'] += box[1]
+    data['block_num'] += tile_num * 1000
+    data['tile'] = tile_num
+
+    # Words that straddle a seam are seen by both tiles, but their center is only ever
+    # inside one tile's core.
+    center_x = data['left'] + data['width'] / 2
+    center_y = data['top'] + data['height'] / 2
+    owned = (center_x >= core[0]) & (center_x < core[2]) & \
+            (center_y >= core[1]) & (center_y < core[3])
+    return data[owned]
+
+@contextmanager
+def omp_thread_limit(limit:int) -> Iterator[None]:
+    """
+    This function is a context manager that sets OMP_THREAD_LIMIT for the tesseract
+    processes started inside it, and puts the variable back the way it was afterwards. The
+    variable is read from the process environment when tesseract starts, so other threads
+    starting tesseract at the same time get the limit too.
+
+    Parameters:
+        - limit: the most OpenMP threads each tesseract process can use
+    """
+
+    previous = os.environ.get('OMP_THREAD_LIMIT')
+    os.environ['OMP_THREAD_LIMIT'] = str(limit)
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ['OMP_THREAD_LIMIT']
+        else:
+            os.environ['OMP_THREAD_LIMIT'] = previous
+
+def ocr_image_tiled(image:"PIL.Image.Image", tile_size:int = 1280, overlap:int = 200,
+                    max_workers:Optional[int] = None) -> "pd.DataFrame":
+    """
+    This function splits a large image into overlapping tiles, OCRs them in a pool of
+    workers and merges the word boxes back into the coordinates of the whole image.
+    Words on the seams between tiles are only kept once.
+
+    Parameters:
+        - image: the image to OCR
+        - tile_size: the largest width and height of each tile in pixels
+        - overlap: how many pixels neighbouring tiles share
+        - max_workers: the number of tiles to OCR at once (defaults to the number of cores)
+    """
+
+    tiles = get_tile_boxes(image.size, tile_size, overlap)
+    if max_workers is None:
+        max_workers = os.cpu_count()
+
+    # pytesseract runs tesseract as a subprocess, so threads are enough to keep every core busy.
+    # Each tesseract process would otherwise start several OpenMP threads of its own, which
+    # fight with the other tiles for the same cores, so they are limited to one while the
+    # tiles are read.
+    with omp_thread_limit(1), ThreadPoolExecutor(max_workers=min(max_workers, len(tiles))) as pool:
+        tile_data = list(pool.map(lambda args: ocr_tile(image, *args),
+                                  [(box, core, i) for i, (box, core) in enumerate(tiles)]))
+
+    data = pd.concat(tile_data, ignore_index=True)
+    return data.sort_values(['top', 'left'], ignore_index=True)
@@ -0,0 +1,286 @@
+# A stand-in for the TIMS Order Entry app, for measuring the Selector without Citrix.
+#
+# It draws the same dialogs the Selector waits for (Warning, Physician, Whole, Additional,
+# the Item grid with its blue highlight, Date Span, and the Cancel/Yes buttons) and
+# responds to the same keystrokes, after a configurable delay. Keystrokes that arrive
+# while it is busy are dropped, like they can be over Citrix. Run it with:
+#     python order_entry_simulator.py --orders orders.json --latency 0.5
+
+import argparse
+import json
+import os
+import random
+import tkinter as tk
+import PIL.Image
+import PIL.ImageDraw
+import PIL.ImageFont
+
+HIGHLIGHT_COLOR = '#3399ff' # (51, 153, 255), the highlight color of the real app
+BACKGROUND_COLOR = '#f0f0f0'
+FONT = ('DejaVu Sans', 11)
+HEADER_FONT = ('DejaVu Sans', 11, 'bold')
+
+def make_button_image(text:str, path:str, size:tuple = (90, 30)) -> None:
+    """
+    This function draws a button and saves it as a PNG. The simulator shows the PNG, so
+    the same file can be used as the Selector's reference image for that button.
+
+    Parameters:
+        - text: the text on the button
+        - path: where to save the PNG
+        - size: the (width, height) of the button
+    """
+
+    image = PIL.Image.new('RGB', size, (225, 225, 225))
+    draw = PIL.ImageDraw.Draw(image)
+    draw.rectangle((0, 0, size[0] - 1, size[1] - 1), outline=(110, 110, 110))
+    draw.rectangle((2, 2, size[0] - 3, size[1] - 3), outline=(255, 255, 255))
+    try:
+        font = PIL.ImageFont.truetype('DejaVuSans.ttf', 14)
+    except OSError:
+        font = PIL.ImageFont.load_default()
+    text_box = draw.textbbox((0, 0), text, font=font)
+    draw.text(
+        ((size[0] - text_box[2]) / 2, (size[1] - text_box[3]) / 2),
+        text, fill=(0, 0, 0), font=font
+    )
+    image.save(path)
+
+class OrderEntrySimulator:
+    """
+    A class that runs the simulated Order Entry window.
+    It has the following attributes:
+      - root: the Tk root of the window
+      - canvas: the Canvas everything is drawn on
+      - orders: a dictionary mapping order numbers to lists of product codes
+      - already_selected: the orders that show the "Warning" popup when opened
+      - latency: the base delay in seconds before each dialog responds
+      - jitter: the most extra random delay added to each response
+      - state: which screen or dialog is showing
+      - busy: whether the app is working on a response (and dropping keystrokes)
+      - typed: the order number typed so far
+      - enters: how many times enter has been pressed on the current screen
+      - rows: the product codes in the Item grid, in their current order
+      - sort_direction: None, 'ascending' or 'descending'
+      - highlighted: the highlighted row in the grid, -1 for the header row
+    """
+
+    def __init__(self, orders:dict, already_selected:set, latency:float, jitter:float, assets:str):
+        self.root = tk.Tk()
+        self.root.title('TIMS - Order Entry')
+        width, height = self.root.winfo_screenwidth(), self.root.winfo_screenheight()
+        self.root.geometry(f'{width}x{height}+0+0')
+        self.canvas = tk.Canvas(self.root, width=width, height=height, bg=BACKGROUND_COLOR, highlightthickness=0)
+        self.canvas.pack(fill='both', expand=True)
+
+        self.orders = orders
+        self.already_selected = already_selected
+        self.latency = latency
+        self.jitter = jitter
+
+        os.makedirs(assets, exist_ok=True)
+        make_button_image('Cancel', os.path.join(assets, 'cancel_btn.png'))
+        make_button_image('Yes', os.path.join(assets, 'yes_btn.png'))
+        self.cancel_image = tk.PhotoImage(file=os.path.join(assets, 'cancel_btn.png'))
+        self.yes_image = tk.PhotoImage(file=os.path.join(assets, 'yes_btn.png'))
+
+        self.state = 'main'
+        self.busy = False
+        self.typed = ''
+        self.enters = 0
+        self.rows = []
+        self.sort_direction = None
+        self.highlighted = -1
+
+        self.root.bind('<Key>', self.on_key)
+        self.root.after(100, self.root.focus_force)
+        self.draw()
+
+    def respond(self, next_state:str) -> None:
+        """
+        This method moves to next_state after the simulated delay. Until then the
+        app is busy and drops keystrokes.
+
+        Parameters:
+            - next_state: the screen or dialog to show next
+        """
+
+        self.busy = True
+        self.enters = 0
+        delay = self.latency + random.uniform(0, self.jitter)
+
+        def finish() -> None:
+            self.busy = False
+            self.state = next_state
+            self.draw()
+
+        self.root.after(int(delay * 1000), finish)
+
+    def on_key(self, event:"tk.Event") -> None:
+        """
+        This method handles a keystroke in whatever screen or dialog is showing.
+        """
+
+        if self.busy:
+            return
+
+        key = event.keysym
+        if self.state == 'main':
+            # Only digits go into the order number, other letters are menu shortcuts
+            if len(key) == 1 and key.isdigit():
+                self.typed += key
+                self.draw()
+            elif key == 'Return' and self.typed:
+                # The first enter looks up the order and the second opens it
+                self.enters += 1
+                if self.enters == 2:
+                    self.open_order()
+
+        elif key == 'Return':
+            self.enters += 1
+            if self.state == 'warning':
+                self.respond('physician')
+            elif self.state == 'physician':
+                self.respond('whole')
+            elif self.state == 'whole' and self.enters == 2:
+                self.respond('additional')
+            elif self.state == 'additional':
+                self.respond('grid')
+            elif self.state == 'grid' and self.highlighted >= 0:
+                self.respond('date span')
+            elif self.state == 'date span' and self.enters == 2:
+                self.respond('grid')
+
+        elif self.state == 'grid' and key in ('Up', 'Down'):
+            step = -1 if key == 'Up' else 1
+            self.highlighted = min(len(self.rows) - 1, max(-1, self.highlighted + step))
+            self.draw()
+
+    def open_order(self) -> None:
+        """
+        This method loads the typed order's line items and opens it.
+        """
+
+        order_number = self.typed
+        self.rows = list(self.orders.get(order_number, random.sample(
+            ['RES 37296', 'RES 39102', 'FPHC482', 'FPX HC431A', 'REPR15', 'HCS A7035'], 3
+        )))
+        self.sort_direction = None
+        self.highlighted = -1
+        self.respond('warning' if order_number in self.already_selected else 'physician')
+
+    def sort_rows(self, event:"tk.Event" = None) -> None:
+        """
+        This method sorts the grid by item when the "Item" header is clicked, flipping
+        the direction on each click after the first.
+        """
+
+        if self.busy or self.state != 'grid':
+            return
+        self.sort_direction = 'descending' if self.sort_direction == 'ascending' else 'ascending'
+        self.rows.sort(reverse=self.sort_direction == 'descending')
+        self.draw()
+
+    def click_cancel(self, event:"tk.Event" = None) -> None:
+        """
+        This method asks to confirm closing the order when Cancel is clicked.
+        """
+
+        if not self.busy and self.state == 'grid':
+            self.respond('confirm')
+
+    def click_yes(self, event:"tk.Event" = None) -> None:
+        """
+        This method closes the order when Yes is clicked.
+        """
+
+        if not self.busy and self.state == 'confirm':
+            self.typed = ''
+            self.respond('main')
+
+    def draw_dialog(self, lines:list[str]) -> None:
+        """
+        This method draws a popup dialog with some lines of text in the middle of the window.
+        """
+
+        width, height = self.root.winfo_width(), self.root.winfo_height()
+        left, top = width // 2 - 220, height // 2 - 90
+        self.canvas.create_rectangle(left, top, left + 440, top + 180, fill='white', outline='#606060', width=2)
+        for i, line in enumerate(lines):
+            self.canvas.create_text(left + 30, top + 40 + 30 * i, text=line, anchor='w', font=FONT)
+
+    def draw(self) -> None:
+        """
+        This method redraws the window for the current state.
+        """
+
+        self.canvas.delete('all')
+        width = self.root.winfo_width()
+        self.canvas.create_text(20, 20, text='Order Entry', anchor='w', font=HEADER_FONT)
+        self.canvas.create_text(20, 60, text='Address', anchor='w', font=FONT)
+        self.canvas.create_text(20, 100, text='Order: ' + self.typed, anchor='w', font=FONT)
+
+        if self.state in ('grid', 'date span', 'confirm'):
+            columns = [('Item', 40), ('Description', 300), ('Qty', 600)]
+            header = {}
+            for name, x in columns:
+                header[name] = self.canvas.create_text(x, 160, text=name, anchor='w', font=HEADER_FONT)
+            self.canvas.tag_bind(header['Item'], '<Button-1>', self.sort_rows)
+
+            for i, row in enumerate(self.rows):
+                y = 200 + 32 * i
+                if i == self.highlighted:
+                    self.canvas.create_rectangle(30, y - 14, width - 30, y + 14, fill=HIGHLIGHT_COLOR, outline='')
+                self.canvas.create_text(40, y, text=row, anchor='w', font=FONT)
+                self.canvas.create_text(300, y, text='Supply', anchor='w', font=FONT)
+                self.canvas.create_text(600, y, text='1', anchor='w', font=FONT)
+
+            cancel = self.canvas.create_image(width - 160, 200 + 32 * len(self.rows) + 40, image=self.cancel_image, anchor='nw')
+            self.canvas.tag_bind(cancel, '<Button-1>', self.click_cancel)
+
+        if self.state == 'warning':
+            self.draw_dialog(['Warning', 'This order has already been selected.'])
+        elif self.state == 'physician':
+            self.draw_dialog(['Physician', 'Confirm the ordering physician.'])
+        elif self.state == 'whole':
+            self.draw_dialog(['Whole', 'Ship the whole order?'])
+        elif self.state == 'additional':
+            self.draw_dialog(['Additional', 'No additional information.'])
+        elif self.state == 'date span':
+            self.draw_dialog(['Date Span', 'Enter the date span for this item.'])
+        elif self.state == 'confirm':
+            self.draw_dialog(['Are you sure you want to cancel?'])
+            height = self.root.winfo_height()
+            yes = self.canvas.create_image(width // 2 - 45, height // 2 + 30, image=self.yes_image, anchor='nw')
+            self.canvas.tag_bind(yes, '<Button-1>', self.click_yes)
+
+    def run(self) -> None:
+        """
+        This method runs the window until it is closed.
+        """
+
+        self.root.mainloop()
+
+def main() -> None:
+    """
+    This function reads the simulator's settings from the command line and runs it.
+    """
+
+    parser = argparse.ArgumentParser(description='Simulate the TIMS Order Entry app.')
+    parser.add_argument('--orders', default=None, help='JSON file mapping order numbers to lists of product codes')
+    parser.add_argument('--already-selected', default='', help='comma separated orders that show the Warning popup')
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds before each dialog responds')
+    parser.add_argument('--jitter', type=float, default=0.2, help='most extra random seconds added to each response')
+    parser.add_argument('--assets', default='simulator_assets', help='folder to write the button reference images to')
+    args = parser.parse_args()
+
+    orders = {}
+    if args.orders:
+        with open(args.orders) as orders_file:
+            orders = json.load(orders_file)
+
+    already_selected = {order for order in args.already_selected.split(',') if order}
+    OrderEntrySimulator(orders, already_selected, args.latency, args.jitter, args.assets).run()
+
+if __name__ == "__main__":
+    main()
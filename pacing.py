@@ -0,0 +1,217 @@
+# A controller for how quickly the Selector types into the Order Entry app.
+
+import csv
+import time
+from typing import Callable, Optional
+from waiting import FrameWatcher
+from capture import CaptureBackend
+from recorder import FlightRecorder
+from metrics import Metrics
+
+try:
+    import pydirectinput
+except ImportError:
+    # pydirectinput only exists on Windows, and pyautogui has the same press function
+    import pyautogui as pydirectinput
+
+# The intervals, in seconds, that the Selector used to hardcode for each kind of keystroke.
+# Every action starts here and speeds up as the app proves it can keep up.
+DEFAULT_INTERVALS = {
+    'menu': 0.5,
+    'dialog': 0.5,
+    'order popup': 1.5,
+    'navigate': 0.1,
+    'field': 0.5,
+    'select': 0.5,
+    'ship qty': 0.5
+}
+
+class Pacer:
+    """
+    A class that presses keys for the Selector and adapts the interval between presses
+    to how fast the app actually responds. After each press it watches the window for a
+    change and moves on as soon as the app has reacted, never waiting longer than the
+    action's current interval. Each action's interval then follows the app's measured
+    response time, times a safety factor, within safe bounds. It backs off when presses
+    that should have had a visible effect go unanswered, and when a check that follows
+    the keystrokes fails.
+    It has the following attributes:
+      - intervals: a dictionary mapping each action to its current interval in seconds
+      - latencies: a dictionary mapping each action to its smoothed response time in seconds
+      - min_interval: the shortest interval any action can be paced at
+      - max_interval: the longest interval any action can be paced at
+      - safety_factor: how many times the measured response time the interval is set to
+      - settle_time: how long to wait after the app reacts before the next press
+      - poll_interval: how long to wait between grabs while watching for a reaction
+      - get_region: a function returning the (x, y, width, height) area to watch for reactions
+      - press_key: the function used to press a single key
+      - capture: the CaptureBackend used to watch for reactions (defaults to get_default_capture())
+      - recorder: an optional FlightRecorder that each key press is kept in
+      - metrics: an optional Metrics object that each burst of key presses is timed in
+      - last_action: the most recent action, which back_off applies to by default
+      - history: a list of dictionaries recording each burst and the pacing chosen for it
+    """
+
+    def __init__(self, get_region:Callable[[], Optional[tuple]] = lambda: None,
+                 intervals:Optional[dict] = None, min_interval:float = 0.05,
+                 max_interval:float = 3.0, safety_factor:float = 2.0, settle_time:float = 0.05,
+                 poll_interval:float = 0.01,
+                 press_key:Optional[Callable[[str], None]] = None,
+                 capture:Optional["CaptureBackend"] = None,
+                 recorder:Optional["FlightRecorder"] = None,
+                 metrics:Optional["Metrics"] = None):
+        self.intervals = dict(DEFAULT_INTERVALS if intervals is None else intervals)
+        self.latencies = {}
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.safety_factor = safety_factor
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        self.get_region = get_region
+        self.press_key = press_key if press_key is not None else pydirectinput.press
+        self.capture = capture
+        self.recorder = recorder
+        self.metrics = metrics
+        self.last_action = None
+        self.history = []
+
+    def get_interval(self, action:str) -> float:
+        """
+        This method returns the current interval for an action, starting unknown actions
+        at the longest interval.
+
+        Parameters:
+          - action: the kind of keystroke, e.g. 'dialog' or 'ship qty'
+        """
+
+        return self.intervals.setdefault(action, self.max_interval)
+
+    def press(self, action:str, key:str, presses:int = 1, expected_reactions:Optional[int] = None) -> None:
+        """
+        This method presses a key one or more times, waiting after each press until the
+        app reacts or the action's interval runs out, and then updates the interval.
+
+        Parameters:
+          - action: the kind of keystroke, e.g. 'dialog' or 'ship qty'
+          - key: the key to press
+          - presses: how many times to press it
+          - expected_reactions: how many of the presses should visibly change the window
+                                (defaults to all of them). Presses that are meant to do
+                                nothing, like extra 'up' presses to make sure the cursor
+                                is at the top, don't slow the action down when they go
+                                unanswered.
+        """
+
+        self.last_action = action
+        interval = self.get_interval(action)
+        watcher = FrameWatcher(self.get_region(), capture=self.capture)
+
+        burst_start = time.monotonic()
+        samples = []
+        for _ in range(presses):
+            watcher.changed()
+            start = time.monotonic()
+            if self.recorder is not None:
+                self.recorder.record('key', action=action, key=key)
+            self.press_key(key)
+
+            # Waiting for the app to react, but no longer than the current interval
+            while time.monotonic() - start < interval:
+                if watcher.changed():
+                    samples.append(time.monotonic() - start)
+                    time.sleep(self.settle_time)
+                    break
+                time.sleep(self.poll_interval)
+
+        for sample in samples:
+            self.record_latency(action, sample)
+
+        # A press the app should have reacted to but didn't within the interval may not have
+        # been taken in, so the interval isn't allowed to shrink that round, and it grows with
+        # the share of those presses that went unanswered
+        if expected_reactions is None:
+            expected_reactions = presses
+        unanswered = max(0, expected_reactions - len(samples))
+        if unanswered:
+            slower = min(self.max_interval, interval * (1 + unanswered / expected_reactions))
+            self.intervals[action] = max(self.intervals[action], slower)
+            self.latencies[action] = self.intervals[action] / self.safety_factor
+
+        if self.metrics is not None:
+            self.metrics.observe(f'keys: {action}', time.monotonic() - burst_start)
+            for sample in samples:
+                self.metrics.observe(f'app reaction: {action}', sample)
+            self.metrics.count(f'unanswered presses: {action}', unanswered)
+
+        self.history.append({
+            'time': time.time(),
+            'action': action,
+            'key': key,
+            'presses': presses,
+            'interval': interval,
+            'reactions': len(samples),
+            'mean latency': sum(samples) / len(samples) if samples else None,
+            'next interval': self.intervals[action]
+        })
+
+    def record_latency(self, action:str, latency:float) -> None:
+        """
+        This method folds a measured response time into the action's smoothed latency and
+        sets its interval from that.
+
+        Parameters:
+          - action: the kind of keystroke
+          - latency: how many seconds the app took to react to the keystroke
+        """
+
+        smoothed = self.latencies.get(action)
+        smoothed = latency if smoothed is None else 0.7 * smoothed + 0.3 * latency
+        self.latencies[action] = smoothed
+        self.intervals[action] = min(self.max_interval,
+                                     max(self.min_interval, self.safety_factor * smoothed))
+
+    def back_off(self, action:Optional[str] = None) -> None:
+        """
+        This method doubles an action's interval after a check that followed it failed,
+        e.g. because keystrokes were dropped.
+
+        Parameters:
+          - action: the kind of keystroke to slow down (defaults to the last one pressed)
+        """
+
+        if action is None:
+            action = self.last_action
+        if action is None:
+            return
+
+        interval = min(self.max_interval, 2 * self.get_interval(action))
+        self.intervals[action] = interval
+        self.latencies[action] = interval / self.safety_factor
+        print(f'Slowing down "{action}" keystrokes to {interval:.2f} seconds apart.')
+
+        self.history.append({
+            'time': time.time(),
+            'action': action,
+            'key': None,
+            'presses': 0,
+            'interval': interval,
+            'reactions': 0,
+            'mean latency': None,
+            'next interval': interval
+        })
+
+    def save(self, path:str) -> None:
+        """
+        This method writes the pacing history to a CSV file.
+
+        Parameters:
+          - path: the file to write
+        """
+
+        with open(path, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=[
+                'time', 'action', 'key', 'presses', 'interval',
+                'reactions', 'mean latency', 'next interval'
+            ])
+            writer.writeheader()
+            writer.writerows(self.history)
@@ -0,0 +1,180 @@
+# Downloads PODs with plain HTTP requests instead of clicking through the POD search page,
+# reusing the session the browser logged into.
+
+import os
+import re
+import threading
+import time
+import urllib3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Optional
+from selenium.webdriver.remote.webdriver import WebDriver
+from batching import AdaptiveBatcher
+import constants
+
+# The POD checkboxes in the search results, named after the document they select
+CHECKBOX_PATTERN = re.compile(r'<input[^>]*type="checkbox"[^>]*name="([^"]+)"', re.IGNORECASE)
+
+class PodHttpClient:
+    """
+    A class that searches for and downloads PODs over a pool of HTTP connections, with the
+    cookies of a browser session that has already logged in. It sends the same form fields
+    the POD search page does, so each download is one request instead of a round of clicks,
+    a confirmation popup and a new tab.
+    It has the following attributes:
+      - search_url: the URL the POD search form is submitted to
+      - download_url: the URL the selected PODs are downloaded from
+      - headers: the headers sent with every request, including the session's cookies
+      - pool: the urllib3 PoolManager the requests go through
+      - max_workers: how many downloads can run at once
+    """
+
+    def __init__(self, cookies:dict, search_url:str, download_url:str,
+                 user_agent:Optional[str] = None, max_workers:int = 4):
+        self.search_url = search_url
+        self.download_url = download_url
+        self.headers = {'Cookie': '; '.join(f'{name}={value}' for name, value in cookies.items())}
+        if user_agent:
+            self.headers['User-Agent'] = user_agent
+        self.max_workers = max_workers
+        self.pool = urllib3.PoolManager(
+            maxsize=max_workers, block=True,
+            retries=urllib3.Retry(total=3, backoff_factor=1, status_forcelist=(502, 503, 504))
+        )
+
+    @classmethod
+    def from_driver(cls, driver:"WebDriver", search_url:str = None, download_url:str = None,
+                    max_workers:int = 4) -> "PodHttpClient":
+        """
+        This method makes a client with the cookies and user agent of a logged in WebDriver.
+
+        Parameters:
+          - driver: the WebDriver that logged into Cardinal
+          - search_url: the URL the POD search form is submitted to (defaults to constants.POD_SEARCH_API)
+          - download_url: the URL PODs are downloaded from (defaults to constants.POD_DOWNLOAD_API)
+          - max_workers: how many downloads can run at once
+        """
+
+        cookies = {cookie['name']: cookie['value'] for cookie in driver.get_cookies()}
+        user_agent = driver.execute_script('return navigator.userAgent')
+        return cls(cookies,
+                   search_url or constants.POD_SEARCH_API,
+                   download_url or constants.POD_DOWNLOAD_API,
+                   user_agent, max_workers)
+
+    def search(self, min_date:"date", max_date:"date") -> list[str]:
+        """
+        This method searches for the PODs in a date range and returns their checkbox names,
+        which identify the documents when downloading them.
+
+        Parameters:
+          - min_date: the earliest date to look for PODs from
+          - max_date: the latest date to look for PODs from
+        """
+
+        response = self.pool.request('POST', self.search_url, headers=self.headers,
+                                     encode_multipart=False, fields={
+            'txtStartDate': min_date.strftime('%m/%d/%Y'),
+            'txtEndDate': max_date.strftime('%m/%d/%Y')
+        })
+        if response.status != 200:
+            raise ConnectionError(f'The POD search returned HTTP {response.status}.')
+
+        page = response.data.decode('utf-8', errors='replace')
+        return [name for name in CHECKBOX_PATTERN.findall(page) if 'chkAll' not in name]
+
+    def download(self, checkbox_names:list[str], folder:str) -> Optional[str]:
+        """
+        This method downloads a batch of PODs as one zip, streaming it to a file in folder.
+        It returns the path of the zip, or None if the portal answered with its error page.
+
+        Parameters:
+          - checkbox_names: the names of the checkboxes of the PODs to download
+          - folder: the folder to save the zip in
+        """
+
+        response = self.pool.request('POST', self.download_url, headers=self.headers,
+                                     encode_multipart=False, preload_content=False,
+                                     fields=[(name, 'on') for name in checkbox_names])
+        try:
+            first_chunk = response.read(4096)
+
+            # A zip starts with "PK", anything else is the error page
+            if response.status != 200 or not first_chunk.startswith(b'PK'):
+                text = first_chunk.decode('utf-8', errors='replace')
+                message = next((m for m in constants.POD_ERROR_MESSAGES if m in text), f'HTTP {response.status}')
+                print(f'Downloading {len(checkbox_names)} PODs failed: {message}')
+                return None
+
+            # Writing to a .part file first, so a broken download never looks like a finished zip
+            path = os.path.join(folder, self.get_filename(response, checkbox_names))
+            try:
+                with open(path + '.part', 'wb') as zip_file:
+                    zip_file.write(first_chunk)
+                    for chunk in response.stream(64 * 1024):
+                        zip_file.write(chunk)
+            except Exception:
+                os.remove(path + '.part')
+                raise
+            os.replace(path + '.part', path)
+            return path
+        finally:
+            response.release_conn()
+
+    def get_filename(self, response:"urllib3.HTTPResponse", checkbox_names:list[str]) -> str:
+        """
+        This method returns the name to save a downloaded zip under: the one the server
+        gives, or one made from the first POD in the batch.
+        """
+
+        disposition = response.headers.get('Content-Disposition', '')
+        match = re.search(r'filename="?([^";]+)"?', disposition)
+        name = match.group(1) if match else f'PODs {checkbox_names[0]} x{len(checkbox_names)}.zip'
+
+        # Keeping the name of every batch unique, since the server may reuse names
+        stem, extension = os.path.splitext(os.path.basename(name))
+        return f'{stem} {threading.get_ident()}-{time.monotonic_ns()}{extension or ".zip"}'
+
+    def download_all(self, checkbox_names:list[str], folder:str,
+                     initial_batch_size:int = 25, backoff:float = 5) -> tuple[list[str], list[str]]:
+        """
+        This method downloads PODs in adaptive batches over max_workers connections at once.
+        The PODs are split into one share per worker, and each worker sizes its batches with
+        its own AdaptiveBatcher. It returns the paths of the zips and the names of the PODs
+        that couldn't be downloaded.
+
+        Parameters:
+          - checkbox_names: the names of the checkboxes of the PODs to download
+          - folder: the folder to save the zips in
+          - initial_batch_size: the size of each worker's first batch
+          - backoff: how many seconds a worker waits after a failed batch before the next try
+        """
+
+        paths = []
+        lock = threading.Lock()
+
+        def download_share(share:list[str]) -> "AdaptiveBatcher":
+            batcher = AdaptiveBatcher(initial_size=initial_batch_size, backoff=backoff)
+
+            def process_batch(batch:list[str]) -> bool:
+                path = self.download(batch, folder)
+                if path is not None:
+                    with lock:
+                        paths.append(path)
+                return path is not None
+
+            batcher.run(share, process_batch)
+            return batcher
+
+        shares = [checkbox_names[i::self.max_workers] for i in range(self.max_workers)]
+        start = time.monotonic()
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            batchers = list(executor.map(download_share, [share for share in shares if share]))
+        elapsed = time.monotonic() - start
+
+        succeeded = sum(len(batcher.succeeded) for batcher in batchers)
+        failed = [name for batcher in batchers for name in batcher.failed]
+        print(f'Downloaded {succeeded} PODs in {len(paths)} zips over {self.max_workers} connections '
+              f'in {elapsed:.1f} seconds ({succeeded / (elapsed / 60) if elapsed else 0:.1f} PODs/minute).')
+        return paths, failed
@@ -0,0 +1,187 @@
+# A flight recorder for the Selector. It keeps the last few screen grabs, OCR results and
+# keystrokes/clicks in memory and only writes them to disk when a run fails (or when asked),
+# so there is something to look at after a stall without slowing every grab down.
+#
+# A flushed recording can be replayed with:
+#     python recorder.py "Flight Recording 2024-01-01 12-00-00" [--ocr]
+
+import argparse
+import collections
+import json
+import os
+import time
+import pandas as pd
+import PIL.Image
+from datetime import datetime
+from typing import Optional
+
+class FlightRecorder:
+    """
+    A class that keeps ring buffers of what the Selector saw and did. Recording only
+    appends a reference to a deque, so it costs next to nothing in the hot loop; the
+    images and DataFrames are only encoded and written when the recorder is flushed.
+    It has the following attributes:
+      - events: a deque of the latest events, each a dictionary with a 'time', a 'kind'
+                ('frame', 'ocr', 'key', 'write', 'click' or 'note') and the event's details
+      - frames: a deque of the latest (event index, Image) pairs. Frames are big, so fewer
+                of them are kept than events.
+      - ocr_results: a deque of the latest (event index, DataFrame) pairs
+      - count: how many events have been recorded in total, used to index them
+      - start: the time.monotonic() the recorder was made at
+    """
+
+    def __init__(self, max_events:int = 2000, max_frames:int = 20):
+        self.events = collections.deque(maxlen=max_events)
+        self.frames = collections.deque(maxlen=max_frames)
+        self.ocr_results = collections.deque(maxlen=max_frames)
+        self.count = 0
+        self.start = time.monotonic()
+
+    def record(self, kind:str, **details) -> int:
+        """
+        This method records an event and returns its index.
+
+        Parameters:
+          - kind: what kind of event it is, e.g. 'key' or 'click'
+          - details: anything else worth knowing about it, which has to be JSON serializable
+        """
+
+        index = self.count
+        self.count += 1
+        self.events.append({'index': index, 'time': time.monotonic() - self.start, 'kind': kind, **details})
+        return index
+
+    def record_frame(self, image:"PIL.Image.Image", origin:tuple = (0, 0)) -> int:
+        """
+        This method records a screen grab, as it was grabbed, and where on screen it came from.
+
+        Parameters:
+          - image: the screen grab
+          - origin: the screen coordinates of the grab's top left corner
+        """
+
+        index = self.record('frame', origin=list(origin), size=list(image.size))
+        self.frames.append((index, image))
+        return index
+
+    def record_ocr(self, data:"pd.DataFrame", scale:float = 1) -> int:
+        """
+        This method records the OCR data read from the latest frame.
+
+        Parameters:
+          - data: the DataFrame from pytesseract.image_to_data
+          - scale: how much the frame was upscaled before it was OCR'd
+        """
+
+        index = self.record('ocr', scale=scale)
+        self.ocr_results.append((index, data))
+        return index
+
+    def flush(self, folder:Optional[str] = None, reason:str = '') -> str:
+        """
+        This method writes everything in the buffers to a folder and returns its path. The
+        buffers are left as they are, so the recorder keeps going.
+
+        Parameters:
+          - folder: where to write the recording (defaults to a new timestamped folder)
+          - reason: why the recording was flushed, e.g. the exception that stopped the run
+        """
+
+        if folder is None:
+            folder = f'Flight Recording {datetime.now():%Y-%m-%d %H-%M-%S}'
+        os.makedirs(folder, exist_ok=True)
+
+        for index, image in self.frames:
+            image.save(os.path.join(folder, f'frame_{index:06d}.png'))
+        for index, data in self.ocr_results:
+            data.to_csv(os.path.join(folder, f'ocr_{index:06d}.tsv'), sep='\t', index=False)
+
+        with open(os.path.join(folder, 'events.jsonl'), 'w') as events_file:
+            for event in self.events:
+                events_file.write(json.dumps(event, default=str) + '\n')
+
+        with open(os.path.join(folder, 'reason.txt'), 'w') as reason_file:
+            reason_file.write(reason)
+
+        print(f'Flight recording saved to {folder}.')
+        return folder
+
+def load_recording(folder:str) -> list[dict]:
+    """
+    This function reads a flushed recording back in. It returns the events in order, with
+    each frame event's Image under 'image' and each OCR event's DataFrame under 'data'
+    (when they were still in the buffers at the time of the flush).
+
+    Parameters:
+      - folder: the folder the recording was flushed to
+    """
+
+    events = []
+    with open(os.path.join(folder, 'events.jsonl')) as events_file:
+        for line in events_file:
+            event = json.loads(line)
+            if event['kind'] == 'frame':
+                path = os.path.join(folder, f"frame_{event['index']:06d}.png")
+                if os.path.exists(path):
+                    with PIL.Image.open(path) as image:
+                        event['image'] = image.copy()
+            elif event['kind'] == 'ocr':
+                path = os.path.join(folder, f"ocr_{event['index']:06d}.tsv")
+                if os.path.exists(path):
+                    event['data'] = pd.read_csv(path, sep='\t', keep_default_na=False)
+            events.append(event)
+    return events
+
+def get_words(data:"pd.DataFrame") -> list[str]:
+    """
+    This function returns the non-empty words in some OCR data.
+
+    Parameters:
+      - data: a DataFrame from pytesseract.image_to_data
+    """
+
+    return [str(word) for word in data['text'] if str(word).strip() and str(word) != 'nan']
+
+def main() -> None:
+    """
+    This function replays a flushed recording: it prints the timeline of what the Selector
+    saw and did, and can run the frames through OCR again to compare with what was read
+    at the time (e.g. after changing the Preprocessor).
+    """
+
+    parser = argparse.ArgumentParser(description='Replay a Selector flight recording.')
+    parser.add_argument('folder', help='the folder the recording was flushed to')
+    parser.add_argument('--ocr', action='store_true', help='OCR each frame again and show what changed')
+    parser.add_argument('--tesseract-cmd', default=None, help='path to the tesseract executable')
+    args = parser.parse_args()
+
+    if args.ocr:
+        import pytesseract
+        from ocr import Preprocessor, parse_ocr_data
+        if args.tesseract_cmd:
+            pytesseract.pytesseract.tesseract_cmd = args.tesseract_cmd
+        preprocessor = Preprocessor()
+
+    with open(os.path.join(args.folder, 'reason.txt')) as reason_file:
+        print(f'Reason: {reason_file.read() or "(none given)"}')
+
+    last_frame = None
+    for event in load_recording(args.folder):
+        details = {key: value for key, value in event.items()
+                   if key not in ('index', 'time', 'kind', 'image', 'data')}
+        print(f"{event['time']:9.3f}s  {event['kind']:<6} {details}")
+
+        if event['kind'] == 'frame':
+            last_frame = event.get('image')
+        elif event['kind'] == 'ocr' and 'data' in event:
+            words = get_words(event['data'])
+            print(f"{'':17}read: {' '.join(words)}")
+
+            if args.ocr and last_frame is not None:
+                image, _ = preprocessor.process(last_frame)
+                new_words = get_words(parse_ocr_data(pytesseract.image_to_data(image)))
+                if new_words != words:
+                    print(f"{'':17}now reads: {' '.join(new_words)}")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import pandas as pd
 from datetime import datetime, date
 import constants
+import os
 
 def format_open_orders_df(df:"pd.DataFrame") -> tuple["pd.DataFrame"]:
     """
@@ -182,4 +183,89 @@ def get_selectable_items(delivered:"pd.DataFrame",
     # Setting the index to be a multi-index of Order number and Product Code
     selectable_items = selectable_items.set_index(["Order Number", "Product Code"])
     
-    return selectable_items
\ No newline at end of file
+    return selectable_items
+
+# The columns of the bulk selection import file, in order
+BULK_IMPORT_COLUMNS = ['Order Number', 'Product Code', 'Quantity', 'Ship Date', 'Delivery Date']
+
+def validate_bulk_selection(selectable_items:"pd.DataFrame") -> tuple["pd.DataFrame"]:
+    """
+    This function checks each selectable line item against what the bulk import accepts.
+    It returns a DataFrame of the valid lines in the bulk import's columns, and a DataFrame
+    of the rejected lines (indexed like selectable_items, so they can go straight to 
+    run_selection_script) with a 'Rejection Reason' column.
+
+    Parameters:
+        - selectable_items: the DataFrame returned by get_selectable_items
+    """
+
+    df = selectable_items.reset_index()
+
+    quantity = pd.to_numeric(df['Quantity'], errors='coerce')
+    ship_date = pd.to_datetime(df['Ship Date'], errors='coerce')
+    delivery_date = pd.to_datetime(df['Delivery Date'], errors='coerce')
+
+    # Checking every rule at once, keeping the first reason each line fails for
+    rules = [
+        (~df['Order Number'].astype(str).str.fullmatch(r'\d+'), 'Order Number is not a number'),
+        (df['Product Code'].isna() | (df['Product Code'].astype(str).str.strip() == ''), 'Product Code is missing'),
+        (quantity.isna() | (quantity <= 0) | (quantity % 1 != 0), 'Quantity is not a positive whole number'),
+        (ship_date.isna(), 'Ship Date is missing'),
+        (delivery_date.isna(), 'Delivery Date is missing'),
+        (delivery_date < ship_date, 'Delivery Date is before Ship Date'),
+        (delivery_date > pd.Timestamp(datetime.now()), 'Delivery Date is in the future')
+    ]
+
+    reasons = pd.Series('', index=df.index)
+    for failed, reason in rules:
+        reasons = reasons.mask(failed.fillna(False).astype(bool) & (reasons == ''), reason)
+
+    # Every line of an order is selected in one go, so an order with any rejected line
+    # is left entirely to the Selector
+    rejected_orders = df.loc[reasons != '', 'Order Number'].unique()
+    reasons = reasons.mask(df['Order Number'].isin(rejected_orders) & (reasons == ''), 
+                           'Another line on the order was rejected')
+
+    valid = df[reasons == ''].copy()
+    valid['Quantity'] = quantity[reasons == ''].astype('int64')
+    valid['Ship Date'] = ship_date[reasons == ''].dt.strftime('%m/%d/%Y')
+    valid['Delivery Date'] = delivery_date[reasons == ''].dt.strftime('%m/%d/%Y')
+    valid = valid[BULK_IMPORT_COLUMNS]
+
+    rejected = df[reasons != ''].copy()
+    rejected['Rejection Reason'] = reasons[reasons != '']
+    rejected = rejected.set_index(['Order Number', 'Product Code'])
+
+    return valid, rejected
+
+def export_bulk_selection(valid:"pd.DataFrame", folder:str = '.', chunk_size:int = 500) -> list[str]:
+    """
+    This function writes the valid line items to CSV files for the bulk import, at most
+    chunk_size lines per file, without splitting an order across files. It returns the
+    paths of the files it wrote.
+
+    Parameters:
+        - valid: the valid lines returned by validate_bulk_selection
+        - folder: the folder to write the files to
+        - chunk_size: the most lines in one file
+    """
+
+    chunks = []
+    current = []
+    current_size = 0
+    for _, order_lines in valid.groupby('Order Number', sort=True):
+        if current and current_size + len(order_lines) > chunk_size:
+            chunks.append(current)
+            current, current_size = [], 0
+        current.append(order_lines)
+        current_size += len(order_lines)
+    if current:
+        chunks.append(current)
+
+    paths = []
+    for i, chunk in enumerate(chunks):
+        path = os.path.join(folder, f'{date.today()} Bulk Selection {i + 1} of {len(chunks)}.csv')
+        pd.concat(chunk).to_csv(path, index=False, columns=BULK_IMPORT_COLUMNS)
+        paths.append(path)
+
+    return paths
@@ -2,37 +2,128 @@ from reference_images import *
 import PIL.Image
 import pyautogui
 import pytesseract
-import win32gui
 import re
+import functools
 import pandas as pd
-import win32con
-from AppOpener import open as open_app
+import subprocess
 import time
 import PIL
-import pydirectinput
 import numpy as np
 import csv
+import json
+import os
 import pandas as pd
 from typing import Optional
+from ocr import Preprocessor, ocr_image_tiled, parse_ocr_data
+from matching import TemplateMatcher
+from waiting import poll, wait_until
+from pacing import Pacer
+from journal import SelectionJournal
+from capture import CaptureBackend, get_default_capture
+from recorder import FlightRecorder
+from metrics import Metrics, timed_method
+
+try:
+    import win32gui
+    import win32con
+    import pydirectinput
+    from AppOpener import open as open_app
+except ImportError:
+    # These only exist on Windows. Elsewhere (e.g. on a Linux virtual display) windows
+    # are managed by X11WindowMgr and pyautogui sends the input instead.
+    win32gui = None
+    win32con = None
+    pydirectinput = pyautogui
+    open_app = None
+
+class StepFailed(Exception):
+    """
+    Raised when a step of working an order doesn't go through, e.g. a button that
+    couldn't be found, so the order isn't recorded as further along than it got.
+    """
+
+class TitleMatcher:
+    """
+    A precompiled window title pattern, so that the regular expression isn't parsed
+    again every time a window is looked up. Get one with get_title_matcher, which
+    reuses the matcher for patterns it has already seen.
+    It has the following attributes:
+      - wildcard: the regular expression the title should match from its start
+      - pattern: the compiled regular expression
+    """
+
+    def __init__(self, wildcard:str):
+        self.wildcard = wildcard
+        self.pattern = re.compile(wildcard)
+
+    def matches(self, title:Optional[str]) -> bool:
+        """
+        This method returns whether a window title matches the pattern.
+        """
+        return title is not None and self.pattern.match(title) is not None
+
+@functools.lru_cache(maxsize=None)
+def get_title_matcher(wildcard:str) -> "TitleMatcher":
+    """
+    This function returns the TitleMatcher for a wildcard, only compiling it the first time.
+    """
+    return TitleMatcher(wildcard)
 
 class WindowMgr:
     """
-    Encapsulates some calls to the win32gui for window management
+    Encapsulates some calls to the win32gui for window management. 
+    The handle found for each wildcard and the active window's rectangle are cached, so
+    looking the same window up again doesn't go through every open window, and getting
+    its rectangle doesn't ask Windows again until the window is focused, maximized or
+    moved (or invalidate is called).
     """
 
     def __init__ (self):
         self._handle = None
+        self._rect = None
+        self._handles = {}
+
+    def has_window(self) -> bool:
+        """
+        This method returns whether a window has been found by one of the find methods.
+        """
+        return bool(self._handle)
+
+    def _set_handle(self, handle) -> None:
+        """
+        This method makes handle the active window, forgetting the cached rectangle if it changed.
+        """
+        if handle != self._handle:
+            self._rect = None
+        self._handle = handle
+
+    def invalidate(self) -> None:
+        """
+        This method forgets the active window's cached rectangle, e.g. after it was moved.
+        """
+        self._rect = None
 
     def find_window(self, class_name:str, window_name:Optional[str] = None) -> None:
         """
         This method finds a window by its class_name
         """
-        self._handle = win32gui.FindWindow(class_name, window_name)
+        self._set_handle(win32gui.FindWindow(class_name, window_name))
 
-    def get_window_rect(self) -> tuple:
+    def get_window_rect(self, refresh:bool = False) -> tuple:
         """
         This method gets the tuple representing the x, y, width, and height of 
-        the active window.
+        the active window. 
+
+        Parameters:
+          - refresh: whether to ask for the rectangle again instead of using the cached one
+        """
+        if self._rect is None or refresh:
+            self._rect = self._read_window_rect()
+        return self._rect
+
+    def _read_window_rect(self) -> tuple:
+        """
+        This method asks Windows for the x, y, width, and height of the active window.
         """
         rect = win32gui.GetWindowRect(self._handle)
         x = rect[0]
@@ -42,25 +133,54 @@ class WindowMgr:
 
         return (x , y, width, height)
 
-    def _window_enum_callback(self, hwnd, wildcard:str) -> None:
+    def _get_window_title(self, handle) -> Optional[str]:
+        """
+        This method returns a window's title, or None if the window no longer exists.
+        """
+        if not win32gui.IsWindow(handle):
+            return None
+        return str(win32gui.GetWindowText(handle))
+
+    def _window_enum_callback(self, hwnd, matcher:"TitleMatcher") -> None:
         """
         This method passes to win32gui.EnumWindows() to check all the opened windows.
         """
-        if re.match(wildcard, str(win32gui.GetWindowText(hwnd))) is not None:
-            self._handle = hwnd
+        if matcher.matches(str(win32gui.GetWindowText(hwnd))):
+            self._found = hwnd
+
+    def _search_windows(self, matcher:"TitleMatcher"):
+        """
+        This method goes through every open window and returns the handle of the last one
+        whose title matches, or None.
+        """
+        self._found = None
+        win32gui.EnumWindows(self._window_enum_callback, matcher)
+        return self._found
 
     def find_window_wildcard(self, wildcard:str) -> None:
         """
         This method finds a window whose title matches the wildcard regular expression.
+        If the window found for this wildcard last time is still open and still matches,
+        it is used without going through all the other windows.
         """
-        self._handle = None
-        win32gui.EnumWindows(self._window_enum_callback, wildcard)
+        matcher = get_title_matcher(wildcard)
+
+        handle = self._handles.get(wildcard)
+        if handle is None or not matcher.matches(self._get_window_title(handle)):
+            handle = self._search_windows(matcher)
+            if handle is None:
+                self._handles.pop(wildcard, None)
+            else:
+                self._handles[wildcard] = handle
+
+        self._set_handle(handle)
 
     def set_foreground(self) -> None:
         """
         This method puts the active window in the foreground. 
         """
         win32gui.SetForegroundWindow(self._handle)
+        self.invalidate()
 
     def maximize_window(self) -> None:
         """
@@ -72,6 +192,173 @@ class WindowMgr:
             pyautogui.size()[1],
             win32con.SWP_SHOWWINDOW
         )
+        self.invalidate()
+
+class X11WindowMgr(WindowMgr):
+    """
+    A WindowMgr for X11 displays (like the Xvfb displays used by selection workers),
+    which makes the same calls through the xdotool command line tool.
+    """
+
+    def _xdotool(self, *args:str) -> str:
+        """
+        This method runs an xdotool command on the current DISPLAY and returns its output.
+        """
+        if None in args:
+            # The window handle is None when no window has been found yet
+            raise RuntimeError(f'xdotool {args[0]} needs a window, but none has been found.')
+        result = subprocess.run(['xdotool', *args], capture_output=True, text=True)
+        return result.stdout.strip()
+
+    def find_window(self, class_name:str, window_name:Optional[str] = None) -> None:
+        """
+        This method finds a window by its class_name
+        """
+        handles = self._xdotool('search', '--class', class_name).split()
+        if window_name is not None:
+            handles = [h for h in handles if self._xdotool('getwindowname', h) == window_name]
+        self._set_handle(handles[-1] if handles else None)
+
+    def _read_window_rect(self) -> tuple:
+        """
+        This method asks xdotool for the x, y, width, and height of the active window.
+        """
+        if self._handle is None:
+            raise RuntimeError('There is no active window to get the rectangle of.')
+        geometry = dict(
+            line.split('=') for line in self._xdotool('getwindowgeometry', '--shell', self._handle).splitlines()
+        )
+        return (int(geometry['X']), int(geometry['Y']), int(geometry['WIDTH']), int(geometry['HEIGHT']))
+
+    def _get_window_title(self, handle) -> Optional[str]:
+        """
+        This method returns a window's title, or None if the window no longer exists.
+        """
+        if handle is None:
+            return None
+        result = subprocess.run(['xdotool', 'getwindowname', handle], capture_output=True, text=True)
+        return result.stdout.strip() if result.returncode == 0 else None
+
+    def _search_windows(self, matcher:"TitleMatcher"):
+        """
+        This method goes through every open window and returns the handle of the last one
+        whose title matches, or None.
+        """
+        found = None
+        for handle in self._xdotool('search', '--name', '.*').split():
+            if matcher.matches(self._xdotool('getwindowname', handle)):
+                found = handle
+        return found
+
+    def set_foreground(self) -> None:
+        """
+        This method puts the active window in the foreground. 
+        """
+        self._xdotool('windowraise', self._handle)
+        self._xdotool('windowfocus', self._handle)
+        self.invalidate()
+
+    def maximize_window(self) -> None:
+        """
+        This method maximizes the active window. 
+        """
+        screen_width, screen_height = pyautogui.size()
+        self._xdotool('windowmove', self._handle, '0', '0')
+        self._xdotool('windowsize', self._handle, str(screen_width), str(screen_height))
+        self.invalidate()
+
+class RoiMap:
+    """
+    A class that remembers where target words were last found relative to the window 
+    they were found in. This lets the Selector OCR a small padded rectangle around the
+    last known position of a word instead of the whole window. 
+    It has the following attributes:
+      - padding: the number of pixels added to each side of a remembered word box
+      - path: an optional JSON file that the map is loaded from and saved to
+      - regions: a dictionary mapping each target word to its (left, top, width, height)
+                 box relative to the top left corner of the window it was found in
+    """
+
+    def __init__(self, padding:int = 60, path:Optional[str] = None):
+        self.padding = padding
+        self.path = path
+        self.regions = {}
+
+        if path is not None and os.path.exists(path):
+            with open(path, 'r') as roi_file:
+                self.regions = {k: tuple(v) for k, v in json.load(roi_file).items()}
+
+    def plan(self, target_word:str, window_rect:tuple) -> tuple | None:
+        """
+        This method returns the padded screen rectangle to search for target_word in,
+        clipped to the window, or None if the word has not been found before.
+
+        Parameters:
+          - target_word: the word that is about to be searched for
+          - window_rect: the (x, y, width, height) tuple of the window being searched
+        """
+
+        if target_word not in self.regions:
+            return None
+
+        left, top, width, height = self.regions[target_word]
+
+        # Padding the remembered box and keeping it inside of the window
+        roi_left = max(0, left - self.padding)
+        roi_top = max(0, top - self.padding)
+        roi_right = min(window_rect[2], left + width + self.padding)
+        roi_bottom = min(window_rect[3], top + height + self.padding)
+
+        if roi_right <= roi_left or roi_bottom <= roi_top:
+            return None
+
+        return (
+            window_rect[0] + roi_left,
+            window_rect[1] + roi_top,
+            roi_right - roi_left,
+            roi_bottom - roi_top
+        )
+
+    def learn(self, target_word:str, word_box:tuple, window_rect:tuple) -> None:
+        """
+        This method records where target_word was just found, relative to the window.
+
+        Parameters:
+          - target_word: the word that was found
+          - word_box: the (left, top, width, height) screen coordinates of the word
+          - window_rect: the (x, y, width, height) tuple of the window it was found in
+        """
+
+        self.regions[target_word] = (
+            int(word_box[0] - window_rect[0]),
+            int(word_box[1] - window_rect[1]),
+            int(word_box[2]),
+            int(word_box[3])
+        )
+        self.save()
+
+    def forget(self, target_word:str) -> None:
+        """
+        This method drops the remembered position of target_word, e.g. when the 
+        layout of the window has changed.
+
+        Parameters:
+          - target_word: the word to forget
+        """
+
+        self.regions.pop(target_word, None)
+        self.save()
+
+    def save(self) -> None:
+        """
+        This method writes the map to its JSON file, if it has one.
+        """
+
+        if self.path is None:
+            return
+
+        with open(self.path, 'w') as roi_file:
+            json.dump(self.regions, roi_file, indent=4)
 
 class Selector:
     """
@@ -80,43 +367,60 @@ class Selector:
       - An Eye that leverages computer vision to find coordinates on the page
       - A Hand that clicks on a word found by the eye.
       - A WindowMgr to handle window operations like searching, maximizing, and activating. 
+      - A RoiMap that remembers where target words were last seen in the window
+      - A TemplateMatcher that holds the decoded reference images
+      - A Pacer that presses keys as quickly as the Order Entry app can keep up with
+      - An optional SelectionJournal that records how far each order has gotten
+      - A CaptureBackend that everything above grabs the screen with
+      - A FlightRecorder that keeps the latest grabs, OCR results and input in memory
+      - A Metrics object that collects the latency of each action, per order and per run
     """
 
-    def __init__(self):
-        self.eye = Eye()
-        self.hand = Hand()
-        self.wmgr = WindowMgr()
+    def __init__(self, roi_map_path:Optional[str] = None, tiled_ocr:bool = False, 
+                 journal:Optional["SelectionJournal"] = None, 
+                 capture:Optional["CaptureBackend"] = None):
+        self.capture = capture if capture is not None else get_default_capture()
+        self.recorder = FlightRecorder()
+        self.metrics = Metrics()
+        self.eye = Eye(tiled=tiled_ocr, capture=self.capture, recorder=self.recorder, 
+                       metrics=self.metrics)
+        self.hand = Hand(recorder=self.recorder, metrics=self.metrics)
+        self.wmgr = WindowMgr() if win32gui is not None else X11WindowMgr()
+        self.roi_map = RoiMap(path=roi_map_path)
+        self.matcher = TemplateMatcher({
+            'CATEGORIES_TAB': CATEGORIES_TAB,
+            'UNCATEGORIZED_TAB': UNCATEGORIZED_TAB,
+            'TIMS_LOGO': TIMS_LOGO,
+            'CANCEL_BTN': CANCEL_BTN,
+            'YES_BTN': YES_BTN
+        }, capture=self.capture)
+        self.pacer = Pacer(get_region=self.get_search_rect, capture=self.capture, 
+                           recorder=self.recorder, metrics=self.metrics)
+        self.journal = journal
+        self.current_order = None
 
     def open_order_entry(self) -> None:
         """
         This method opens Citrix Workspace and then Total Information Management System (TIMS)
         using computer vision to navigate the screen. When TIMS opens, it automatically opens
-        the Order Entry app. The method then sleeps while the app opens. 
+        the Order Entry app. The method then waits for the app's window to open. 
         """
 
         open_app("Citrix Workspace")
-        time.sleep(10)
+        if not self.wait_for_window("^Citrix Workspace$", timeout=60):
+            raise StepFailed("Citrix Workspace didn't open.")
 
-        self.wmgr.find_window_wildcard("^Citrix Workspace$")
         self.wmgr.set_foreground()
         self.wmgr.maximize_window()
 
-        self.wait_until_seen("Apps")
-
-        categories_coords = pyautogui.locateCenterOnScreen(CATEGORIES_TAB, confidence=0.7)
-        pydirectinput.click(categories_coords.x, categories_coords.y)
-
-        time.sleep(0.5)
-
-        uncategorized_coords = pyautogui.locateCenterOnScreen(UNCATEGORIZED_TAB, confidence=0.7)
-        pydirectinput.click(uncategorized_coords.x, uncategorized_coords.y)
+        self.wait_until_seen("Apps", timeout=60, required=True)
 
-        time.sleep(0.5)
+        self.click_reference_image('CATEGORIES_TAB', confidence=0.7)
+        self.click_reference_image('UNCATEGORIZED_TAB', confidence=0.7)
+        self.click_reference_image('TIMS_LOGO', confidence=0.7)
 
-        tims_logo_coords = pyautogui.locateCenterOnScreen(TIMS_LOGO, confidence=0.7)
-        pydirectinput.click(tims_logo_coords.x, tims_logo_coords.y)
-
-        time.sleep(40)
+        if not self.wait_for_window(".*Order Entry.*", timeout=120):
+            raise StepFailed("The Order Entry app didn't open.")
 
         self.set_selection_mode()
 
@@ -131,20 +435,22 @@ class Selector:
         
         self.wmgr.set_foreground()
         self.wmgr.maximize_window()
-        self.wait_until_seen("Address", self.wmgr.get_window_rect())
+        self.wait_until_seen("Address", self.wmgr.get_window_rect(), timeout=60, required=True)
 
-        pydirectinput.press('alt', 1, 0.5)
-        pydirectinput.press('alt', 1, 0.5)
+        self.pacer.press('menu', 'alt')
+        self.pacer.press('menu', 'alt')
         print("pressing m")
-        pydirectinput.press('m', 1, 0.5)
+        self.pacer.press('menu', 'm')
         print("pressing s")
-        pydirectinput.press('s', 1, 0.5)
-        pydirectinput.press('shift', 1, 0.5)
-        pydirectinput.press('shift', 1, 0.5)
+        self.pacer.press('menu', 's')
+        self.pacer.press('menu', 'shift', expected_reactions=0)
+        self.pacer.press('menu', 'shift', expected_reactions=0)
 
-        pydirectinput.press("enter", 3, 0.5)
-        pyautogui.write("LB", interval=0.5)
-        pydirectinput.press("enter", 2, 0.5)
+        self.pacer.press('dialog', "enter", 3)
+        self.recorder.record('write', text="LB")
+        with self.metrics.timed('write: initials'):
+            pyautogui.write("LB", interval=0.5)
+        self.pacer.press('dialog', "enter", 2)
 
     def get_order_line_items(self, order_number:str, order_line_items:"pd.DataFrame") -> None:
         """
@@ -157,60 +463,135 @@ class Selector:
           - order_line_items (DataFrame): each individual order's worth of items 
         """
 
-        pydirectinput.write(order_number)
+        self.current_order = order_number
+        self.metrics.start_order(order_number)
+        self.recorder.record('write', text=order_number)
+        with self.metrics.timed('write: order number'):
+            pydirectinput.write(order_number)
 
-        pydirectinput.press("enter", 2, 1.5)
+        self.pacer.press('order popup', "enter", 2)
 
         if self.check_if_already_selected():
-            pydirectinput.press("enter", 1, 1.5)
+            self.pacer.press('order popup', "enter")
 
         self.wait_until_seen("Physician")
 
-        pydirectinput.press("enter", 1, 1.5)
+        self.pacer.press('order popup', "enter")
 
         self.wait_until_seen("Whole")
 
-        pydirectinput.press("enter", 2, 1.5)
+        self.pacer.press('order popup', "enter", 2)
 
         self.wait_until_seen("Additional")
 
-        pydirectinput.press("enter", 1, 1.5)
-
-        self.wait_until_seen("Item", rect=self.wmgr.get_window_rect())
+        self.pacer.press('order popup', "enter")
 
-        self.eye.get_screen_grab_data(self.wmgr.get_window_rect())
+        # The order only counts as opened once its line item grid shows
+        self.wait_until_seen("Item", rect=self.wmgr.get_window_rect(), required=True)
+        self.record_state('opened')
 
         self.sort_items(order_line_items)
+        self.record_state('sorted')
 
-    def sort_items(self, order_line_items:"pd.DataFrame") -> None:
+    def sort_items(self, order_line_items:"pd.DataFrame", plan:bool = True, max_clicks:int = 4) -> None:
         """
         This method clicks on the "Item" filter button until the item in first position
         on the list of selectable items is in the first position on the list of orders in
-        the Order Entry app. This makes it easier to process the orders accordingly. 
+        the Order Entry app. This makes it easier to process the orders accordingly. It 
+        raises StepFailed if the item still isn't first after max_clicks clicks.
         
         Parameters:
           - order_line_items (DataFrame): each individual order's worth of items. 
+          - plan: whether to first try planning the clicks from a single read of the grid,
+                  falling back to clicking and checking if the plan doesn't check out
+          - max_clicks: the most times to click the "Item" filter button when not planning
         """
+
+        if plan and self.sort_items_from_grid(order_line_items):
+            return
         
         # Click the "Item" filter button
         self.hand.click_from_screen(self.eye, "Item")
 
-        # Reset the cursor to the top of the list of items (i.e. the row of headers)
-        for i in range(len(order_line_items)+5):
-            pydirectinput.press('up')
+        # Reset the cursor to the top of the list of items (i.e. the row of headers). The
+        # cursor may already be there, so none of these presses have to move it.
+        self.pacer.press('navigate', 'up', len(order_line_items)+5, expected_reactions=0)
         # Move down one line to the first item. 
-        pydirectinput.press('down')
+        self.pacer.press('navigate', 'down')
 
         # Saving shorthand version of first item for comparison
         first_item_shorthand = order_line_items.iloc[0]["Product Code"][-5:]
 
         # Searching for the first item in the highlighted box, then continuing
         # to click the "Item" filter button until things align. 
+        clicks = 1
         while not self.eye.check_highlighted_item(self.wmgr, self.eye.find_highlight_on_screen(self.wmgr), first_item_shorthand):
+            if clicks >= max_clicks:
+                raise StepFailed(f'"{first_item_shorthand}" was still not first after {clicks} sorts.')
+            clicks += 1
             self.hand.click_from_screen(self.eye, "Item")
-            for i in range(len(order_line_items)):
-                pydirectinput.press('up')
-            pydirectinput.press('down')
+            self.pacer.press('navigate', 'up', len(order_line_items), expected_reactions=0)
+            self.pacer.press('navigate', 'down')
+
+    def sort_items_from_grid(self, order_line_items:"pd.DataFrame", max_clicks:int = 3) -> bool:
+        """
+        This method OCRs the line item grid, works out from the order of its rows how many
+        clicks on the "Item" filter button it takes to bring the first selectable item to
+        the top, and clicks once at a time. After each click it waits for the grid to redraw
+        and reads it again, so the plan is checked against the order the grid actually
+        ended up in before clicking again. It then moves down to the item's row and checks
+        the highlighted row once at the end. It returns whether the first selectable item 
+        ended up highlighted.
+
+        Parameters:
+          - order_line_items (DataFrame): each individual order's worth of items. 
+          - max_clicks: the most times to click the "Item" filter button
+        """
+
+        first_item_shorthand = order_line_items.iloc[0]["Product Code"][-5:]
+        window_rect = self.wmgr.get_window_rect()
+
+        self.eye.get_screen_grab_data(window_rect)
+        header_box = self.eye.find_word("Item")
+        rows = self.eye.read_grid_column("Item")
+
+        for clicks_done in range(max_clicks + 1):
+            sort_plan = plan_sort_clicks(rows, first_item_shorthand)
+            if header_box is None or sort_plan is None:
+                print(f'Could not plan the sort for "{first_item_shorthand}" from the grid.')
+                return False
+
+            clicks, row_index = sort_plan
+            if clicks == 0:
+                break
+            if clicks_done == max_clicks:
+                # Out of clicks, so going to the item's row in the order the grid shows now
+                row_index = next(i for i, row in enumerate(rows) if first_item_shorthand in row)
+                break
+            print(f'Sorting with {clicks} more clicks, then moving down to row {row_index + 1}.')
+
+            # Clicking once and waiting for the grid to redraw before reading its new order
+            previous_rows = rows
+            def grid_redrawn() -> bool:
+                nonlocal rows
+                self.eye.get_screen_grab_data(window_rect)
+                rows = self.eye.read_grid_column("Item")
+                return rows != previous_rows
+
+            self.hand.click_box(header_box)
+            if not wait_until(grid_redrawn, region=window_rect, timeout=5, max_checks=3,
+                              check_now=False, settle_time=0.1, capture=self.capture):
+                print("The grid didn't change after clicking the \"Item\" filter button.")
+
+        # Reset the cursor to the top of the list of items (i.e. the row of headers),
+        # then move down to the row the item should be in
+        self.pacer.press('navigate', 'up', max(len(rows), len(order_line_items))+5, expected_reactions=0)
+        self.pacer.press('navigate', 'down', row_index+1)
+
+        color_bbox = self.eye.find_highlight_on_screen(self.wmgr)
+        if color_bbox is None:
+            return False
+        return self.eye.check_highlighted_item(self.wmgr, color_bbox, first_item_shorthand)
 
     def select_next_item(self) -> None:
         """
@@ -219,22 +600,89 @@ class Selector:
         the item.
         """
 
-        pydirectinput.press("enter", 2, 0.5)
+        self.pacer.press('select', "enter", 2)
         self.check_date_span()
         self.change_ship_qty()
-        pydirectinput.press("enter", 1, 0.5)
+        self.pacer.press('select', "enter")
+        self.record_state('selected')
 
     def close_order(self) -> None:
         """
         This method searches for the cancel button, presses it, and then
-        confirms the cancellation.
+        confirms the cancellation. It raises StepFailed if either button can't be found,
+        so the order isn't recorded as closed.
+        """
+
+        self.click_reference_image('CANCEL_BTN', confidence=0.5, required=True)
+        self.click_reference_image('YES_BTN', confidence=0.5, required=True)
+        self.record_state('closed')
+        self.metrics.end_order()
+
+    def reset_to_order_prompt(self) -> bool:
+        """
+        This method tries to bring the Order Entry app back to the order number prompt
+        after a step failed partway through an order: it escapes out of any dialog, and
+        cancels the order if it is still open. It returns whether the app ended up back
+        at the prompt, i.e. the Order Entry window is open and no line item grid shows.
+        """
+
+        self.pacer.press('dialog', 'esc', 3, expected_reactions=0)
+        if self.click_reference_image('CANCEL_BTN', confidence=0.5, timeout=3, required=False):
+            self.click_reference_image('YES_BTN', confidence=0.5, timeout=3, required=False)
+
+        if not self.wait_for_window(".*Order Entry.*", timeout=10):
+            return False
+        self.wmgr.set_foreground()
+        return not self.look_for("Item", self.wmgr.get_window_rect())
+
+    def record_state(self, state:str) -> None:
+        """
+        This method records that the current order has reached a state in the Selector's
+        journal, if it has one.
+
+        Parameters:
+          - state: one of 'opened', 'sorted', 'selected' or 'closed'
+        """
+
+        self.recorder.record('note', order=self.current_order, state=state)
+        if self.journal is not None and self.current_order is not None:
+            self.journal.record(self.current_order, state)
+
+    @timed_method('click_reference_image')
+    def click_reference_image(self, name:str, confidence:float = 0.7, timeout:float = 10,
+                              required:bool = True) -> bool:
+        """
+        This method waits for one of the reference images to appear inside the active window 
+        (or on the whole screen if there is no active window) and clicks its center. It returns
+        whether the image was found, and raises StepFailed if it wasn't and it was required.
+
+        Parameters:
+          - name: the name of the reference image in the Selector's TemplateMatcher
+          - confidence: the lowest match score (0 to 1) that counts as found
+          - timeout: how many seconds to wait for the image to appear
+          - required: whether not finding the image should raise StepFailed
         """
 
-        cancel_btn_coords = pyautogui.locateCenterOnScreen(CANCEL_BTN, confidence=0.5)
-        pydirectinput.click(cancel_btn_coords.x, cancel_btn_coords.y)
+        region = self.wmgr.get_window_rect() if self.wmgr.has_window() else None
 
-        yes_btn_coords = pyautogui.locateCenterOnScreen(YES_BTN, confidence=0.5)
-        pydirectinput.click(yes_btn_coords.x, yes_btn_coords.y)
+        match = None
+        def template_found() -> bool:
+            nonlocal match
+            match = self.matcher.find_on_screen([name], region=region, confidence=confidence)[name]
+            return match is not None
+
+        wait_until(template_found, region=region, timeout=timeout, settle_time=0.1, capture=self.capture)
+
+        if match is None:
+            print(f"I couldn't find {name} on the screen.")
+            if required:
+                raise StepFailed(f"{name} couldn't be found on the screen.")
+            return False
+
+        print(f"Found {name} with confidence {match.confidence:.2f}.")
+        self.recorder.record('click', x=match.x, y=match.y, target=name)
+        pydirectinput.click(match.x, match.y)
+        return True
     
     def check_date_span(self) -> None:
         """
@@ -242,20 +690,21 @@ class Selector:
         accordingly if it finds it. 
         """
 
-        tries = 0
-        self.eye.get_screen_grab_data()
-        while not (self.eye.can_see("Date") & self.eye.can_see("Span")):
-            if tries >= 3: break
-            self.eye.get_screen_grab_data()
-            tries += 1
+        search_rect = self.get_search_rect()
 
-        if tries == 3: 
+        def date_span_visible() -> bool:
+            self.eye.get_screen_grab_data(rect=search_rect)
+            return self.eye.can_see("Date", refresh=False) and self.eye.can_see("Span", refresh=False)
+
+        # Only OCRing again once the window has changed and settled
+        if not wait_until(date_span_visible, region=search_rect, timeout=6, max_checks=4, 
+                          capture=self.capture): 
+            # The popup often doesn't come up, so not seeing it isn't a reason to slow down
             print("date span not found")
-            pass
         else: 
-            pydirectinput.press("tab", 2, 0.5)
+            self.pacer.press('field', "tab", 2)
             # pydirectinput.write(ship date)
-            pydirectinput.press("enter", 2, 0.5)
+            self.pacer.press('dialog', "enter", 2)
 
     def change_ship_qty(self) -> None:
         """     
@@ -263,59 +712,216 @@ class Selector:
         using keyboard shortcuts
         """
 
-        pydirectinput.press('tab', 3, 0.5)
+        self.pacer.press('field', 'tab', 3)
         #pydirectinput.write(ship qty)
-        pydirectinput.press('enter', 12, 0.5)
+        self.pacer.press('ship qty', 'enter', 12, expected_reactions=1)
 
-    def wait_until_seen(self, target_word:str, rect:tuple = None, max_tries:int = 5) -> bool:
+    def wait_until_seen(self, target_word:str, rect:tuple = None, max_tries:int = 5, 
+                        timeout:Optional[float] = None, back_off:bool = True,
+                        required:bool = False) -> bool:
         """
         This method causes the program to wait while it searches for  
         a given target word to found on the screen or not within a given
-        number of tries.
+        number of tries. After the first search, the word is only searched for
+        again once the search area has changed and settled. 
         
         Parameters:
           - target_word: the word to search for
-          - rect: the rectangle to search in
+          - rect: the rectangle to search in (defaults to the active window, or the 
+                  whole screen if there is no active window)
           - max_tries: the maximum number of times to search for the word
+          - timeout: the most seconds to wait for the word (defaults to 2 seconds per try)
+          - back_off: whether to slow down the last keystrokes if the word isn't found. This
+                      should be False for words that often aren't meant to appear.
+          - required: whether not finding the word should raise StepFailed
         
         Return: True if target_word is found, False if not 
         """
 
+        if timeout is None:
+            timeout = 2 * max_tries
+
         print(f'Beginning search for "{target_word}".')
-        tries = 1
-        self.eye.get_screen_grab_data(rect=rect)
-        while not (self.eye.can_see(target_word)):
-            print("searching for " + target_word + " " + str(tries))
-            if tries >= max_tries: break
-            time.sleep(1)
-            self.eye.get_screen_grab_data(rect=rect)
+        tries = 0
+        def target_word_seen() -> bool:
+            nonlocal tries
             tries += 1
+            if self.look_for(target_word, rect):
+                return True
+            print("searching for " + target_word + " " + str(tries))
+            return False
 
-        if tries == max_tries:
+        with self.metrics.timed(f'wait_until_seen: {target_word}'):
+            seen = wait_until(target_word_seen, region=self.get_search_rect(rect), 
+                              timeout=timeout, max_checks=max_tries, capture=self.capture)
+        self.metrics.count(f'wait_until_seen attempts: {target_word}', tries)
+
+        if seen:
+            print(f'"{target_word}" was found after {tries} tries.')
+            return True
+        else:
             print(f'"{target_word}" was not found on the screen after {tries} tries.')
+            self.recorder.record('note', missed=target_word, tries=tries)
+            # The window may have been moved, so its rectangle is read again next time
+            self.wmgr.invalidate()
+            if back_off:
+                self.pacer.back_off()
+            if required:
+                raise StepFailed(f'"{target_word}" was not found on the screen.')
             return False
-        else:
-            print(f'"{target_word}" was found after {tries} tries.')
+
+    @timed_method('wait_for_window')
+    def wait_for_window(self, wildcard:str, timeout:float = 60) -> bool:
+        """
+        This method waits for a window whose title matches the wildcard regular expression
+        to open, checking more and more slowly until the timeout. It returns whether the 
+        window was found.
+
+        Parameters:
+          - wildcard: the regular expression the window title should match
+          - timeout: the most seconds to wait for the window
+        """
+
+        def window_found() -> bool:
+            self.wmgr.find_window_wildcard(wildcard)
+            return self.wmgr.has_window()
+
+        if poll(window_found, timeout=timeout):
             return True
+
+        print(f'No window matching "{wildcard}" opened after {timeout} seconds.')
+        return False
+
+    def look_for(self, target_word:str, rect:tuple = None) -> bool:
+        """
+        This method does a single search for target_word. It first OCRs only the padded
+        area where the RoiMap last saw the word and falls back to the whole search area 
+        on a miss. Wherever the word is found is remembered for the next search.
+
+        Parameters:
+          - target_word: the word to search for
+          - rect: the rectangle to search in (defaults to the active window, or the 
+                  whole screen if there is no active window)
+        """
+
+        search_rect = self.get_search_rect(rect)
+
+        roi = self.roi_map.plan(target_word, search_rect)
+        if roi is not None:
+            self.eye.get_screen_grab_data(rect=roi)
+            if self.eye.can_see(target_word, refresh=False):
+                return True
+
+        self.eye.get_screen_grab_data(rect=search_rect)
+        word_box = self.eye.find_word(target_word)
+        if word_box is None:
+            return False
+
+        self.roi_map.learn(target_word, word_box, search_rect)
+        return True
+
+    def get_search_rect(self, rect:tuple = None) -> tuple:
+        """
+        This method returns the rectangle that a full search should cover: rect if it
+        is given, otherwise the active window, otherwise the whole screen.
+
+        Parameters:
+          - rect: the rectangle requested by the caller, if any
+        """
+
+        if rect is not None:
+            return rect
+        if self.wmgr.has_window():
+            return self.wmgr.get_window_rect()
+        screen_width, screen_height = self.capture.size()
+        return (0, 0, screen_width, screen_height)
         
     def check_if_already_selected(self) -> bool:
-        return self.wait_until_seen("Warning", rect=self.wmgr.get_window_rect())
+        return self.wait_until_seen("Warning", rect=self.wmgr.get_window_rect(), back_off=False)
+
+def plan_sort_clicks(rows:list[str], target:str, max_clicks:int = 2) -> tuple[int] | None:
+    """
+    This function plans how to bring the row containing target to the top of a grid that
+    is sorted by clicking its column header. Clicking the header of an unsorted column 
+    is assumed to sort it ascending, and each click after that flips the direction. The
+    assumption isn't always right, so callers should click once at a time and plan again
+    from the order the grid shows after each click. It returns a tuple
+    of (header clicks, index of the target row after those clicks), preferring plans that
+    put the target in the first row, or None if no row contains target.
+
+    Parameters:
+      - rows: the text of the column in each row of the grid, top to bottom
+      - target: the text the target row contains
+      - max_clicks: the most header clicks to plan for
+    """
+
+    ascending = sorted(rows)
+    descending = sorted(rows, reverse=True)
+
+    # Working out which way the column is sorted now
+    if rows == ascending:
+        direction = 'ascending'
+    elif rows == descending:
+        direction = 'descending'
+    else:
+        direction = None
+
+    best_plan = None
+    order = rows
+    for clicks in range(max_clicks + 1):
+        if clicks > 0:
+            direction = 'descending' if direction == 'ascending' else 'ascending'
+            order = ascending if direction == 'ascending' else descending
+
+        matching_rows = [i for i, row in enumerate(order) if target in row]
+        if not matching_rows:
+            return None
+        if best_plan is None or matching_rows[0] < best_plan[1]:
+            best_plan = (clicks, matching_rows[0])
+        if best_plan[1] == 0:
+            break
+
+    return best_plan
 
 class Eye:
     """
     A class to keep track of what pytesseract is seeing. The constructor 
     initializes the tesseract_cmd variable with the appropriate path.
     It has the following attributes:
-      - view: an Image that shows the latest screenshot the Eye has analyzed
+      - view: an Image that shows the latest screenshot the Eye has analyzed, after preprocessing
+      - raw_view: the latest screenshot as it was grabbed from the screen
       - data: a DataFrame that shows the latest OCR data from view. 
+      - origin: the screen coordinates of the top left corner of view
+      - scale: how much view was upscaled from the screen before OCR
+      - preprocessor: the Preprocessor that prepares each grab for OCR
+      - tiled: whether large views are split into tiles that are OCR'd in parallel
+      - tile_size: the width and height of each tile, in upscaled pixels
+      - capture: the CaptureBackend the screen is grabbed with
+      - recorder: an optional FlightRecorder that each grab and its OCR data are kept in
+      - metrics: an optional Metrics object that the Eye's actions are timed in
     """
 
-    def __init__(self, view:Optional[tuple] = None, data:Optional["pd.DataFrame"] = None):
+    def __init__(self, view:Optional[tuple] = None, data:Optional["pd.DataFrame"] = None, 
+                 tiled:bool = False, tile_size:int = 1280, 
+                 preprocessor:Optional["Preprocessor"] = None, 
+                 capture:Optional["CaptureBackend"] = None, 
+                 recorder:Optional["FlightRecorder"] = None, 
+                 metrics:Optional["Metrics"] = None):
         pytesseract.pytesseract.tesseract_cmd = 'C:\\Users\\levi.banks\\AppData\\Local\\Programs\\Tesseract-OCR\\tesseract.exe'
         self.view = view
+        self.raw_view = view
         self.data = data
-
-    def get_screen_grab_data(self, rect:tuple = None) -> None:
+        self.origin = (0, 0)
+        self.scale = 1
+        self.preprocessor = preprocessor if preprocessor is not None else Preprocessor()
+        self.tiled = tiled
+        self.tile_size = tile_size
+        self.capture = capture if capture is not None else get_default_capture()
+        self.recorder = recorder
+        self.metrics = metrics
+
+    @timed_method('get_screen_grab_data')
+    def get_screen_grab_data(self, rect:tuple = None, text_height:Optional[float] = None) -> None:
         """
         This method takes a screenshot and does some processing on it to then analyze
         it using pytesseract. The Eye updates its data attribute with the DataFrame created
@@ -323,38 +929,116 @@ class Eye:
         #
         Parameters:
           - rect: the coordinates of the area to be analyzed. 
+          - text_height: the expected height in screen pixels of the text being looked for,
+                         which the preprocessor uses to choose how much to upscale the grab
         """
 
-        screengrab = pyautogui.screenshot(imageFilename=r"C:\Users\levi.banks\OneDrive - Providence St. Joseph Health\Python Projects\stealth_pod_import\view.png", region = rect)
-        new_size = tuple(2*x for x in screengrab.size)
-        screengrab = screengrab.resize(new_size, PIL.Image.Resampling.LANCZOS)
-        screengrab.save(r"C:\Users\levi.banks\OneDrive - Providence St. Joseph Health\Python Projects\stealth_pod_import\view.png")
-        self.view = screengrab.copy()
-
-        data = pytesseract.image_to_data(screengrab)
+        screengrab = self.capture.grab(rect)
+        self.raw_view = screengrab
+        self.origin = (rect[0], rect[1]) if rect else (0, 0)
+        if self.recorder is not None:
+            self.recorder.record_frame(screengrab, self.origin)
 
-        with open(r'C:\Users\levi.banks\OneDrive - Providence St. Joseph Health\Python Projects\stealth_pod_import\data.tsv', 'w', newline='') as tsvfile:
-            tsvfile.truncate(0)
-            tsvfile.write(data)
+        screengrab, self.scale = self.preprocessor.process(screengrab, text_height)
+        self.view = screengrab
 
-        with open(r'C:\Users\levi.banks\OneDrive - Providence St. Joseph Health\Python Projects\stealth_pod_import\data.tsv', 'rb') as tsvfile:
-            data = pd.read_csv(r'C:\Users\levi.banks\OneDrive - Providence St. Joseph Health\Python Projects\stealth_pod_import\data.tsv', delimiter='\t', na_values=-1, encoding='unicode_escape', on_bad_lines="skip", quoting=csv.QUOTE_NONE)
+        # Splitting large grabs (like a maximized window) into tiles that are OCR'd on all cores
+        if self.tiled and max(screengrab.size) > self.tile_size:
+            self.data = ocr_image_tiled(screengrab, tile_size=self.tile_size)
+        else:
+            self.data = parse_ocr_data(pytesseract.image_to_data(screengrab))
 
-        self.data = data
+        # Keeping the grab and what was read from it in memory, in case the run fails. 
+        # They used to be written to view.png and data.tsv on every grab.
+        if self.recorder is not None:
+            self.recorder.record_ocr(self.data, self.scale)
 
-    def can_see(self, target_word:str) -> bool:
+    @timed_method('can_see')
+    def can_see(self, target_word:str, refresh:bool = True) -> bool:
         """
         This method verifies whether a given word is found in the data attribute
         of the Eye object.
         
         Parameters:
           - target_word: the word to search for
+          - refresh: whether to take a new full screen grab first, or to check the 
+                     data from the latest grab
         """
 
-        self.get_screen_grab_data()
+        if refresh:
+            self.get_screen_grab_data()
         word_is_visible = not self.data[self.data['text'] == target_word].empty
         return word_is_visible
+
+    def find_word(self, target_word:str) -> tuple | None:
+        """
+        This method returns the (left, top, width, height) screen coordinates of the first
+        occurrence of target_word in the data from the latest grab, or None if it isn't there.
+
+        Parameters:
+          - target_word: the word to search for
+        """
+
+        word_data = self.data[self.data['text'] == target_word]
+        if word_data.empty:
+            return None
+
+        return (
+            self.origin[0] + word_data['left'].values[0] / self.scale,
+            self.origin[1] + word_data['top'].values[0] / self.scale,
+            word_data['width'].values[0] / self.scale,
+            word_data['height'].values[0] / self.scale
+        )
     
+    def read_grid_column(self, header_word:str) -> list[str]:
+        """
+        This method reads one column of a grid from the data of the latest grab. The column
+        runs down from header_word, as wide as the gap to the next header to its right. 
+        It returns the text of the column in each row, top to bottom.
+
+        Parameters:
+          - header_word: the column's header, e.g. "Item"
+        """
+
+        words = self.data[self.data['text'].notna()].copy()
+        words['text'] = words['text'].astype(str).str.strip()
+        words = words[words['text'] != '']
+
+        headers = words[words['text'] == header_word]
+        if headers.empty:
+            return []
+        header = headers.iloc[0]
+
+        # Finding where the next column starts from the other headers on the same line
+        header_line = words[(words['top'] - header['top']).abs() < header['height'] / 2]
+        next_headers = header_line[header_line['left'] > header['left'] + header['width']]
+        column_right = next_headers['left'].min() if not next_headers.empty else float('inf')
+        column_left = header['left'] - header['height']
+
+        # Keeping the words under the header whose centers are inside the column
+        centers = words['left'] + words['width'] / 2
+        cells = words[(words['top'] > header['top'] + header['height'] / 2) &
+                      (centers >= column_left) & (centers < column_right)]
+        cells = cells.sort_values(['top', 'left'])
+
+        # Grouping the words into rows by how far apart they are vertically
+        rows = []
+        row_top = None
+        row_words = []
+        for _, word in cells.iterrows():
+            if row_top is not None and word['top'] - row_top > 0.6 * header['height']:
+                rows.append(' '.join(row_words))
+                row_words = []
+                row_top = None
+            if row_top is None:
+                row_top = word['top']
+            row_words.append(word['text'])
+        if row_words:
+            rows.append(' '.join(row_words))
+
+        return rows
+
+    @timed_method('find_highlight_on_screen')
     def find_highlight_on_screen(self, 
                                  wmgr:"WindowMgr", 
                                  color:tuple = (51, 153, 255), 
@@ -376,17 +1060,21 @@ class Eye:
         
         window_coords = (window_rect[0], window_rect[1])
 
+        # Looking at the grab as it was on screen, since preprocessing may have 
+        # dropped the colors and changed the scale
+        view = self.raw_view.convert('RGB')
+
         # The coordinates to track where the color has been found.
-        left = self.view.width
-        top = self.view.height
+        left = view.width
+        top = view.height
         right = 0
         bottom = 0
         
         # Going through the Eye's view to look for the color pixel by pixel.
         color_found = False
-        for x in range(self.view.width):
-            for y in range(self.view.height):
-                r, g, b = self.view.getpixel((x,y))
+        for x in range(view.width):
+            for y in range(view.height):
+                r, g, b = view.getpixel((x,y))
                 if abs(r - color[0]) <= color_tolerance and \
                    abs(g - color[1]) <= color_tolerance and \
                    abs(b - color[2]) <= color_tolerance:
@@ -472,9 +1160,25 @@ class Eye:
 class Hand():
     """
     A class that simulates some clicking actions done by the Selector class.
+    It has the following attributes:
+      - recorder: an optional FlightRecorder that each click is kept in
+      - metrics: an optional Metrics object that the Hand's actions are timed in
     """
-    def __init__(self):
-        pass
+    def __init__(self, recorder:Optional["FlightRecorder"] = None, 
+                 metrics:Optional["Metrics"] = None):
+        self.recorder = recorder
+        self.metrics = metrics
+
+    def click(self, x:float, y:float) -> None:
+        """
+        This method clicks a point on the screen, recording the click if the Hand has a recorder.
+
+        Parameters:
+            - x, y: the screen coordinates to click
+        """
+        if self.recorder is not None:
+            self.recorder.record('click', x=x, y=y)
+        pyautogui.click(x, y)
 
     def click_active_window(self, wmgr:"WindowMgr") -> None:
         """
@@ -485,8 +1189,19 @@ class Hand():
             - wmgr: WindowMgr object to handle window operations
         """
         window_rect = wmgr.get_window_rect()
-        pyautogui.click(window_rect[0] + 50, window_rect[1] + 55)
+        self.click(window_rect[0] + 50, window_rect[1] + 55)
 
+    def click_box(self, box:tuple) -> None:
+        """
+        This method clicks the center of a (left, top, width, height) box on the screen,
+        like the ones returned by Eye.find_word.
+
+        Parameters:
+            - box: the screen coordinates of the box to click
+        """
+        self.click(box[0] + box[2] / 2, box[1] + box[3] / 2)
+
+    @timed_method('click_from_screen')
     def click_from_screen(self, eye: "Eye", target_word: str, xadj:int = 0, yadj:int = 0) -> None:
         """
         This method clicks a particular word on the screen, taking into account any
@@ -504,11 +1219,14 @@ class Hand():
             eye.get_screen_grab_data()
             tries += 1
 
+        if self.metrics is not None:
+            self.metrics.count(f'click_from_screen retries: {target_word}', tries)
+
         if tries == 3:
             print("I couldn't find that word.")
             return None
         else:
-            pyautogui.click(
-               (eye.data[eye.data['text'] == target_word]['left'].values[0]) / 2 + xadj,
-               (eye.data[eye.data['text'] == target_word]['top'].values[0]) / 2 + yadj
+            self.click(
+               (eye.data[eye.data['text'] == target_word]['left'].values[0]) / eye.scale + xadj,
+               (eye.data[eye.data['text'] == target_word]['top'].values[0]) / eye.scale + yadj
             )
\ No newline at end of file
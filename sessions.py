@@ -0,0 +1,127 @@
+# Keeps the cookies of a Cardinal login between runs, so a run can pick up the last run's
+# session instead of logging in and waiting on a two-factor code again.
+
+import json
+import os
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.remote.webdriver import WebDriver
+import constants
+
+DEFAULT_SESSION_PATH = os.path.join(os.path.expanduser('~'), '.cardinal_session.json')
+
+class SessionStore:
+    """
+    A class that saves a logged in browser's cookies to a file, and puts them back into a new
+    browser on the next run. The cookies are not encrypted: the file is made readable by the
+    user only where the file system supports it, but on Windows that permission has no
+    effect, so the file is only as private as the user's folder. A saved session is checked
+    without the browser first (its age and the cookies' expiry dates), and then by opening
+    the POD search page with it, which is the first page a run needs anyway. A full login is
+    only needed when that page sends the browser back to the login page.
+    It has the following attributes:
+      - path: the file the session is saved in
+      - max_age: how many seconds a saved session is trusted for before it is thrown away
+    """
+
+    def __init__(self, path:str = DEFAULT_SESSION_PATH, max_age:float = 12 * 60 * 60):
+        self.path = path
+        self.max_age = max_age
+
+    def save(self, driver:"WebDriver") -> None:
+        """
+        This method saves the browser's cookies. The file is written with permissions for
+        the user only and swapped in whole, so a crash never leaves half a session behind.
+
+        Parameters:
+            - driver: the browser that is logged in
+        """
+
+        session = {'saved_at': time.time(), 'cookies': driver.get_cookies()}
+        temporary_path = self.path + '.tmp'
+        file_descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(file_descriptor, 'w') as session_file:
+            json.dump(session, session_file)
+        os.replace(temporary_path, self.path)
+
+    def load(self) -> Optional[list[dict]]:
+        """
+        This method returns the saved cookies that haven't expired, or None if there is no
+        saved session, it is older than max_age, or all of its cookies have expired.
+        """
+
+        try:
+            with open(self.path) as session_file:
+                session = json.load(session_file)
+        except (OSError, ValueError):
+            return None
+
+        now = time.time()
+        if now - session.get('saved_at', 0) > self.max_age:
+            return None
+
+        cookies = [cookie for cookie in session.get('cookies', []) if cookie.get('expiry', now + 1) > now]
+        return cookies or None
+
+    def has_session(self) -> bool:
+        """
+        This method returns whether there is a saved session worth trying, without opening
+        a browser.
+        """
+
+        return self.load() is not None
+
+    def restore(self, driver:"WebDriver") -> bool:
+        """
+        This method puts the saved cookies into the browser and returns whether the browser
+        is logged in with them. A session that doesn't work anymore is deleted.
+
+        Parameters:
+            - driver: the browser to restore the session into
+        """
+
+        cookies = self.load()
+        if cookies is None:
+            return False
+
+        if apply_cookies(driver, cookies):
+            return True
+
+        self.clear()
+        return False
+
+    def clear(self) -> None:
+        """
+        This method deletes the saved session.
+        """
+
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+def apply_cookies(driver:"WebDriver", cookies:list[dict]) -> bool:
+    """
+    This function puts a Cardinal session's cookies into a browser and returns whether the
+    browser can open the POD search page with them, i.e. whether the session is logged in.
+
+    Parameters:
+        - driver: the browser to put the cookies into
+        - cookies: the cookies, as WebDriver.get_cookies returns them
+    """
+
+    # Cookies can only be added for the site the browser is on, so it opens the site first
+    parts = urlsplit(constants.POD_SEARCH)
+    driver.get(f'{parts.scheme}://{parts.netloc}/')
+    for cookie in cookies:
+        try:
+            driver.add_cookie(cookie)
+        except WebDriverException:
+            # A cookie for another domain, e.g. the login page's
+            continue
+
+    driver.get(constants.POD_SEARCH)
+    return bool(driver.find_elements(By.ID, 'txtStartDate'))
@@ -3,6 +3,10 @@ from constants import *
 from utils import *
 from reports import *
 from selection import Selector
+from journal import SelectionJournal
+from workers import run_sharded_selection
+from browser_pool import BrowserPool
+from sessions import SessionStore
 
 def main() -> None:
     """
@@ -12,44 +16,120 @@ def main() -> None:
     the user chooses the "select items" setting, it will then call 
     run_selection_script(selectable_items, settings).
     """
-    selectable_items = None
-
     display_intro()
 
     settings = display_settings()
 
-    selectable_items = run_selectables_script(settings)
+    run_scripts(settings)
+
+def run_scripts(settings:dict, driver:Optional["WebDriver"] = None, 
+                downloads_folder:Optional[str] = None) -> "pd.DataFrame":
+    """
+    This function runs the steps chosen in settings: it finds the selectable items, exports
+    them for bulk import if chosen, and selects the rest, with as many Selectors at once as
+    the 'selection sessions' setting (or SELECTION_SESSIONS) asks for. It returns the 
+    selectable items. 
+
+    Parameters:
+        - settings: the dictionary of settings chosen by the user.
+        - driver: a WebDriver that is already logged into Cardinal (see run_selectables_script)
+        - downloads_folder: the user's downloads folder (see run_selectables_script)
+    """
+
+    # Ask the user for their downloads folder
+    if downloads_folder is None:
+        downloads_folder = get_downloads_folder()
+
+    selectable_items = run_selectables_script(settings, driver, downloads_folder)
+
+    if selectable_items is not None and settings['bulk export']:
+        selectable_items = run_bulk_export(selectable_items, downloads_folder)
+
+    if selectable_items is not None and not selectable_items.empty:
+        start = time.monotonic()
+        run_selection_script(selectable_items, settings,
+                             settings.get('selection sessions', SELECTION_SESSIONS))
+        if settings['bulk export'] and settings['select items']:
+            gui_seconds = time.monotonic() - start
+            print(f'The Selector handled {len(selectable_items)} rejected lines in {gui_seconds:.1f} seconds '
+                  f'({len(selectable_items) / gui_seconds if gui_seconds else 0:.2f} lines/second).')
 
-    if selectable_items is not None:
-        run_selection_script(selectable_items, settings)
+    return selectable_items
 
-def run_selectables_script(settings:dict) -> "pd.DataFrame":
+def run_bulk_export(selectable_items:"pd.DataFrame", downloads_folder:str) -> "pd.DataFrame":
+    """
+    This function writes every selectable item the bulk import will accept to chunked
+    CSV files in the downloads folder, and returns the rejected items, which are left for
+    the Selector to select in the Order Entry app.
+
+    Parameters:
+        - selectable_items: the list of all selectable line items for the program to address
+        - downloads_folder: the folder to write the CSV files and the rejections to
+    """
+
+    start = time.monotonic()
+    valid, rejected = validate_bulk_selection(selectable_items)
+    paths = export_bulk_selection(valid, downloads_folder)
+    bulk_seconds = time.monotonic() - start
+
+    print(f'Exported {len(valid)} lines on {valid["Order Number"].nunique()} orders to '
+          f'{len(paths)} bulk import files in {bulk_seconds:.2f} seconds '
+          f'({len(valid) / bulk_seconds if bulk_seconds else 0:.0f} lines/second).')
+
+    if not rejected.empty:
+        print(f'{len(rejected)} lines were rejected and will be selected in Order Entry:')
+        print(rejected['Rejection Reason'].value_counts().to_string())
+        rejected.to_excel(os.path.join(downloads_folder, f'{date.today()} Bulk Selection Rejections.xlsx'))
+
+    return rejected.drop(columns='Rejection Reason')
+
+def run_selectables_script(settings:dict, driver:Optional["WebDriver"] = None, 
+                           downloads_folder:Optional[str] = None) -> "pd.DataFrame":
     """
     This function describes the set of steps needed to create a list of selectable items
     based on Cardinal Proof of Delivery (POD) documents and the Open Orders Details report.
 
     Parameters:
         - settings: the dictionary of settings chosen by the user.
+        - driver: a WebDriver that is already logged into Cardinal, e.g. the warm browser of
+                  daemon.py. Without one, a new browser is started and logged in. 
+        - downloads_folder: the user's downloads folder. The user is asked for it if it isn't given.
     """
 
     # Ask the user for their downloads folder
-    downloads_folder = get_downloads_folder()
+    if downloads_folder is None:
+        downloads_folder = get_downloads_folder()
 
-    if settings['cardinal PODs']:
-        # Ask the user for their Cardinal credentials 
-        credentials = get_credentials(first_try=True)
+    # A browser that was passed in is already logged in and stays with its owner
+    warm_browser = driver is not None
+
+    if settings['cardinal PODs'] and not warm_browser:
+        # Ask the user for their Cardinal credentials, unless they chose to stay logged in
+        # and the last run's session can be picked up instead
+        session_store = SessionStore() if settings.get('stay logged in') else None
+        if session_store is not None and session_store.has_session():
+            credentials = None
+        else:
+            credentials = get_credentials(first_try=True)
 
     if settings['open orders report'] or settings['cardinal PODs']:
         # Engage a Selenium WebDriver in a mode that allows web automation 
-        driver = engage_stealth_mode()
+        if not warm_browser:
+            driver = engage_stealth_mode()
+
+        # Saving downloads to the downloads folder and following them as they finish
+        tracker = DownloadTracker(driver, downloads_folder)
+        tracker.enable()
 
     if settings['open orders report']:
         # Go to the Open Orders Details Report viewer page and get the report,
         # downloading it as an Excel file
+        download_mark = tracker.mark()
         get_open_orders_report(driver)
 
-        # Checking to make sure the user has fully downloaded the file
-        keep_download_check()
+        # Waiting for the file to be fully downloaded
+        for report in tracker.wait_for_downloads(since=download_mark):
+            print(f'Downloaded the Open Orders Details Report to {report.path}.')
 
     if settings['cardinal PODs'] or settings['find selectables']:
         # Getting the list of sorted files from newest to oldest and 
@@ -59,16 +139,30 @@ def run_selectables_script(settings:dict) -> "pd.DataFrame":
 
     if settings['cardinal PODs']:
         # Log into Cardinal and repeat the credentialing process if needed
-        successful_login = cardinal_login(driver, credentials)
-        while successful_login == False:
-            credentials = get_credentials(first_try=False)
-            successful_login = cardinal_login(driver, credentials)
-
-        # Get all POD PDF documents from the last 7 days
-        get_PODs(driver, pap_pin_df)
-
-        # Log out of Cardinal when done
-        cardinal_log_out(driver)
+        if not warm_browser:
+            successful_login = cardinal_login(driver, credentials, session_store)
+            while successful_login == False:
+                credentials = get_credentials(first_try=credentials is None)
+                successful_login = cardinal_login(driver, credentials, session_store)
+
+        # Get all POD PDF documents from the last 7 days, with direct requests when the 
+        # endpoints behind the POD search page are known, and through the browser otherwise,
+        # with a pool of browsers sharing the login when more than one is allowed
+        if POD_SEARCH_API and POD_DOWNLOAD_API:
+            get_PODs_http(driver, pap_pin_df, downloads_folder)
+        elif POD_BROWSER_SESSIONS > 1:
+            with BrowserPool(driver, downloads_folder, POD_BROWSER_SESSIONS, tracker=tracker) as pool:
+                pool.get_PODs(pap_pin_df)
+        else:
+            get_PODs(driver, pap_pin_df, tracker)
+
+        # Saving the session for the next run if the user chose to stay logged in, so that 
+        # run can skip the login and two-factor authentication, and logging out otherwise
+        if not warm_browser and session_store is not None:
+            session_store.save(driver)
+        elif not warm_browser:
+            SessionStore().clear()
+            cardinal_log_out(driver)
 
     if settings['find selectables'] and settings['cardinal PODs']:
         # Process the POD PDFs into one DataFrame
@@ -94,27 +188,49 @@ def run_selectables_script(settings:dict) -> "pd.DataFrame":
 
     return selectable_items
 
-def run_selection_script(selectable_items:"pd.DataFrame", settings:dict) -> None:
+def run_selection_script(selectable_items:"pd.DataFrame", settings:dict, sessions:int = 1) -> None:
     """
     This function leverages selection.py and the Selector class to automate
     the order selection process. In its current, incomplete form, it only tries
-    to open each order and then immediately close it. 
+    to open each order and then immediately close it. Progress is kept in a journal
+    in the downloads folder, so if the run is restarted on the same day, orders that
+    were already closed are skipped.
 
     Parameters:
         - selectable_items: the list of all selectable line items for the program to address
         - settings: the dictionary of settings chosen by the user.
+        - sessions: how many Selectors to run at once. More than one runs each Selector
+                    on its own Xvfb virtual display (see workers.py).
     """
-    if settings['select items']:
-        selector = Selector()
+    if settings['select items'] and sessions > 1:
+        run_sharded_selection(selectable_items, sessions)
+
+    elif settings['select items']:
+        journal = SelectionJournal(f'{datetime.now().date()} Selection Journal.db')
+        selector = Selector(journal=journal)
 
         selector.open_order_entry()
 
-        for order_number, new_df in selectable_items.groupby(level=0):
+        try:
+            for order_number, new_df in selectable_items.groupby(level=0):
+
+                if journal.is_complete(str(order_number)):
+                    print(f'Order {order_number} was already closed, skipping it.')
+                    continue
+
+                selector.get_order_line_items(str(order_number), new_df.droplevel(0).reset_index())
+                selector.close_order()
 
-            selector.get_order_line_items(str(order_number), new_df.droplevel(0).reset_index())
-            selector.close_order()
+                #print(order_number, ": \n", new_df.droplevel(0).reset_index())
+        except Exception as e:
+            # Saving the last few things the Selector saw and did, to see what went wrong
+            selector.recorder.flush(reason=f'Order {selector.current_order}: {e!r}')
+            raise
 
-            #print(order_number, ": \n", new_df.droplevel(0).reset_index())
+        # Keeping a record of how quickly the Selector ended up typing, and where the time went
+        selector.pacer.save('Selection Pacing.csv')
+        selector.metrics.save('Selection Metrics.json')
+        journal.close()
 
 # Starting the script    
 if __name__ == "__main__":
@@ -0,0 +1,336 @@
+# Gets Cardinal's two-factor authentication codes from a mailbox. Each provider is told when
+# the code was asked for, and only looks at messages that arrived after that with the
+# verification code subject, returning as soon as one shows up.
+
+import email
+import imaplib
+import os
+import re
+import select
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from email.message import Message
+from typing import Optional
+import constants
+
+try:
+    import pythoncom
+    import win32com.client
+except ImportError:
+    # These only exist on Windows, where Outlook is. The other providers work anywhere.
+    pythoncom = None
+    win32com = None
+
+CODE_PATTERN = re.compile(r'\b\d{6}\b')
+
+class CodeProvider(ABC):
+    """
+    The base class of the two-factor code providers. A provider waits for the first message
+    that arrived at or after a timestamp with the verification code subject, and returns the
+    six digit code in it.
+    It has the following attributes:
+      - subject: the text the subject of a code message contains
+      - clock_skew: how many seconds earlier than the timestamp a message can be stamped and
+                    still count, since the mail server's clock may be a little behind
+    """
+
+    def __init__(self, subject:str = constants.TFA_SUBJECT, clock_skew:float = 5):
+        self.subject = subject
+        self.clock_skew = clock_skew
+
+    @abstractmethod
+    def get_code(self, since:float, timeout:float = 300) -> str:
+        """
+        This method waits for a code message that arrived after since and returns its code.
+
+        Parameters:
+            - since: the time.time() the code was asked for
+            - timeout: the most seconds to wait for the message
+        """
+
+    def matches(self, subject:Optional[str], received:float, since:float) -> bool:
+        """
+        This method returns whether a message is a code message that arrived late enough.
+
+        Parameters:
+            - subject: the message's subject
+            - received: when the message arrived, as a time.time() value
+            - since: the time the code was asked for
+        """
+
+        return bool(subject) and self.subject in subject and received >= since - self.clock_skew
+
+def find_code(text:str) -> Optional[str]:
+    """
+    This function returns the first six digit code in text, or None if there isn't one.
+
+    Parameters:
+        - text: the body of a message
+    """
+
+    match = CODE_PATTERN.search(text or '')
+    return match.group(0) if match else None
+
+def get_message_text(message:"Message") -> str:
+    """
+    This function returns the text of an email message: its plain text parts, or its HTML
+    parts with the tags taken out if it has no plain text.
+
+    Parameters:
+        - message: the parsed email message
+    """
+
+    parts = {'text/plain': [], 'text/html': []}
+    for part in message.walk():
+        if part.get_content_type() in parts:
+            payload = part.get_payload(decode=True) or b''
+            parts[part.get_content_type()].append(
+                payload.decode(part.get_content_charset() or 'utf-8', errors='replace')
+            )
+
+    if parts['text/plain']:
+        return '\n'.join(parts['text/plain'])
+    return re.sub(r'<[^>]+>', ' ', '\n'.join(parts['text/html']))
+
+class OutlookCodeProvider(CodeProvider):
+    """
+    A code provider that reads the default Outlook inbox. It is told about new messages by
+    Outlook's ItemAdd event instead of counting the inbox, and only looks through the
+    messages received since the code was asked for.
+    It has the following attributes:
+      - delete: whether to delete the code message once the code is read
+    """
+
+    def __init__(self, subject:str = constants.TFA_SUBJECT, clock_skew:float = 5, delete:bool = True):
+        super().__init__(subject, clock_skew)
+        self.delete = delete
+
+    def get_code(self, since:float, timeout:float = 300) -> str:
+        inbox = win32com.client.Dispatch('Outlook.Application').GetNamespace('MAPI').GetDefaultFolder(6)
+        items = inbox.Items
+        arrived = []
+
+        class ItemEvents:
+            def OnItemAdd(self, item) -> None:
+                arrived.append(item)
+
+        # Keeping a reference to the events object, or Outlook stops sending them
+        events = win32com.client.WithEvents(items, ItemEvents)
+
+        # Checking the messages that came in before the event was hooked up. Outlook's
+        # filters only go down to the minute, so the exact time is checked afterwards.
+        start = datetime.fromtimestamp(since - self.clock_skew - 60).strftime('%m/%d/%Y %I:%M %p')
+        candidates = list(items.Restrict(f"[ReceivedTime] >= '{start}'"))
+
+        deadline = time.monotonic() + timeout
+        while True:
+            for item in candidates:
+                if self.matches(getattr(item, 'Subject', ''), get_received_time(item), since):
+                    code = find_code(item.Body)
+                    if code is not None:
+                        if self.delete:
+                            item.Delete()
+                        return code
+
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'No verification code arrived in Outlook within {timeout} seconds.')
+
+            pythoncom.PumpWaitingMessages()
+            candidates, arrived[:] = list(arrived), []
+            time.sleep(0.05)
+
+def get_received_time(item) -> float:
+    """
+    This function returns when an Outlook item was received, as a time.time() value.
+    pywin32 hands back Outlook's dates as local wall-clock times labelled as UTC, so the
+    label is dropped and the time is read as local time, the same way the Restrict filter
+    in OutlookCodeProvider writes it.
+
+    Parameters:
+        - item: the Outlook mail item
+    """
+
+    return time.mktime(item.ReceivedTime.replace(tzinfo=None).timetuple())
+
+class ImapCodeProvider(CodeProvider):
+    """
+    A code provider that reads a mailbox over IMAP. It searches the folder for code messages
+    from the day the code was asked for, and between searches waits with IMAP IDLE, so the
+    server tells it the moment a message is added.
+    It has the following attributes:
+      - host, port: the IMAP server
+      - username, password: the mailbox's login
+      - folder: the folder to watch
+      - idle_seconds: the longest an IDLE lasts before searching again anyway
+    """
+
+    def __init__(self, host:str, username:str, password:str, port:int = 993, folder:str = 'INBOX',
+                 subject:str = constants.TFA_SUBJECT, clock_skew:float = 5, idle_seconds:float = 30):
+        super().__init__(subject, clock_skew)
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.folder = folder
+        self.idle_seconds = idle_seconds
+
+    def connect(self) -> "imaplib.IMAP4":
+        """
+        This method logs into the mailbox and opens the folder.
+        """
+
+        imap = imaplib.IMAP4_SSL(self.host, self.port)
+        imap.login(self.username, self.password)
+        imap.select(self.folder, readonly=True)
+        return imap
+
+    def get_code(self, since:float, timeout:float = 300) -> str:
+        imap = self.connect()
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                code = self.search(imap, since)
+                if code is not None:
+                    return code
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f'No verification code arrived at {self.host} within {timeout} seconds.')
+                self.idle(imap, min(remaining, self.idle_seconds))
+        finally:
+            try:
+                imap.logout()
+            except (imaplib.IMAP4.error, OSError):
+                pass
+
+    def search(self, imap:"imaplib.IMAP4", since:float) -> Optional[str]:
+        """
+        This method returns the code from the newest code message that arrived after since,
+        or None if there isn't one yet.
+
+        Parameters:
+            - imap: the logged in connection
+            - since: the time the code was asked for
+        """
+
+        day = datetime.fromtimestamp(since - self.clock_skew).strftime('%d-%b-%Y')
+        _, data = imap.search(None, 'SINCE', day, 'SUBJECT', f'"{self.subject}"')
+        for message_id in reversed(data[0].split()):
+            _, fetched = imap.fetch(message_id, '(INTERNALDATE BODY.PEEK[])')
+            received = time.mktime(imaplib.Internaldate2tuple(fetched[0][0]))
+            message = email.message_from_bytes(fetched[0][1])
+            if self.matches(message['Subject'], received, since):
+                code = find_code(get_message_text(message))
+                if code is not None:
+                    return code
+        return None
+
+    def idle(self, imap:"imaplib.IMAP4", seconds:float) -> None:
+        """
+        This method waits with IMAP IDLE until the server reports a change to the folder or
+        seconds have passed.
+
+        Parameters:
+            - imap: the logged in connection
+            - seconds: the most seconds to wait
+        """
+
+        tag = imap._new_tag().decode()
+        imap.send(f'{tag} IDLE\r\n'.encode())
+        if not imap.readline().startswith(b'+'):
+            # The server doesn't do IDLE, so this falls back to searching every few seconds
+            time.sleep(min(seconds, 2))
+            return
+
+        deadline = time.monotonic() + seconds
+        while (remaining := deadline - time.monotonic()) > 0:
+            if not select.select([imap.sock], [], [], remaining)[0]:
+                break
+            line = imap.readline()
+            if b'EXISTS' in line or b'RECENT' in line:
+                break
+
+        imap.send(b'DONE\r\n')
+        while not imap.readline().startswith(tag.encode()):
+            pass
+
+class MaildirCodeProvider(CodeProvider):
+    """
+    A code provider that reads a local Maildir, e.g. one a mail client or fetchmail keeps in
+    sync. It watches the Maildir's new and cur folders, which change whenever a message is
+    delivered, and only reads the messages delivered since the code was asked for.
+    It has the following attributes:
+      - path: the Maildir's folder
+      - check_interval: how many seconds apart the folders are checked for changes
+    """
+
+    def __init__(self, path:str, subject:str = constants.TFA_SUBJECT, clock_skew:float = 5,
+                 check_interval:float = 0.05):
+        super().__init__(subject, clock_skew)
+        self.path = path
+        self.check_interval = check_interval
+
+    def get_code(self, since:float, timeout:float = 300) -> str:
+        deadline = time.monotonic() + timeout
+        last_change = None
+
+        while True:
+            change = tuple(os.stat(os.path.join(self.path, sub)).st_mtime_ns for sub in ('new', 'cur'))
+            if change != last_change:
+                last_change = change
+                code = self.search(since)
+                if code is not None:
+                    return code
+
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'No verification code arrived in {self.path} within {timeout} seconds.')
+            time.sleep(self.check_interval)
+
+    def search(self, since:float) -> Optional[str]:
+        """
+        This method returns the code from the newest code message delivered after since,
+        or None if there isn't one yet. Only the files delivered late enough are opened,
+        going by their modification times, which is when Maildir delivery finished.
+
+        Parameters:
+            - since: the time the code was asked for
+        """
+
+        recent = []
+        for sub in ('new', 'cur'):
+            with os.scandir(os.path.join(self.path, sub)) as entries:
+                for entry in entries:
+                    try:
+                        delivered = entry.stat().st_mtime
+                    except FileNotFoundError:
+                        # Moved from new to cur by a mail client while this was reading
+                        continue
+                    if delivered >= since - self.clock_skew:
+                        recent.append((delivered, entry.path))
+
+        for delivered, path in sorted(recent, reverse=True):
+            try:
+                with open(path, 'rb') as message_file:
+                    message = email.message_from_binary_file(message_file)
+            except FileNotFoundError:
+                continue
+            if self.matches(message['Subject'], delivered, since):
+                code = find_code(get_message_text(message))
+                if code is not None:
+                    return code
+        return None
+
+def get_default_code_provider() -> "CodeProvider":
+    """
+    This function returns the code provider set up in constants.py: a Maildir if TFA_MAILDIR
+    is set, an IMAP mailbox if TFA_IMAP_HOST is set (with the password in the
+    TFA_IMAP_PASSWORD environment variable), and Outlook otherwise.
+    """
+
+    if constants.TFA_MAILDIR:
+        return MaildirCodeProvider(constants.TFA_MAILDIR)
+    if constants.TFA_IMAP_HOST:
+        return ImapCodeProvider(constants.TFA_IMAP_HOST, constants.TFA_IMAP_USER,
+                                os.environ.get('TFA_IMAP_PASSWORD', ''))
+    return OutlookCodeProvider()
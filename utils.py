@@ -9,7 +9,7 @@ from selenium.webdriver.remote.webelement import WebElement
 from selenium_stealth import stealth
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
-from selenium.common.exceptions import TimeoutException, NoSuchElementException, NoSuchWindowException, ElementClickInterceptedException
+from selenium.common.exceptions import TimeoutException, NoSuchElementException, NoSuchWindowException, ElementClickInterceptedException, WebDriverException
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 import time
@@ -20,9 +20,15 @@ import constants
 from selenium.webdriver.common.action_chains import ActionChains
 from pathlib import Path
 from zipfile import ZipFile
-import pyautogui
 import pytesseract
-from selection import Selector
+from capture import get_default_capture
+from downloads import DownloadTracker
+from batching import AdaptiveBatcher
+from pod_http import PodHttpClient
+from tfa import CodeProvider, get_default_code_provider
+from dom import check_all_checkboxes, select_checkboxes_by_label, click_twice, \
+                get_checkbox_names, check_checkboxes_by_name, \
+                get_datatable_info, set_datatable_page, set_datatable_page_length, read_page_state
 from typing import Callable, Optional
 
 class Window:
@@ -241,13 +247,17 @@ def display_settings() -> dict:
     if the code has completed the previous steps successfully.
     """
 
-    settings_window = Window(geometry="600x400", title="Settings")
+    settings_window = Window(geometry="600x470", title="Settings")
 
     settings_window.add_label(settings_text)
     settings_window.add_checkbutton("open orders report", "Download Open Orders Details Report")
     settings_window.add_checkbutton("cardinal PODs", "Download Cardinal POD documents")
     settings_window.add_checkbutton("find selectables", "Find all selectable items using previous documents")
     settings_window.add_checkbutton("select items", "Select items from 'Selectable Items.xlsx'")
+    settings_window.add_checkbutton("bulk export", "Export items for bulk import, only selecting rejected items", 
+                                    default=False)
+    settings_window.add_checkbutton("stay logged in", "Stay logged into Cardinal between runs (keeps the\n"
+                                    "session cookies unencrypted in your user folder)", default=False)
 
     settings_window.add_button("Submit", settings_window.close_window)
 
@@ -347,6 +357,11 @@ def engage_stealth_mode() -> "WebDriver":
     options.add_argument("--start-maximized")
     options.add_experimental_option("excludeSwitches", ["enable-automation"])
     options.add_experimental_option("useAutomationExtension", False)
+
+    # Letting downloads through without the "Keep" prompt, and logging DevTools events so 
+    # that a DownloadTracker can follow downloads
+    options.add_argument("--disable-features=InsecureDownloadWarnings")
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
     driver = webdriver.Chrome(options=options)
 
     stealth(driver,
@@ -377,24 +392,21 @@ def wait_for_element(driver:"WebDriver", identifier:str, by:str, wait_time:int =
     if by == 'id':
         return wait.until(EC.visibility_of_element_located((By.ID, identifier)))
 
-def select_branches(driver:"WebDriver", dropdown_xpath:str, branches:list) -> None:
+def select_branches(driver:"WebDriver", dropdown_xpath:str, branches:list) -> dict:
     """
     This function goes through a list of checkbuttons and selects only the relevant ones
-    based on the content of branches. 
+    based on the content of branches, all in one script run in the page. It returns a 
+    summary of which branches were selected, already selected or missing.
 
     Parameters:
         - driver: the driver controlling the web browser
         - dropdown_xpath: the xpath string for the "branches" dropdown
         - branches: a list of branches that are desired
     """
-    dropdown_menu = driver.find_element(By.XPATH, dropdown_xpath)
-    for element in dropdown_menu.find_elements(By.XPATH, './/*'):
-        label = element.text
-        already_clicked = False
-        for sub_element in element.find_elements(By.XPATH, './/*'):
-            if label in branches and not already_clicked:
-                sub_element.click()
-                already_clicked = sub_element.is_selected()
+    summary = select_checkboxes_by_label(driver, dropdown_xpath, branches)
+    if summary['missing']:
+        print(f"These branches weren't in the dropdown: {', '.join(summary['missing'])}")
+    return summary
 
 def wait_for_element_text_change(driver:"WebDriver", element_xpath:str, 
                                  old_text:str, timeout:int = 300) -> bool:
@@ -446,19 +458,6 @@ def get_open_orders_report(driver:"WebDriver") -> None:
     download_dd_excel = wait_for_element(driver, '//*[@id="ReportViewerControl_ctl05_ctl04_ctl00_Menu"]/div[2]/a', 'xpath')
     download_dd_excel.click()
 
-def keep_download_check() -> None:
-    """
-    This function creates a Selector object to look for the "insecure download" pop-up 
-    that Chrome shows after downloading the report. It then clicks the "Keep" button to
-    save the download appropriately.
-    """
-    selector = Selector()
-
-    while not selector.eye.can_see("Keep"):
-        time.sleep(1)
-
-    selector.hand.click_from_screen(selector.eye, "Keep")
-    
 def get_sorted_files(folder:str) -> list[str]:
     """
     This function takes a path to a folder and returns a list of file paths in that
@@ -509,95 +508,210 @@ def get_open_orders_from_downloads(sorted_files:list[str]) -> "pd.DataFrame":
 
     return open_orders_df  
 
-def get_code_from_inbox() -> str:
-    """
-    This function creates a connection to Microsoft Outlook and waits
-    for a two-factor authentication code email to enter the inbox. It then 
-    uses a regular expression to search the email for the code and then returns
-    the code. 
+def get_code_from_inbox(since:Optional[float] = None, provider:Optional["CodeProvider"] = None) -> str:
     """
+    This function waits for a two-factor authentication code email that arrives after since
+    and returns the code in it. The mailbox is read by the provider set up in constants.py
+    (Outlook by default, see tfa.py) unless another provider is given.
 
-    # Establishing a connection with Outlook and finding the inbox
-    outlook = win32com.client.Dispatch('Outlook.Application').GetNamespace("MAPI")
-    inbox = None
-    for folder in outlook.Folders:
-        for subfolder in folder.Folders:
-            subfolder_name = subfolder.Name
-            if subfolder_name == 'Inbox':
-                inbox = subfolder
-
-    # Waiting until we receive the Two-factor authentication email
-    current_num_messages = len(inbox.Items)
-    while len(inbox.Items) == current_num_messages:
-        time.sleep(0.5) 
-
-    # Searching through the messages to find the latest one with 
-    # a verification code from Cardinal
-    message_with_code = None
-    for i, message in enumerate(inbox.Items):
-        subject = message.Subject
-        if ('One-time verification code' in subject):
-            message_with_code = message
+    Parameters:
+        - since: the time.time() the code was asked for. Defaults to now.
+        - provider: the CodeProvider to get the code from
+    """
 
-    # Using a regular expression to search for a string of six numbers
-    code = re.search(r'\d{6,6}', message_with_code.Body).group(0)
-    message_with_code.Delete()
-    return code 
+    if since is None:
+        since = time.time()
+    if provider is None:
+        provider = get_default_code_provider()
+    return provider.get_code(since)
 
-def get_PODs(driver:"WebDriver", df:"pd.DataFrame") -> None:
+def get_PODs(driver:"WebDriver", df:"pd.DataFrame", tracker:Optional["DownloadTracker"] = None) -> None:
     """
     This function goes to the report download page of the vendor's website and 
     searches for/downloads all PODs from all relevant date ranges (calculated by get_date_ranges).
-    It can handle some error pages, but it requires some manual input occasionally if the error page
-    shows up well after the tab has already been open. 
+    The PODs on each page are downloaded in batches sized by an AdaptiveBatcher, so a batch that
+    hits an error page is split up until the documents causing it are found, and those are
+    retried a few times before being given up on. It requires some manual input occasionally 
+    if the error page shows up well after the tab has already been open. 
 
     Parameters:
         - driver: the WebDriver controlling the web browser
         - df: the DataFrame being used to calculate the relevant date ranges
+        - tracker: a DownloadTracker to wait on each page's download with. Without one, 
+                   the function waits for the download tabs to close instead. 
+    """
+
+    batcher = AdaptiveBatcher()
+
+    for min_date, max_date in get_date_ranges(df):
+        get_PODs_for_range(driver, min_date, max_date, batcher, tracker)
+
+    if batcher.failed:
+        print(f"These PODs couldn't be downloaded: {', '.join(batcher.failed)}")
+
+def get_PODs_for_range(driver:"WebDriver", min_date:"date", max_date:"date", 
+                       batcher:"AdaptiveBatcher", tracker:Optional["DownloadTracker"] = None) -> None:
+    """
+    This function searches for the PODs in one date range and downloads every page of them. 
+
+    Parameters:
+        - driver: the WebDriver controlling the web browser
+        - min_date: the earliest date to look for PODs from
+        - max_date: the latest date to look for PODs from
+        - batcher: the AdaptiveBatcher that sizes the download batches
+        - tracker: a DownloadTracker to wait on each page's download with
+    """
+
+    page_list = search_PODs(driver, min_date, max_date)
+    for page_number in page_list:
+        get_PODs_from_page(driver, page_number, batcher, tracker)
+    close_POD_tabs(driver)
+
+def search_PODs(driver:"WebDriver", min_date:"date", max_date:"date") -> list[int]:
+    """
+    This function opens the POD search page, searches for the PODs in a date range, and
+    returns the page numbers of the results. 
+
+    Parameters:
+        - driver: the WebDriver controlling the web browser
+        - min_date: the earliest date to look for PODs from
+        - max_date: the latest date to look for PODs from
+    """
+
+    driver.get(constants.POD_SEARCH)
+
+    set_date_range(driver, min_date, max_date)
+    click_POD_search(driver)
+
+    WebDriverWait(driver, 300).until(EC.visibility_of_element_located((By.XPATH, '//*[@id="divContent"]/div/div[1]/font')))
+
+    # Showing more PODs per page where the site allows it, so there are fewer pages to download
+    set_datatable_page_length(driver, constants.POD_RESULTS_TABLE, constants.POD_PAGE_LENGTH)
+    return get_page_list(driver)
+
+def get_PODs_from_page(driver:"WebDriver", page_number:int, batcher:"AdaptiveBatcher", 
+                       tracker:Optional["DownloadTracker"] = None) -> None:
+    """
+    This function downloads the PODs on one page of the current search results in 
+    adaptive batches.
+
+    Parameters:
+        - driver: the WebDriver controlling the web browser, showing POD search results
+        - page_number: the page of results to download
+        - batcher: the AdaptiveBatcher that sizes the download batches
+        - tracker: a DownloadTracker to wait on each batch's download with
     """
 
     minute_wait = WebDriverWait(driver, 300)
-    seconds_wait = WebDriverWait(driver, 5)
     actions = ActionChains(driver)
 
-    date_ranges = get_date_ranges(df)
+    set_page(driver, page_number)
+    batcher.run(
+        get_checkbox_names(driver, excluded_names=['chkAll']),
+        lambda batch: download_POD_batch(driver, batch, minute_wait, actions, tracker)
+    )
+    print(batcher.report())
 
-    for date_range in date_ranges:
-        min_date = date_range[0]
-        max_date = date_range[1]
+def close_POD_tabs(driver:"WebDriver") -> None:
+    """
+    This function closes the download popup after a date range is done and waits for the
+    download tabs to close.
 
-        driver.get(constants.POD_SEARCH)
+    Parameters:
+        - driver: the WebDriver controlling the web browser
+    """
 
-        set_date_range(driver, min_date, max_date)
-        click_POD_search(driver)
+    driver.switch_to.window(driver.window_handles[0])
+    close_download_popup(driver, ActionChains(driver), timeout=5)
+    WebDriverWait(driver, 300).until(EC.number_of_windows_to_be(1))
+
+def get_PODs_http(driver:"WebDriver", df:"pd.DataFrame", downloads_folder:str, 
+                  max_workers:int = 4) -> None:
+    """
+    This function does what get_PODs does with direct HTTP requests instead of the browser.
+    It reuses the session cookies of the logged in driver to search each date range and
+    download the PODs as zips into the downloads folder, a few batches at a time. 
+
+    Parameters:
+        - driver: the WebDriver that is logged into the vendor's website
+        - df: the DataFrame being used to calculate the relevant date ranges
+        - downloads_folder: the folder to save the zips in
+        - max_workers: how many downloads to run at once
+    """
 
-        minute_wait.until(EC.visibility_of_element_located((By.XPATH, '//*[@id="divContent"]/div/div[1]/font')))
-        page_list = get_page_list(driver)
+    client = PodHttpClient.from_driver(driver, max_workers=max_workers)
 
-        for i in page_list:
-            set_page(driver, i)
-            click_all_PODs(driver)
-            old_handles = set(driver.window_handles)
-            download_selected_PODs(driver)
-            new_handles = set(driver.window_handles)-old_handles
-            minute_wait.until(lambda d: len(new_handles) > 0)
-            new_handle = new_handles.pop()
+    failed = []
+    for min_date, max_date in get_date_ranges(df):
+        checkbox_names = client.search(min_date, max_date)
+        print(f'Found {len(checkbox_names)} PODs from {min_date} to {max_date}.')
+        _, range_failed = client.download_all(checkbox_names, downloads_folder)
+        failed.extend(range_failed)
 
-            while error_page(driver, new_handle):
-                new_handle = restart_download(driver, minute_wait, actions, new_handle)
-            
-            while len(driver.window_handles) > 3:
-                time.sleep(1)
+    if failed:
+        print(f"These PODs couldn't be downloaded: {', '.join(failed)}")
 
+def download_POD_batch(driver:"WebDriver", checkbox_names:list[str], wait:"WebDriverWait", 
+                       actions:"ActionChains", tracker:Optional["DownloadTracker"] = None) -> bool:
+    """
+    This function downloads one batch of PODs from the current page of search results:
+    it selects just the PODs in the batch, downloads them, and checks the download tab for
+    an error page. It returns whether the download went through. A failed download's tab 
+    is closed so the batch can be tried again. 
+
+    Parameters:
+        - driver: the WebDriver controlling the web browser
+        - checkbox_names: the names of the checkboxes of the PODs in the batch
+        - wait: a WebDriverWait object to handle waiting for web elements
+        - actions: an ActionChains object, used to chain together multiple 
+                   WebDriver steps when necessary
+        - tracker: a DownloadTracker to wait on the download with. Without one, the
+                   function waits for the download tab to close instead. 
+    """
+
+    driver.switch_to.window(driver.window_handles[0])
+    close_download_popup(driver, actions)
+
+    # Clearing the selection by checking and unchecking Select All, then selecting the batch
+    click_twice(driver, 'chkAll')
+    check_checkboxes_by_name(driver, checkbox_names)
+
+    download_mark = tracker.mark() if tracker is not None else None
+    old_handles = set(driver.window_handles)
+    download_selected_PODs(driver)
+    wait.until(lambda d: len(set(d.window_handles) - old_handles) > 0)
+    new_handle = (set(driver.window_handles) - old_handles).pop()
+
+    if error_page(driver, new_handle):
+        driver.switch_to.window(new_handle)
+        driver.close()
         driver.switch_to.window(driver.window_handles[0])
-        try:
-            close_popup = seconds_wait.until(EC.element_to_be_clickable((By.XPATH, '//*[@id="Close"]')))
-            actions.move_to_element(close_popup).perform()
-            close_popup.click()
-        except TimeoutException:
-            pass
+        return False
 
-        minute_wait.until(EC.number_of_windows_to_be(1))
+    if tracker is not None:
+        for download in tracker.wait_for_downloads(since=download_mark):
+            print(f'Downloaded {len(checkbox_names)} PODs to {download.path} ({download.bytes:,} bytes).')
+    else:
+        while len(driver.window_handles) > 3:
+            time.sleep(1)
+    return True
+
+def close_download_popup(driver:"WebDriver", actions:"ActionChains", timeout:float = 2) -> None:
+    """
+    This function closes the popup the POD search page shows after a download, if it is open.
+
+    Parameters:
+        - driver: the WebDriver controlling the web browser
+        - actions: an ActionChains object, used to move to the popup's close button
+        - timeout: how many seconds to give the popup to show up
+    """
+
+    try:
+        close_popup = WebDriverWait(driver, timeout).until(EC.element_to_be_clickable((By.XPATH, '//*[@id="Close"]')))
+        actions.move_to_element(close_popup).perform()
+        close_popup.click()
+    except TimeoutException:
+        pass
 
 def get_date_ranges(df:"pd.DataFrame") -> list[tuple["date"]]:
     """
@@ -658,13 +772,18 @@ def click_POD_search(driver:"WebDriver") -> None:
 
 def get_page_list(driver:"WebDriver") -> list[int]:
     """
-    This function looks at the paginate buttons at the top of the POD
-    search results and returns a list of the page numbers. 
+    This function returns a list of the page numbers of the POD search results. It reads
+    the page count from the results table itself, and only falls back to clicking the 
+    paginate buttons at the top of the results if the table can't be read. 
 
     Parameters:
         - driver: the WebDriver controlling the web browser
     """
 
+    table_info = get_datatable_info(driver, constants.POD_RESULTS_TABLE)
+    if table_info is not None:
+        return list(range(1, max(1, table_info['pages']) + 1))
+
     # Finding the first and last page buttons
     first_page_btn = driver.find_element(By.XPATH, '//*[@id="podResults_first"]')
     last_page_btn = driver.find_element(By.XPATH, '//*[@id="podResults_last"]')
@@ -696,8 +815,9 @@ def get_page_list(driver:"WebDriver") -> list[int]:
 
 def set_page(driver:"WebDriver", page_number:int) -> None:
     """
-    This function iteratively clicks through all the paginate buttons until it reaches
-    the target page, identified by page_number.
+    This function jumps straight to the target page, identified by page_number, through the
+    results table. If the table can't be driven directly, it iteratively clicks through all
+    the paginate buttons until it reaches the target page instead.
 
     Parameters:
         - driver: the WebDriver controlling the web browser
@@ -714,9 +834,12 @@ def set_page(driver:"WebDriver", page_number:int) -> None:
     except TimeoutException:
         pass
 
-    select_all_checkbox = wait.until(EC.element_to_be_clickable((By.XPATH, '//*[@id="chkAll"]')))
-    select_all_checkbox.click()
-    select_all_checkbox.click()
+    # Clearing the selection from the last page by checking and unchecking Select All
+    wait.until(EC.element_to_be_clickable((By.XPATH, '//*[@id="chkAll"]')))
+    click_twice(driver, 'chkAll')
+
+    if set_datatable_page(driver, constants.POD_RESULTS_TABLE, page_number - 1):
+        return
 
     while True:
         page_btns_span = driver.find_element(By.XPATH, '//*[@id="podResults_paginate"]/span')
@@ -739,22 +862,17 @@ def set_page(driver:"WebDriver", page_number:int) -> None:
             next_page_btn.click()
             wait.until(EC.staleness_of(page_btns_span))
 
-def click_all_PODs(driver:"WebDriver") -> None:
+def click_all_PODs(driver:"WebDriver") -> dict:
     """
-    This function clicks all the checkboxes on a particular page of documents. 
+    This function clicks all the checkboxes on a particular page of documents, in one
+    script run in the page. It returns a summary counting the checkboxes it checked.
 
     Parameters:
         - driver: the WebDriver controlling the web browser
     """
 
-    # Find all the checkboxes on the page
-    POD_checkboxes = driver.find_elements(By.XPATH, '//input[@type="checkbox"]')        
-    for checkbox in POD_checkboxes:
-
-        # Go down the list and check off each POD 
-        # (avoiding the Select All checkboxes)
-        if 'chkAll' not in checkbox.get_attribute('name'):
-            checkbox.click()
+    # Checking off each POD (avoiding the Select All checkboxes)
+    return check_all_checkboxes(driver, excluded_names=['chkAll'])
 
 def download_selected_PODs(driver:"WebDriver") -> None:
     """
@@ -777,63 +895,71 @@ def download_selected_PODs(driver:"WebDriver") -> None:
     confirm_download_btn = wait.until(EC.visibility_of_element_located((By.XPATH, '//*[@id="yes"]')))
     confirm_download_btn.click()
 
-def error_page(driver:"WebDriver", page_handle:str) -> bool:
+def error_page(driver:"WebDriver", page_handle:str, timeout:float = 10, retries:int = 1,
+               ocr_fallback:bool = True) -> bool:
     """
-    This function checks a particular page for error text using computer vision (pytesseract). 
-    It returns a boolean based on whether it finds an error message or not.
+    This function checks a particular page for error text by reading the page through the
+    driver: its text, its title and the HTTP status it was served with. It returns a boolean
+    based on whether it finds an error or not. A tab that has already closed (because its
+    download finished) isn't an error. A page that is still loading or can't be read is 
+    read again, and if it still can't be read, the screen is checked instead, or it is 
+    counted as an error so the download is tried again. 
 
     Parameters:
         - driver: the WebDriver controlling the web browser
         - page_handle: the string identifying the page in question
+        - timeout: the most seconds to wait for the page to finish loading, each try
+        - retries: how many more times to try reading a page that couldn't be read
+        - ocr_fallback: whether to look at the screen with computer vision (pytesseract), 
+                        like this function used to, if the page can't be read at all
     """
 
-    time.sleep(2)
+    for attempt in range(retries + 1):
+        try:
+            driver.switch_to.window(page_handle)
+            WebDriverWait(driver, timeout, poll_frequency=0.05).until(
+                lambda d: read_page_state(d)['ready_state'] == 'complete'
+            )
+            page = read_page_state(driver)
+            break
+        except NoSuchWindowException:
+            return False
+        except (TimeoutException, WebDriverException):
+            print(f"The download page couldn't be read (try {attempt + 1} of {retries + 1}).")
+    else:
+        if ocr_fallback:
+            return error_page_ocr()
+        return True
 
-    driver.switch_to.window(page_handle)
+    if page['status'] is not None and page['status'] >= 400:
+        print(f"The download page returned HTTP {page['status']}.")
+        return True
+
+    page_text = page['title'] + '\n' + page['text']
+    for error_message in constants.POD_ERROR_MESSAGES:
+        if error_message in page_text:
+            return True
+        
+    return False
+
+def error_page_ocr() -> bool:
+    """
+    This function checks the screen for error text using computer vision (pytesseract). 
+    It is the fallback for error_page when the page can't be read through the driver.
+    """
 
     pytesseract.pytesseract.tesseract_cmd = r'C:\Users\levi.banks\AppData\Local\Programs\Tesseract-OCR\tesseract.exe'
 
-    screengrab = pyautogui.screenshot()
+    screengrab = get_default_capture().grab()
 
     text = pytesseract.image_to_string(screengrab)
 
-    error_messages = [
-        "We are sorry, the (Proof of Delivery) documents",
-        "An error occurred while processing your request"
-    ]
-
-    for error_message in error_messages:
+    for error_message in constants.POD_ERROR_MESSAGES:
         if error_message in text:
             return True
         
     return False
 
-def restart_download(driver:"WebDriver", wait:"WebDriverWait", actions:"ActionChains", handle:str) -> str:
-    """
-    This function triggers when an error message is found. It closes the problem tab, 
-    then goes back to the main download page to start the download over again. It returns 
-    the most recently created handle after the download has been restarted. 
-
-    Parameters:
-        - driver: the WebDriver controlling the web browser
-        - wait: a WebDriverWait object to handle waiting for web elements
-        - actions: an ActionChains object, used to chain together multiple 
-                   WebDriver steps when necessary
-        - handle: the string identifying the page in question
-    """
-
-    driver.switch_to.window(handle)
-    driver.close()
-    driver.switch_to.window(driver.window_handles[0])
-    close_popup = wait.until(EC.element_to_be_clickable((By.XPATH, '//*[@id="Close"]')))
-    actions.move_to_element(close_popup).perform()
-    close_popup.click()
-    old_handles = set(driver.window_handles)
-    download_selected_PODs(driver)
-    new_handles = set(driver.window_handles)-old_handles
-    wait.until(lambda d: len(new_handles) > 0)
-    return new_handles.pop()
-
 def unzip_current_zips(dl_folder:str) -> "Path":
     """
     This function creates a new folder to extract all the recently downloaded
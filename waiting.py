@@ -0,0 +1,148 @@
+# Waiting helpers that follow what is actually happening on screen instead of sleeping
+# for a fixed amount of time.
+
+import time
+import PIL.Image
+import PIL.ImageChops
+import PIL.ImageStat
+from typing import Callable, Optional
+from capture import CaptureBackend, get_default_capture
+
+class FrameWatcher:
+    """
+    A class that watches an area of the screen for changes by comparing tiny grayscale
+    thumbnails of it. Comparing thumbnails costs a screenshot and a few thousand pixels,
+    which is cheap enough to do many times a second, unlike OCR.
+    It has the following attributes:
+      - region: the (x, y, width, height) area of the screen to watch, or None for the whole screen
+      - thumbnail_size: the size each grab is shrunk to before comparing
+      - threshold: how different two thumbnails have to be, as a mean gray level
+                   difference, to count as a change. Averaging over the thumbnail means
+                   small things like a blinking cursor don't count.
+      - capture: the CaptureBackend the region is grabbed with
+      - frame: the thumbnail from the latest grab
+    """
+
+    def __init__(self, region:Optional[tuple] = None, thumbnail_size:tuple = (96, 54),
+                 threshold:float = 1.0, capture:Optional["CaptureBackend"] = None):
+        self.region = region
+        self.thumbnail_size = thumbnail_size
+        self.threshold = threshold
+        self.capture = capture if capture is not None else get_default_capture()
+        self.frame = None
+
+    def grab(self) -> "PIL.Image.Image":
+        """
+        This method grabs the watched region and returns it as a grayscale thumbnail.
+        """
+
+        screengrab = self.capture.grab(self.region)
+        return screengrab.convert('L').resize(self.thumbnail_size, PIL.Image.Resampling.BOX)
+
+    def changed(self) -> bool:
+        """
+        This method grabs a new frame and returns whether it differs from the last one.
+        """
+
+        frame = self.grab()
+        previous, self.frame = self.frame, frame
+        if previous is None:
+            return False
+        difference = PIL.ImageStat.Stat(PIL.ImageChops.difference(previous, frame)).mean[0]
+        return difference > self.threshold
+
+def wait_until(check:Callable[[], bool], region:Optional[tuple] = None, timeout:float = 30,
+               max_checks:Optional[int] = None, check_now:bool = True, settle_time:float = 0.3,
+               min_interval:float = 0.05, max_interval:float = 1.0, recheck_interval:float = 3.0,
+               capture:Optional["CaptureBackend"] = None) -> bool:
+    """
+    This function waits until check returns True, but only runs check (usually an OCR)
+    when the watched region has changed and then stopped changing for settle_time seconds,
+    or when recheck_interval seconds have passed without a check, whether or not the region
+    is still changing. While nothing changes, the time between frame grabs backs off
+    exponentially from min_interval to max_interval. It returns whether check passed
+    before the deadline.
+
+    Parameters:
+        - check: the expensive test to run once the screen settles
+        - region: the (x, y, width, height) area of the screen to watch, or None for the
+                  whole screen
+        - timeout: the hard deadline in seconds
+        - max_checks: the most times check will be run, or None for no limit
+        - check_now: whether to run check once before waiting for any change
+        - settle_time: how long the region has to stay the same after changing before
+                       check is run
+        - min_interval: the shortest time between frame grabs, in seconds
+        - max_interval: the longest time between frame grabs, in seconds
+        - recheck_interval: the longest time between checks, in seconds, or None to only
+                            check once the region settles after a change
+        - capture: the CaptureBackend to grab frames with (defaults to get_default_capture())
+    """
+
+    deadline = time.monotonic() + timeout
+    watcher = FrameWatcher(region, capture=capture)
+    watcher.changed()
+
+    checks = 0
+    if check_now:
+        checks += 1
+        if check():
+            return True
+
+    interval = min_interval
+    last_change = None
+    last_check = time.monotonic()
+    while time.monotonic() < deadline:
+        if max_checks is not None and checks >= max_checks:
+            return False
+
+        time.sleep(max(0, min(interval, deadline - time.monotonic())))
+
+        changed = watcher.changed()
+        if changed:
+            # Polling quickly again so we notice when the screen stops changing
+            last_change = time.monotonic()
+            interval = min_interval
+
+        # Checking once the screen has settled after a change, and also every recheck_interval
+        # seconds whatever the screen does, in case a check missed on a screen that then stayed
+        # the same or one that never stops changing (a spinner, an animation)
+        settled = (not changed and last_change is not None
+                   and time.monotonic() - last_change >= settle_time)
+        overdue = recheck_interval is not None and time.monotonic() - last_check >= recheck_interval
+        if settled or overdue:
+            if settled:
+                last_change = None
+            last_check = time.monotonic()
+            checks += 1
+            if check():
+                return True
+
+        # Backing off while the screen is still, unless we are waiting for it to settle
+        if last_change is None:
+            interval = min(interval * 2, max_interval)
+
+    return False
+
+def poll(predicate:Callable[[], bool], timeout:float = 60, min_interval:float = 0.05,
+         max_interval:float = 2.0) -> bool:
+    """
+    This function calls predicate with exponentially growing gaps until it returns True or
+    the deadline passes, for things that can't be seen on screen, like a window existing.
+    It returns whether predicate passed.
+
+    Parameters:
+        - predicate: the test to run
+        - timeout: the hard deadline in seconds
+        - min_interval: the first gap between calls, in seconds
+        - max_interval: the longest gap between calls, in seconds
+    """
+
+    deadline = time.monotonic() + timeout
+    interval = min_interval
+    while not predicate():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(max(0, min(interval, deadline - time.monotonic())))
+        interval = min(interval * 2, max_interval)
+    return True
@@ -0,0 +1,241 @@
+# Runs several Selectors at once, each on its own virtual display, sharing one queue of
+# orders through the selection journal.
+
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import pandas as pd
+from datetime import datetime
+from typing import Optional
+from journal import SelectionJournal
+from capture import FRAMEBUFFER_ENV_VAR
+
+class VirtualDisplay:
+    """
+    A class that starts an Xvfb virtual X display for a selection worker to drive, and
+    stops it again when it is done. It is used as a context manager:
+
+        with VirtualDisplay(1) as display:
+            ...
+
+    It has the following attributes:
+      - number: the X display number, e.g. 1 for ':1'
+      - size: the (width, height) of the display's screen
+      - framebuffer: whether Xvfb should keep its screen in a memory mapped file, which
+                     XvfbFramebufferCapture can read without going through the X server
+      - fbdir: the temporary folder holding the framebuffer file, while the display runs
+      - process: the running Xvfb process
+    """
+
+    def __init__(self, number:int, size:tuple = (1920, 1080), framebuffer:bool = True):
+        self.number = number
+        self.size = size
+        self.framebuffer = framebuffer
+        self.fbdir = None
+        self.process = None
+
+    @property
+    def name(self) -> str:
+        """
+        The display's name, as it goes in the DISPLAY environment variable.
+        """
+        return f':{self.number}'
+
+    @property
+    def framebuffer_path(self) -> Optional[str]:
+        """
+        The path to the display's framebuffer file, or None if it doesn't have one.
+        """
+        return os.path.join(self.fbdir, 'Xvfb_screen0') if self.fbdir else None
+
+    def start(self, timeout:float = 10) -> None:
+        """
+        This method starts Xvfb and waits for the display to accept connections.
+
+        Parameters:
+            - timeout: how many seconds to wait for the display to come up
+        """
+
+        command = [
+            'Xvfb', self.name,
+            '-screen', '0', f'{self.size[0]}x{self.size[1]}x24',
+            '-nolisten', 'tcp'
+        ]
+        if self.framebuffer:
+            self.fbdir = tempfile.mkdtemp(prefix=f'xvfb{self.number}_')
+            command += ['-fbdir', self.fbdir]
+        self.process = subprocess.Popen(command)
+
+        socket_path = f'/tmp/.X11-unix/X{self.number}'
+        deadline = time.monotonic() + timeout
+        while not os.path.exists(socket_path):
+            if self.process.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError(f'Xvfb could not start display {self.name}.')
+            time.sleep(0.05)
+
+    def stop(self) -> None:
+        """
+        This method stops Xvfb.
+        """
+
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+        if self.fbdir is not None:
+            shutil.rmtree(self.fbdir, ignore_errors=True)
+            self.fbdir = None
+
+    def __enter__(self) -> "VirtualDisplay":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+def run_selection_worker(worker:str, display:str, journal_path:str,
+                         orders:dict, launch_command:Optional[list[str]] = None,
+                         lease_ttl:float = 900, framebuffer_path:Optional[str] = None,
+                         max_attempts:int = 3) -> int:
+    """
+    This function is the body of one selection worker process. It points the process at
+    its own display, opens the Order Entry app there, and then leases orders from the
+    journal and works on them until there are none left. After an order fails, Order
+    Entry is brought back to the order prompt before the next lease, and the worker stops
+    if it can't be. It returns the number of orders it closed.
+
+    Parameters:
+        - worker: the worker's name, used to hold leases in the journal
+        - display: the X display the worker drives, e.g. ':1'
+        - journal_path: the path to the shared selection journal
+        - orders: a dictionary mapping each order number to its line items DataFrame
+        - launch_command: the command that starts the Order Entry app on the display, or
+                          None to open it through Citrix Workspace like a single Selector
+        - lease_ttl: how many seconds each order's lease lasts
+        - framebuffer_path: the display's Xvfb framebuffer file, which the Selector grabs
+                            the screen from if it is given
+        - max_attempts: how many times an order can fail (across all workers) before it is skipped
+    """
+
+    # pyautogui connects to the display when it is imported, so the display has to be
+    # set before the Selector is imported
+    os.environ['DISPLAY'] = display
+    if framebuffer_path is not None:
+        os.environ[FRAMEBUFFER_ENV_VAR] = framebuffer_path
+    from selection import Selector
+
+    journal = SelectionJournal(journal_path)
+    selector = Selector(journal=journal)
+
+    if launch_command is None:
+        selector.open_order_entry()
+    else:
+        subprocess.Popen(launch_command)
+        selector.wait_for_window(".*Order Entry.*", timeout=120)
+        selector.set_selection_mode()
+
+    closed = 0
+    order_number = journal.lease(worker, lease_ttl, max_attempts)
+    while order_number is not None:
+        print(f'{worker} is working on order {order_number}.')
+        try:
+            selector.get_order_line_items(order_number, orders[order_number])
+            journal.renew(order_number, worker, lease_ttl)
+            selector.close_order()
+        except Exception as e:
+            # Handing the order back with the failure counted, so another worker can try it
+            # until it has failed max_attempts times, and moving on to the next order
+            journal.release(order_number, worker, failed=True)
+            selector.recorder.flush(
+                folder=f'{worker} Flight Recording {datetime.now():%Y-%m-%d %H-%M-%S}',
+                reason=f'Order {order_number}: {e!r}'
+            )
+            print(f'{worker} failed on order {order_number}: {e!r}')
+
+            # Getting back to the order prompt before the next order, so one stuck dialog
+            # doesn't make every order after it fail too
+            try:
+                back_at_prompt = selector.reset_to_order_prompt()
+            except Exception as reset_error:
+                print(f'{worker} failed to reset Order Entry: {reset_error!r}')
+                back_at_prompt = False
+            if not back_at_prompt:
+                print(f"{worker} couldn't get Order Entry back to the order prompt, stopping.")
+                break
+        else:
+            closed += 1
+        order_number = journal.lease(worker, lease_ttl, max_attempts)
+
+    selector.pacer.save(f'{worker} Selection Pacing.csv')
+    selector.metrics.save(f'{worker} Selection Metrics.json')
+    journal.close()
+    return closed
+
+def run_sharded_selection(selectable_items:"pd.DataFrame", sessions:int = 2,
+                          journal_path:Optional[str] = None,
+                          launch_command:Optional[list[str]] = None,
+                          first_display:int = 90) -> None:
+    """
+    This function splits the work of run_selection_script across several worker
+    processes, each with its own Xvfb display, window manager and Selector. The orders
+    go into the journal's queue and each worker leases them one at a time, so no order
+    is processed twice and closed orders from an earlier run are skipped. It prints
+    the throughput once every worker is done.
+
+    Parameters:
+        - selectable_items: the list of all selectable line items for the program to address
+        - sessions: how many workers (and displays) to run
+        - journal_path: the path to the selection journal (defaults to today's journal
+                        in the current folder)
+        - launch_command: the command that starts the Order Entry app on each display
+        - first_display: the X display number of the first worker
+    """
+
+    if journal_path is None:
+        journal_path = f'{datetime.now().date()} Selection Journal.db'
+
+    orders = {
+        str(order_number): new_df.droplevel(0).reset_index()
+        for order_number, new_df in selectable_items.groupby(level=0)
+    }
+
+    journal = SelectionJournal(journal_path)
+    journal.enqueue(list(orders))
+    already_closed = len(journal.get_completed() & set(orders))
+
+    displays = [VirtualDisplay(first_display + i) for i in range(sessions)]
+    start = time.monotonic()
+    try:
+        for display in displays:
+            display.start()
+
+        # Spawning fresh processes, since each one has to import pyautogui for its own display
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(sessions) as pool:
+            results = [
+                pool.apply_async(run_selection_worker, (
+                    f'worker {i + 1}', display.name, journal_path, orders, launch_command,
+                    900, display.framebuffer_path
+                ))
+                for i, display in enumerate(displays)
+            ]
+            for i, result in enumerate(results):
+                try:
+                    result.get()
+                except Exception as e:
+                    print(f'worker {i + 1} stopped: {e!r}')
+    finally:
+        for display in displays:
+            display.stop()
+
+    elapsed_minutes = (time.monotonic() - start) / 60
+    closed = len(journal.get_completed() & set(orders)) - already_closed
+    failed = journal.get_failed() & set(orders)
+    journal.close()
+    if failed:
+        print(f"These orders failed too many times and were skipped: {', '.join(sorted(failed))}")
+    print(f'{sessions} sessions closed {closed} orders in {elapsed_minutes:.1f} minutes '
+          f'({closed / elapsed_minutes if elapsed_minutes else 0:.1f} orders/minute).')